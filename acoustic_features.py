@@ -0,0 +1,266 @@
+"""
+音刺激の音響特徴量（色との対応を調べるための説明変数）。
+
+1刺激につき次の値を NumPy の FFT で計算する。
+  - duration_s            : 長さ（秒）
+  - rms_dbfs              : 全体の RMS（dBFS）
+  - centroid_hz           : スペクトル重心（フレームのエネルギーで重み付けした平均）
+  - bandwidth_hz          : スペクトルの広がり（重心まわりの標準偏差、同じ重み付け）
+  - onset_density         : 1秒あたりのオンセット数（スペクトルフラックスのピーク）
+  - pitch_hz              : 基本周波数の推定値（自己相関、有声フレームの中央値。無ければ空）
+  - voiced_ratio          : 有声と判定したフレームの割合
+
+WAV は ingest.read_wav で読む。MP3 などは PATH にある ffmpeg で復号する（packages.txt で入れる。
+Streamlit Community Cloud と .devcontainer はこれを apt で入れる）。復号できない刺激が1つでもあれば
+表を書かずに終了コード 1 で終わる（欠けた表で audioName の結合が黙って空にならないように）。
+結果は内容のハッシュごとに cache/features/<ハッシュ>.json に置き、次回からは変わったファイルだけ計算し直す。
+全刺激の表は audioName 列を持つ CSV に書き出すので、results.csv / color_results.csv と audioName で結合できる。
+
+    python acoustic_features.py [uploads ...] [--workers N] [--out stimulus_features.csv]
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+
+from ingest import read_wav, downmix
+
+FEATURE_CACHE_DIR = Path('cache') / 'features'
+FEATURE_VERSION = 1      # 特徴量の計算を変えたら上げる（キャッシュを作り直す）
+AUDIO_EXTS = ('.wav', '.mp3', '.ogg', '.m4a', '.mp4', '.aac')
+DECODE_RATE = 22050      # ffmpeg で復号する時の周波数
+FRAME = 2048
+HOP = 512
+PITCH_RANGE_HZ = (50.0, 1000.0)
+VOICED_THRESHOLD = 0.5   # 正規化自己相関がこれ以上のフレームを有声とみなす
+ONSET_K = 1.0            # オンセットのしきい値（移動中央値 + ONSET_K × フラックスの標準偏差）
+FEATURE_COLUMNS = ['duration_s', 'rms_dbfs', 'centroid_hz', 'bandwidth_hz',
+                   'onset_density', 'pitch_hz', 'voiced_ratio']
+
+
+# ---------- 復号 ----------
+def decode_audio(path: Path) -> Optional[tuple]:
+    """音声ファイルをモノラルの float32 配列とサンプリング周波数にする。復号できなければ None。"""
+    path = Path(path)
+    if path.suffix.lower() == '.wav':
+        try:
+            samples, rate = read_wav(path.read_bytes())
+            return downmix(samples), rate
+        except ValueError:
+            pass
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return None
+    proc = subprocess.run([ffmpeg, '-v', 'error', '-i', str(path), '-f', 'f32le', '-ac', '1',
+                           '-ar', str(DECODE_RATE), '-'], capture_output=True)
+    if proc.returncode != 0:
+        return None
+    return np.frombuffer(proc.stdout, dtype='<f4').copy(), DECODE_RATE
+
+
+# ---------- 特徴量 ----------
+def _frames(mono: np.ndarray) -> np.ndarray:
+    """
+    HOP ずつずらした FRAME 長のフレームを (フレーム数, FRAME) で返す。
+    先頭には半フレーム分の無音を足し（冒頭の音も窓の中央で捉える）、末尾の半端なフレームは捨てる
+    （無音で埋めると途切れがオンセットに見えるため）。FRAME に満たない信号は無音で埋めた1フレームにする。
+    """
+    padded = np.concatenate([np.zeros(FRAME // 2, dtype=np.float32), mono])
+    if len(padded) < FRAME:
+        padded = np.concatenate([padded, np.zeros(FRAME - len(padded), dtype=np.float32)])
+    n = 1 + (len(padded) - FRAME) // HOP
+    idx = np.arange(FRAME)[None, :] + HOP * np.arange(n)[:, None]
+    return padded[idx]
+
+def _onsets(mag: np.ndarray, rate: int) -> int:
+    """スペクトルフラックスの局所最大のうち、移動中央値を十分上回るものを数える。"""
+    # 先頭フレームも直前を無音として差分を取り、両端に 0 を足して端のピークも拾えるようにする
+    flux = np.maximum(np.diff(np.log1p(mag), axis=0, prepend=0), 0).sum(axis=1)
+    flux = np.concatenate([[0.0], flux, [0.0]])
+    win = max(1, int(0.25 * rate / HOP))
+    padded = np.pad(flux, win, mode='edge')
+    windows = padded[np.arange(len(flux))[:, None] + np.arange(2 * win + 1)[None, :]]
+    threshold = np.median(windows, axis=1) + ONSET_K * flux.std()
+    peak = (flux[1:-1] > flux[:-2]) & (flux[1:-1] >= flux[2:]) & (flux[1:-1] > threshold[1:-1])
+    frames = np.nonzero(peak)[0]
+    # 50ms 以内に続くピークは1つのオンセットとみなす
+    min_gap = max(1, int(0.05 * rate / HOP))
+    count, last = 0, -min_gap
+    for f in frames:
+        if f - last >= min_gap:
+            count += 1
+            last = f
+    return count
+
+def _pitch(frames: np.ndarray, rate: int) -> tuple:
+    """フレームごとの自己相関（FFT）から基本周波数を推定し、(有声フレームの中央値, 有声の割合) を返す。"""
+    lo = max(1, int(rate / PITCH_RANGE_HZ[1]))
+    hi = min(FRAME - 2, int(rate / PITCH_RANGE_HZ[0]))
+    spec = np.fft.rfft(frames, n=2 * FRAME, axis=1)
+    ac = np.fft.irfft(np.abs(spec) ** 2, axis=1)[:, :FRAME]
+    energy = ac[:, 0]
+    active = energy > 1e-8 * FRAME
+    if not active.any() or hi <= lo:
+        return float('nan'), 0.0
+    # 窓の重なりが減る分を補正してから最大値を探す
+    norm = ac[:, lo:hi + 1] / (energy[:, None] + 1e-12) * (FRAME / (FRAME - np.arange(lo, hi + 1)))[None, :]
+    # 周期の整数倍のラグも同じくらい高くなるので、最大値の 9 割に届く最初のラグから
+    # その 1.5 倍までの範囲で最大のものを選ぶ（オクターブ下への誤りを防ぐ）
+    first = np.argmax(norm >= 0.9 * norm.max(axis=1, keepdims=True), axis=1)
+    lags = np.arange(norm.shape[1])[None, :]
+    window = (lags >= first[:, None]) & (lags <= (first + (first + lo) // 2)[:, None])
+    best = np.argmax(np.where(window, norm, -np.inf), axis=1)
+    strength = norm[np.arange(len(norm)), best]
+    voiced = active & (strength >= VOICED_THRESHOLD)
+    if not voiced.any():
+        return float('nan'), 0.0
+    # 放物線補間でラグを小数まで求める
+    lag = best + lo
+    rows = np.nonzero(voiced)[0]
+    l = lag[rows]
+    y0, y1, y2 = ac[rows, l - 1], ac[rows, l], ac[rows, l + 1]
+    denom = y0 - 2 * y1 + y2
+    shift = np.where(np.abs(denom) > 1e-12, 0.5 * (y0 - y2) / np.where(denom == 0, 1, denom), 0.0)
+    f0 = rate / (l + np.clip(shift, -0.5, 0.5))
+    return float(np.median(f0)), float(voiced.sum() / active.sum())
+
+def extract_features(mono: np.ndarray, rate: int) -> Dict:
+    """モノラル信号から特徴量の dict（FEATURE_COLUMNS）を作る。"""
+    mono = np.asarray(mono, dtype=np.float32)
+    duration = len(mono) / rate
+    rms = float(np.sqrt(np.mean(np.square(mono, dtype=np.float64)))) if len(mono) else 0.0
+    frames = _frames(mono)
+    mag = np.abs(np.fft.rfft(frames * np.hanning(FRAME).astype(np.float32), axis=1))
+    freqs = np.fft.rfftfreq(FRAME, 1.0 / rate)
+    power = mag ** 2
+    frame_energy = power.sum(axis=1)
+    voiced_frames = frame_energy > 0
+    if voiced_frames.any():
+        p = power[voiced_frames]
+        e = frame_energy[voiced_frames]
+        centroid = (p @ freqs) / e
+        spread = np.sqrt(np.maximum((p @ freqs ** 2) / e - centroid ** 2, 0))
+        centroid_hz = float(np.average(centroid, weights=e))
+        bandwidth_hz = float(np.average(spread, weights=e))
+    else:
+        centroid_hz = bandwidth_hz = float('nan')
+    pitch_hz, voiced_ratio = _pitch(frames, rate)
+    return {
+        'duration_s': round(duration, 4),
+        'rms_dbfs': round(20 * np.log10(rms), 2) if rms > 0 else float('-inf'),
+        'centroid_hz': round(centroid_hz, 2),
+        'bandwidth_hz': round(bandwidth_hz, 2),
+        'onset_density': round(_onsets(mag, rate) / duration, 4) if duration > 0 else 0.0,
+        'pitch_hz': round(pitch_hz, 2),
+        'voiced_ratio': round(voiced_ratio, 4),
+    }
+
+
+# ---------- キャッシュと一括処理 ----------
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()[:16]
+
+def _sidecar_path(digest: str, cache_dir: Path) -> Path:
+    return Path(cache_dir) / f"{digest}.v{FEATURE_VERSION}.json"
+
+def _compute(job: tuple) -> Optional[Dict]:
+    """プロセスプールで1ファイル分を計算し、サイドカーに書く。復号できなければ None。"""
+    path, digest, cache_dir = job
+    decoded = decode_audio(path)
+    if decoded is None:
+        return None
+    features = extract_features(*decoded)
+    sidecar = _sidecar_path(digest, cache_dir)
+    sidecar.parent.mkdir(parents=True, exist_ok=True)
+    tmp = sidecar.with_name(f".{sidecar.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(features), encoding='utf-8')
+    os.replace(tmp, sidecar)
+    return features
+
+def list_stimuli(dirs: List[Path]) -> List[Path]:
+    """ディレクトリ内の音声ファイル（_check_sound.* を除く）を名前順に返す。"""
+    files = []
+    for d in dirs:
+        d = Path(d)
+        if d.is_dir():
+            files += [p for p in d.iterdir()
+                      if p.is_file() and p.suffix.lower() in AUDIO_EXTS and not p.name.startswith('_check_sound.')]
+    return sorted(files)
+
+def build_feature_table(dirs: List[Path], workers: int = None, cache_dir: Path = FEATURE_CACHE_DIR) -> Dict:
+    """
+    全刺激の特徴量を集めて {'rows', 'computed', 'cached', 'skipped'} を返す。
+    rows は audioName, hash, FEATURE_COLUMNS の dict。同じ名前のファイルが複数のディレクトリにあれば先に渡した方を使う。
+    キャッシュにないハッシュだけをプロセスプールで計算する。
+    """
+    seen, jobs, rows, skipped = set(), [], {}, []
+    cached = 0
+    for path in list_stimuli(dirs):
+        if path.name in seen:
+            continue
+        seen.add(path.name)
+        digest = file_hash(path)
+        sidecar = _sidecar_path(digest, cache_dir)
+        if sidecar.exists():
+            rows[path.name] = {'audioName': path.name, 'hash': digest,
+                               **json.loads(sidecar.read_text(encoding='utf-8'))}
+            cached += 1
+        else:
+            jobs.append((path, digest, cache_dir))
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for (path, digest, _), features in zip(jobs, pool.map(_compute, jobs)):
+                if features is None:
+                    skipped.append(path.name)
+                else:
+                    rows[path.name] = {'audioName': path.name, 'hash': digest, **features}
+    ordered = [rows[name] for name in sorted(rows)]
+    return {'rows': ordered, 'computed': len(jobs) - len(skipped), 'cached': cached, 'skipped': skipped}
+
+def write_feature_table(rows: List[Dict], path: str):
+    header = ['audioName', 'hash'] + FEATURE_COLUMNS
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=header)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: ('' if isinstance(v, float) and np.isnan(v) else v) for k, v in row.items()})
+
+def load_feature_table(path: str = 'stimulus_features.csv') -> Dict[str, np.ndarray]:
+    """特徴量の CSV を列ごとの NumPy 配列として読み込む（数値列は float64、空欄は NaN）。"""
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    out = {key: np.array([r[key] for r in rows], dtype=str) for key in ('audioName', 'hash')}
+    for key in FEATURE_COLUMNS:
+        out[key] = np.array([float(r[key]) if r[key] else np.nan for r in rows], dtype=np.float64)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="音刺激の音響特徴量を計算する")
+    parser.add_argument('dirs', nargs='*', default=['uploads'], help="音声ファイルのディレクトリ（既定: uploads）")
+    parser.add_argument('--workers', type=int, default=None, help="プロセス数（既定: CPU数）")
+    parser.add_argument('--out', default='stimulus_features.csv', help="CSV の出力先")
+    args = parser.parse_args()
+
+    result = build_feature_table(args.dirs, workers=args.workers)
+    if result['skipped']:
+        reason = ("ffmpeg が PATH にありません（packages.txt を参照して入れてください）" if shutil.which('ffmpeg') is None
+                  else "ffmpeg で復号できませんでした")
+        sys.exit(f"{len(result['skipped'])} 件の刺激を復号できないため {args.out} を書きません。{reason}: "
+                 f"{', '.join(result['skipped'])}")
+    if not result['rows']:
+        sys.exit(f"刺激が見つかりません（{', '.join(map(str, args.dirs))}）。{args.out} を書きません。")
+    write_feature_table(result['rows'], args.out)
+    print(f"{len(result['rows'])} 件 → {args.out}（計算 {result['computed']} 件, キャッシュ {result['cached']} 件）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+音声ファイルの長さをヘッダーだけから求める（復号しない）。
+
+MP3:
+  - 先頭の ID3v2 タグを飛ばして最初のフレームヘッダーを読む
+  - Xing / Info ヘッダー（VBR、LAME の CBR）があればフレーム数から、LAME タグがあれば
+    エンコーダーの前後の無音（encoder delay / padding）を引いたサンプル数から求める
+  - VBRI ヘッダー（Fraunhofer）があればそのフレーム数から求める
+  - どちらもなければフレームヘッダーを順にたどってフレーム数を数える（CBR でも VBR でも正確）
+WAV: fmt チャンクの block align と data チャンクの長さから求める（ingest.wav_duration）。
+
+mp3_gain_envelope は各グラニュールのサイド情報の global_gain（量子化の倍率）を読み、
+復号せずにおおよその音量の推移を返す（管理画面の波形サムネイル用）。
+"""
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+import numpy as np
+
+from ingest import wav_duration
+
+# ビットレート（kbps）: [MPEG-1 か][レイヤー] → 表
+_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+_LAYERS = {3: 1, 2: 2, 1: 3}   # ヘッダーのレイヤー欄 → レイヤー番号
+
+
+def _id3v2_size(data: bytes) -> int:
+    """先頭の ID3v2 タグの長さ（なければ 0）。"""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+def parse_frame_header(data: bytes, pos: int) -> Optional[Dict]:
+    """pos の4バイトを MPEG オーディオのフレームヘッダーとして読む。ヘッダーでなければ None。"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    version = (b1 >> 3) & 3            # 3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5, 1: 予約
+    layer_bits = (b1 >> 1) & 3
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    if version == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    layer = _LAYERS[layer_bits]
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or mpeg1) else 576
+        length = (samples // 8) * bitrate // rate + padding
+    return {'mpeg1': mpeg1, 'layer': layer, 'rate': rate, 'samples': samples, 'length': length,
+            'mono': (b3 >> 6) == 3}
+
+def _xing_info(data: bytes, pos: int, header: Dict) -> Optional[Dict]:
+    """最初のフレームの Xing / Info / VBRI ヘッダーから {'frames', 'delay', 'padding'} を読む。"""
+    side = (17 if header['mono'] else 32) if header['mpeg1'] else (9 if header['mono'] else 17)
+    x = pos + 4 + side
+    if data[x:x + 4] in (b'Xing', b'Info'):
+        flags = int.from_bytes(data[x + 4:x + 8], 'big')
+        if not flags & 1:
+            return None
+        frames = int.from_bytes(data[x + 8:x + 12], 'big')
+        offset = x + 8 + 4 + (4 if flags & 2 else 0) + (100 if flags & 4 else 0) + (4 if flags & 8 else 0)
+        delay = padding = 0
+        # LAME タグ: 9 バイトのエンコーダー名の 12 バイト後に delay(12bit) + padding(12bit)
+        if data[offset:offset + 4] in (b'LAME', b'Lavf', b'Lavc'):
+            d = data[offset + 21:offset + 24]
+            if len(d) == 3:
+                delay = (d[0] << 4) | (d[1] >> 4)
+                padding = ((d[1] & 0x0F) << 8) | d[2]
+        return {'frames': frames, 'delay': delay, 'padding': padding}
+    v = pos + 4 + 32
+    if data[v:v + 4] == b'VBRI':
+        return {'frames': int.from_bytes(data[v + 14:v + 18], 'big'), 'delay': 0, 'padding': 0}
+    return None
+
+def _first_frame(data: bytes) -> Tuple[int, Dict]:
+    """最初の正しいフレーム（次のフレームヘッダーも続いているもの）の位置とヘッダー。"""
+    pos = _id3v2_size(data)
+    # 最初の正しいフレーム（次のフレームヘッダーも続いているもの）を探す
+    header = None
+    while pos + 4 <= len(data):
+        header = parse_frame_header(data, pos)
+        if header and header['length'] > 0:
+            nxt = pos + header['length']
+            if nxt + 4 > len(data) or parse_frame_header(data, nxt):
+                break
+        header = None
+        pos += 1
+    if header is None:
+        raise ValueError("MP3 のフレームが見つかりません")
+    return pos, header
+
+def _walk_frames(data: bytes, pos: int) -> Iterator[Tuple[int, Dict]]:
+    """pos から続くフレームを (位置, ヘッダー) で順に返す（末尾の ID3v1 タグの手前まで）。"""
+    end = len(data) - (128 if data[-128:-125] == b'TAG' else 0)
+    while pos + 4 <= end:
+        h = parse_frame_header(data, pos)
+        if h is None or h['length'] <= 0:
+            break
+        yield pos, h
+        pos += h['length']
+
+def mp3_duration(data: bytes) -> float:
+    """MP3 の長さ（秒）。フレームが見つからなければ ValueError。"""
+    pos, header = _first_frame(data)
+    rate, spf = header['rate'], header['samples']
+
+    info = _xing_info(data, pos, header)
+    if info is not None and info['frames'] > 0:
+        samples = info['frames'] * spf - info['delay'] - info['padding']
+        return max(samples, 0) / rate
+
+    frames = sum(1 for _ in _walk_frames(data, pos))
+    return frames * spf / rate
+
+def mp3_gain_envelope(data: bytes) -> Tuple[np.ndarray, float]:
+    """
+    レイヤー3 の各グラニュールの global_gain から音量の推移（相対振幅、最大 1）を作る。
+    (グラニュールごとの値, グラニュールの秒数) を返す。振幅はおおよそ 2^(global_gain / 4) に比例する。
+    """
+    pos, header = _first_frame(data)
+    if header['layer'] != 3:
+        raise ValueError("レイヤー3 の MP3 ではありません")
+    if _xing_info(data, pos, header) is not None:
+        pos += header['length']            # Xing / Info のフレームは音声を含まない
+    gains = []
+    for fpos, h in _walk_frames(data, pos):
+        channels = 1 if h['mono'] else 2
+        granules = 2 if h['mpeg1'] else 1
+        # サイド情報のうち、グラニュール×チャンネルごとの欄が始まるビット位置と1欄の長さ
+        start = (9 + (5 if channels == 1 else 3) + 4 * channels) if h['mpeg1'] else (8 + channels)
+        block = 59 if h['mpeg1'] else 63
+        side = int.from_bytes(data[fpos + 4:fpos + 4 + 32], 'big')
+        total_bits = 32 * 8
+        for gr in range(granules):
+            g = -1     # 符号化されたデータがない（part2_3_length が 0 の）グラニュールは無音
+            for ch in range(channels):
+                bit = start + (gr * channels + ch) * block
+                if (side >> (total_bits - bit - 12)) & 0xFFF:
+                    # global_gain は part2_3_length(12) + big_values(9) の後の 8 ビット
+                    g = max(g, (side >> (total_bits - bit - 21 - 8)) & 0xFF)
+            gains.append(g)
+    if not gains:
+        raise ValueError("MP3 のフレームが見つかりません")
+    gains = np.asarray(gains, dtype=np.float64)
+    coded = gains >= 0
+    if not coded.any():
+        return np.zeros(len(gains)), header['samples'] / (2 if header['mpeg1'] else 1) / header['rate']
+    amp = np.where(coded, np.exp2((gains - gains[coded].max()) / 4), 0.0)
+    return amp, header['samples'] / (2 if header['mpeg1'] else 1) / header['rate']
+
+def probe_duration(data: bytes, name: str) -> Optional[float]:
+    """拡張子に応じてヘッダーから長さ（秒）を求める。対応していない形式や壊れたファイルは None。"""
+    ext = Path(name).suffix.lower()
+    try:
+        if ext == '.wav':
+            return wav_duration(data)
+        if ext == '.mp3':
+            return mp3_duration(data)
+    except (ValueError, IndexError):
+        pass
+    return None
@@ -0,0 +1,53 @@
+"""
+color_tree のバッチ API のベンチマーク。
+
+    python benchmarks/bench_color_tree.py [N]
+
+N 本（既定 1,000,000）のランダムな 8 桁パスについて、paths_to_hsl_batch + hsl_to_hex_batch の
+所要時間を測り、先頭の一部をスカラー版（path_to_hsl_separated + hsl_to_hex）と突き合わせる。
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from color_tree import (FIRST_RADIX, RADIX, N_STEPS, path_to_hsl_separated, hsl_to_hex,
+                        paths_to_hsl_batch, hsl_to_hex_batch)
+
+N_SCALAR = 20_000
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = np.random.default_rng(0)
+    paths = np.empty((n, N_STEPS), dtype=np.int64)
+    paths[:, 0] = rng.integers(0, FIRST_RADIX, n)
+    paths[:, 1:] = rng.integers(0, RADIX, (n, N_STEPS - 1))
+
+    t0 = time.perf_counter()
+    H, S, L = paths_to_hsl_batch(paths)
+    t1 = time.perf_counter()
+    hexes = hsl_to_hex_batch(H, S, L)
+    t2 = time.perf_counter()
+    print(f"batch  N={n:,}: HSL {t1 - t0:.3f}s + hex {t2 - t1:.3f}s = {t2 - t0:.3f}s")
+
+    m = min(n, N_SCALAR)
+    t0 = time.perf_counter()
+    mismatches = 0
+    for i in range(m):
+        hsl = path_to_hsl_separated(paths[i].tolist())
+        hexc = hsl_to_hex(hsl)
+        if (hexc != hexes[i] or hsl['H'] != H[i] or hsl['S'] != S[i] or hsl['L'] != L[i]):
+            mismatches += 1
+    t1 = time.perf_counter()
+    per_row = (t1 - t0) / m
+    print(f"scalar N={m:,}: {t1 - t0:.3f}s（N={n:,} 換算 {per_row * n:.1f}s）")
+    print(f"一致確認: {m:,} 件中 不一致 {mismatches} 件")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
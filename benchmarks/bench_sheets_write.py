@@ -0,0 +1,120 @@
+"""
+結果を Google Sheets に書く3つの方法の比較（fake_sheets の偽物を相手にする。ネットワーク不要）。
+
+    python benchmarks/bench_sheets_write.py [SESSIONS] [ROWS] [THINK_SEC]
+
+SESSIONS 人の参加者が同時に、THINK_SEC 秒おきに ROWS 回ボタンを押して1行ずつ結果を送る。
+  - 同期追記   : 以前の append_to_gsheet（ボタンの処理の中で worksheet + append_row、失敗したら諦める）
+  - 書き込みキュー: sheet_writer（enqueue_row だけしてすぐ戻り、裏のスレッドがまとめて append_rows）
+  - 一括同期   : 実験中は results.db に保存するだけで、終わってから sheets_sync で1回送る
+ボタンの処理が止まる時間、API の呼び出し回数・429 の回数、最後に Sheets に届いた行数を表示する。
+偽物の設定は環境変数 FAKE_GSHEETS（fake_sheets.py を参照）で変えられる。既定は中央値 300ms、60 要求/分、
+2% の 503（その半分は書き込みが反映された後のエラー）。
+"""
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import fake_sheets
+import sheet_writer
+import sheets_sync
+from result_store import new_result_store, insert_row, RESULT_COLUMNS
+
+SHEET = 'results'
+
+
+def make_client() -> fake_sheets.FakeClient:
+    config = fake_sheets.parse_config(os.environ.get(fake_sheets.ENV_VAR, 'fail=0.02,ambiguous=0.5,seed=1'))
+    config['path'] = None
+    return fake_sheets.FakeClient(**config)
+
+def make_row(session: int, trial: int) -> dict:
+    return {'participant_id': f'bench_{session}', 'trial': trial, 'audioName': 'stimulus.mp3',
+            'finalHex': '#336699', 'totalRT_ms': 800, 'practice': False}
+
+def run_sessions(sessions: int, rows: int, think: float, on_click) -> list:
+    """参加者ごとのスレッドで on_click(session, trial) を呼び、1回ごとにかかった秒数を集める。"""
+    waits = []
+    lock = threading.Lock()
+
+    def participant(s):
+        for t in range(1, rows + 1):
+            t0 = time.perf_counter()
+            on_click(s, t)
+            with lock:
+                waits.append(time.perf_counter() - t0)
+            time.sleep(think)
+
+    threads = [threading.Thread(target=participant, args=(s,)) for s in range(sessions)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return waits
+
+def landed(client: fake_sheets.FakeClient) -> int:
+    """Sheets に届いた、重複を除いた行数。"""
+    rows = client.sheets[fake_sheets.FAKE_SHEET_KEY][SHEET][1:]
+    return len({(r[0], r[1]) for r in rows}), len(rows)
+
+def bench_sync_append(sessions, rows, think):
+    client = make_client()
+    sh = client.open_by_key(fake_sheets.FAKE_SHEET_KEY)
+
+    def click(s, t):
+        row = make_row(s, t)
+        try:
+            wks = sh.worksheet(SHEET)
+            wks.append_row([row.get(k, '') for k in RESULT_COLUMNS], value_input_option='USER_ENTERED')
+        except Exception:
+            pass
+    waits = run_sessions(sessions, rows, think, click)
+    return waits, client, 0.0
+
+def bench_write_behind(sessions, rows, think):
+    client = make_client()
+    writer = sheet_writer.new_sheet_writer(lambda: client.open_by_key(fake_sheets.FAKE_SHEET_KEY))
+
+    def click(s, t):
+        row = make_row(s, t)
+        sheet_writer.enqueue_row(writer, SHEET, [row.get(k, '') for k in RESULT_COLUMNS])
+    waits = run_sessions(sessions, rows, think, click)
+    t0 = time.perf_counter()
+    sheet_writer.flush_sheet_writer(writer, 600)
+    return waits, client, time.perf_counter() - t0
+
+def bench_bulk_sync(sessions, rows, think):
+    client = make_client()
+    with tempfile.TemporaryDirectory() as tmp:
+        store = new_result_store(Path(tmp) / 'results.db')
+        waits = run_sessions(sessions, rows, think, lambda s, t: insert_row(store, SHEET, make_row(s, t)))
+        t0 = time.perf_counter()
+        for _ in range(2):         # 2回目は何も送らないことも確かめる
+            sheets_sync.sync(client.open_by_key(fake_sheets.FAKE_SHEET_KEY), store['path'], [SHEET])
+        return waits, client, time.perf_counter() - t0
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    think = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+    print(f"参加者 {sessions} 人 × {rows} 行, {think} 秒おき（送る行 {sessions * rows} 行）")
+    for name, bench in [('同期追記    ', bench_sync_append), ('書き込みキュー', bench_write_behind),
+                        ('一括同期    ', bench_bulk_sync)]:
+        waits, client, tail = bench(sessions, rows, think)
+        waits_ms = sorted(w * 1000 for w in waits)
+        p95 = waits_ms[int(len(waits_ms) * 0.95) - 1]
+        unique, total = landed(client)
+        st = client.stats
+        print(f"{name}: クリックの待ち 中央値 {statistics.median(waits_ms):8.2f} ms, 95% {p95:8.2f} ms | "
+              f"API {st['calls']:4d} 回, 429 {st['quota_errors']:3d} 回, 503 {st['failures']:2d} 回 | "
+              f"届いた行 {unique}/{sessions * rows}（重複 {total - unique}）, 後処理 {tail:.1f} 秒")
+
+
+if __name__ == '__main__':
+    main()
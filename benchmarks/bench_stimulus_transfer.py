@@ -0,0 +1,149 @@
+"""
+音刺激の配信ルートごとの、1試行あたりの転送量のベンチマーク。
+
+    python benchmarks/bench_stimulus_transfer.py [LOOPS]
+
+uploads/ の刺激を static/stimuli/ に置き、同じプロセスで Tornado サーバーを立てて
+  - before: Streamlit の静的配信（app/static/stimuli/<ハッシュ>?v=<ハッシュ>、AppStaticFileHandler）
+  - after : stimulus_server のルート（stimulus/<ハッシュ>）
+の両方に同じ要求の並びを送り、応答のステータス行・ヘッダー・本文のバイト数と要求数を数える。
+
+クライアントは max-age / immutable / ETag / Range を解釈する簡単な HTTP キャッシュとして振る舞う。
+1試行 = 再生（Range: bytes=0-）+ LOOPS 回のループ（同）+ 後半へのシーク。場面は次の5つ。
+  - 初回の試行     : キャッシュが空
+  - 2回目以降      : 同じ刺激がキャッシュにある
+  - ページ再読み込み: キャッシュがある状態で再読み込み（immutable でなければ再検証する）
+  - キャッシュなし  : <audio> がループ・シークのたびに取り直す最悪の場合
+  - キャッシュなし（Web Audio）: 同じく HTTP キャッシュなしで、復号済みの音声でループ・シークする
+                                 （components/audio_player の再生方法。取得は試行の最初の1回だけ）
+"""
+import asyncio
+import http.client
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+from streamlit.web.server.app_static_file_handler import AppStaticFileHandler
+
+from stimuli import new_stimulus_store, new_stimulus_manifest, load_manifest_stimuli
+from stimulus_server import stimulus_routes, ROUTE_URL
+
+SCENARIOS = ['初回の試行', '2回目以降', 'ページ再読み込み', 'キャッシュなし', 'キャッシュなし（Web Audio）']
+
+
+def start_server() -> int:
+    """両方のルートを持つ Tornado サーバーを別スレッドで起動してポート番号を返す。"""
+    ready = threading.Event()
+    port = []
+
+    def run():
+        async def main():
+            app = tornado.web.Application(
+                [(r'/app/static/(.*)', AppStaticFileHandler, {'path': str(Path('static').resolve())})]
+                + stimulus_routes())
+            server = tornado.httpserver.HTTPServer(app)
+            sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+            server.add_sockets(sockets)
+            port.append(sockets[0].getsockname()[1])
+            ready.set()
+            await asyncio.Event().wait()
+        asyncio.run(main())
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return port[0]
+
+
+class CachingClient:
+    """max-age / immutable / ETag / Range を解釈する最小限の HTTP キャッシュ付きクライアント。"""
+
+    def __init__(self, port: int, use_cache: bool = True):
+        self.port = port
+        self.use_cache = use_cache
+        self.cache = {}            # URL → {'etag', 'body', 'immutable', 'expires'}
+        self.requests = 0
+        self.bytes = 0
+
+    def get(self, url: str, start: int = 0, reload: bool = False):
+        entry = self.cache.get(url) if self.use_cache else None
+        if entry and entry['expires'] > time.time() and (not reload or entry['immutable']):
+            return entry['body'][start:]
+        headers = {'Range': f'bytes={start}-'}
+        if entry:
+            headers['If-None-Match'] = entry['etag']
+            headers['If-Range'] = entry['etag']
+        conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        conn.request('GET', '/' + url, headers=headers)
+        res = conn.getresponse()
+        body = res.read()
+        conn.close()
+        self.requests += 1
+        self.bytes += len(f'HTTP/1.1 {res.status} {res.reason}\r\n') + 2 + len(body)
+        self.bytes += sum(len(k) + len(v) + 4 for k, v in res.getheaders())
+        if res.status == 304:
+            return entry['body'][start:]
+        if self.use_cache and res.status == 200:
+            cc = res.getheader('Cache-Control') or ''
+            max_age = int(cc.split('max-age=')[1].split(',')[0]) if 'max-age=' in cc else 0
+            self.cache[url] = {'etag': res.getheader('Etag'), 'body': body,
+                               'immutable': 'immutable' in cc, 'expires': time.time() + max_age}
+        return body
+
+def run_trial(client: CachingClient, url: str, size: int, loops: int):
+    client.get(url)
+    for _ in range(loops):
+        client.get(url)
+    client.get(url, start=size // 2)
+
+def measure(port: int, urls: list, sizes: list, loops: int) -> dict:
+    """場面ごとに (要求数, バイト数) の刺激あたり平均を返す。"""
+    out = {}
+    for scenario in SCENARIOS:
+        requests = total = 0
+        for url, size in zip(urls, sizes):
+            client = CachingClient(port, use_cache=not scenario.startswith('キャッシュなし'))
+            if scenario in ('2回目以降', 'ページ再読み込み'):
+                run_trial(client, url, size, loops)
+            before_req, before_bytes = client.requests, client.bytes
+            if scenario == 'ページ再読み込み':
+                client.get(url, reload=True)
+            elif scenario == 'キャッシュなし（Web Audio）':
+                client.get(url)
+            else:
+                run_trial(client, url, size, loops)
+            requests += client.requests - before_req
+            total += client.bytes - before_bytes
+        out[scenario] = (requests / len(urls), total / len(urls))
+    return out
+
+
+def main():
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    store = new_stimulus_store()
+    ids = load_manifest_stimuli(store, new_stimulus_manifest(Path('uploads')))
+    if not ids:
+        print("uploads/ に音刺激がありません")
+        return
+    entries = [store['entries'][i] for i in ids]
+    sizes = [e['size'] for e in entries]
+    port = start_server()
+    routes = {
+        'before (app/static)': [e['url'] for e in entries],
+        'after  (stimulus/) ': [f"{ROUTE_URL}/{e['file']}" for e in entries],
+    }
+    print(f"刺激 {len(entries)} 件（平均 {sum(sizes) / len(sizes):,.0f} bytes）, ループ {loops} 回 + シーク 1 回 / 試行")
+    results = {name: measure(port, urls, sizes, loops) for name, urls in routes.items()}
+    for scenario in SCENARIOS:
+        print(f"[{scenario}]")
+        for name, res in results.items():
+            req, nbytes = res[scenario]
+            print(f"  {name}: 要求 {req:4.1f} 回, {nbytes:12,.0f} bytes / 試行")
+
+
+if __name__ == '__main__':
+    main()
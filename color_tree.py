@@ -0,0 +1,325 @@
+"""
+段階的色選択（8段階の選択木）の色計算。
+
+path_to_hsl_separated / hsl_to_hex は sc.py から移したもので、計算内容は変えていない。
+build_palette_table は選択木の全ノードの色を一度だけ計算して NumPy 配列に保持する。
+build_collision_index は丸めとクリップで同じ HEX になる葉を同値類にまとめる。
+"""
+from typing import List, Dict
+import numpy as np
+
+N_STEPS = 8
+FIRST_RADIX = 6   # 段階1 の選択肢数
+RADIX = 3         # 段階2〜8 の選択肢数
+N_LEAVES = FIRST_RADIX * RADIX ** (N_STEPS - 1)  # 13,122
+STEP_ATTRIBUTE = ['hue','hue','hue','lightness','lightness','saturation','saturation','final']
+
+# 選択木の色の決め方（パレット方式）。path_to_hsl_separated に直書きされている定数と同じ値。
+# satSteps / lightSteps は stepAttribute で彩度・明度を変える段階（先頭から順）ごとの1選択あたりの変化量。
+# 段階1 の選択肢数は baseHues の数で決まる。
+DEFAULT_SCHEME = {
+    'stepAttribute': STEP_ATTRIBUTE,
+    'baseHues': [0, 60, 120, 180, 240, 300],
+    'hueDeltas': [0, 30, 15, 8, 4, 2, 1, 0.5],
+    'satBase': 70,
+    'lightBase': 50,
+    'satSteps': [25, 15],
+    'lightSteps': [20, 10],
+    'finalStep': {'H': 1.5, 'S': 2, 'L': 1.2},
+    'satRange': [8, 95],
+    'lightRange': [3, 95],
+}
+
+# 名前付きのパレット方式。palette_compiler.py がこれを静的ファイルに書き出す。
+# html_prototype は sc2.html / soundcolor.html の pathToHSL_separated と同じ値。
+PALETTE_SCHEMES = {
+    'sc': DEFAULT_SCHEME,
+    'html_prototype': {
+        'stepAttribute': ['hue','hue','hue','saturation','saturation','lightness','lightness','final'],
+        'baseHues': [0, 120, 240],
+        'hueDeltas': [0, 30, 15, 8, 4, 2, 1, 0.5],
+        'satBase': 70,
+        'lightBase': 50,
+        'satSteps': [18, 8],
+        'lightSteps': [12, 6],
+        'finalStep': {'H': 1.5, 'S': 2, 'L': 1.2},
+        'satRange': [8, 95],
+        'lightRange': [3, 95],
+    },
+}
+
+
+def clamp(v, a, b):
+    return max(a, min(b, v))
+
+def path_to_hsl_separated(path: List[int]):
+    baseHues = [0, 60, 120, 180, 240, 300]
+    hueDeltas = [0, 30, 15, 8, 4, 2, 1, 0.5]
+    satBase = 70
+    lightBase = 50
+    stepAttribute = ['hue','hue','hue','lightness','lightness','saturation','saturation','final']
+    filled = path + [1] * (8 - len(path))
+    H = baseHues[filled[0]] if filled[0] < len(baseHues) else 0
+    S = satBase
+    L = lightBase
+    for i in range(1, 8):
+        m = filled[i] - 1
+        attr = stepAttribute[i]
+        if attr == 'hue':
+            delta = hueDeltas[i] if i < len(hueDeltas) else 5
+            H += m * delta
+        elif attr == 'saturation':
+            satChange = 25 if i == 5 else 15
+            S += m * satChange
+        elif attr == 'lightness':
+            lightChange = 20 if i == 3 else 10
+            L += m * lightChange
+        elif attr == 'final':
+            H += m * 1.5
+            S += m * 2
+            L += m * 1.2
+    H = (H % 360 + 360) % 360
+    S = clamp(round(S), 8, 95)
+    L = clamp(round(L), 3, 95)
+    return {'H': H, 'S': S, 'L': L}
+
+def hsl_to_hex(hsl: Dict[str, float]):
+    h = hsl['H'] / 360.0
+    s = hsl['S'] / 100.0
+    l = hsl['L'] / 100.0
+    def hue2rgb(p, q, t):
+        if t < 0: t += 1
+        if t > 1: t -= 1
+        if t < 1/6: return p + (q - p) * 6 * t
+        if t < 1/2: return q
+        if t < 2/3: return p + (q - p) * (2/3 - t) * 6
+        return p
+    if s == 0:
+        r = g = b = l
+    else:
+        q = l * (1 + s) if l < 0.5 else l + s - l * s
+        p = 2 * l - q
+        r = hue2rgb(p, q, h + 1/3)
+        g = hue2rgb(p, q, h)
+        b = hue2rgb(p, q, h - 1/3)
+    def to_hex(x):
+        return format(int(round(x * 255)), '02x')
+    return f"#{to_hex(r)}{to_hex(g)}{to_hex(b)}"
+
+
+# ---------- バッチ版（NumPy） ----------
+# path_to_hsl_separated / hsl_to_hex と同じ式・同じ演算順序で書いてあり、結果は完全に一致する。
+# （np.round は Python の round と同じく偶数丸め）
+_HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+
+def paths_to_hsl_batch(paths, scheme: Dict = None):
+    """
+    (N, 8) の整数配列（0始まりの桁）から H, S, L の配列を返す。
+    列数が 8 未満なら path_to_hsl_separated と同様に残りを 1 で埋める。
+    scheme を省略すると DEFAULT_SCHEME（= path_to_hsl_separated と同じ定数）を使う。
+    """
+    if scheme is None:
+        scheme = DEFAULT_SCHEME
+    paths = np.asarray(paths, dtype=np.int64)
+    if paths.ndim != 2 or paths.shape[1] > N_STEPS:
+        raise ValueError(f"paths は (N, {N_STEPS}) 以下の2次元配列である必要があります: {paths.shape}")
+    if paths.shape[1] < N_STEPS:
+        pad = np.ones((paths.shape[0], N_STEPS - paths.shape[1]), dtype=np.int64)
+        paths = np.concatenate([paths, pad], axis=1)
+    baseHues = np.asarray(scheme['baseHues'], dtype=np.float64)
+    hueDeltas = scheme['hueDeltas']
+    stepAttribute = scheme.get('stepAttribute', STEP_ATTRIBUTE)
+    satSteps = dict(zip([i for i, a in enumerate(stepAttribute) if a == 'saturation'], scheme['satSteps']))
+    lightSteps = dict(zip([i for i, a in enumerate(stepAttribute) if a == 'lightness'], scheme['lightSteps']))
+    final = scheme['finalStep']
+    first = paths[:, 0]
+    H = np.where(first < len(baseHues), baseHues[np.clip(first, 0, len(baseHues) - 1)], 0.0)
+    S = np.full(len(paths), float(scheme['satBase']))
+    L = np.full(len(paths), float(scheme['lightBase']))
+    for i in range(1, 8):
+        m = paths[:, i] - 1
+        attr = stepAttribute[i]
+        if attr == 'hue':
+            H = H + m * (hueDeltas[i] if i < len(hueDeltas) else 5)
+        elif attr == 'saturation':
+            S = S + m * satSteps[i]
+        elif attr == 'lightness':
+            L = L + m * lightSteps[i]
+        elif attr == 'final':
+            H = H + m * final['H']
+            S = S + m * final['S']
+            L = L + m * final['L']
+    H = (H % 360 + 360) % 360
+    S = np.clip(np.round(S), *scheme['satRange'])
+    L = np.clip(np.round(L), *scheme['lightRange'])
+    return H, S, L
+
+def hsl_to_rgb_batch(H, S, L):
+    """H, S, L の配列から 0xRRGGBB の uint32 配列を返す（hsl_to_hex と同じ丸め）。"""
+    h = np.asarray(H, dtype=np.float64) / 360.0
+    s = np.asarray(S, dtype=np.float64) / 100.0
+    l = np.asarray(L, dtype=np.float64) / 100.0
+    def hue2rgb(p, q, t):
+        t = np.where(t < 0, t + 1, t)
+        t = np.where(t > 1, t - 1, t)
+        return np.select(
+            [t < 1/6, t < 1/2, t < 2/3],
+            [p + (q - p) * 6 * t, q, p + (q - p) * (2/3 - t) * 6],
+            default=p)
+    q = np.where(l < 0.5, l * (1 + s), l + s - l * s)
+    p = 2 * l - q
+    gray = s == 0
+    r = np.where(gray, l, hue2rgb(p, q, h + 1/3))
+    g = np.where(gray, l, hue2rgb(p, q, h))
+    b = np.where(gray, l, hue2rgb(p, q, h - 1/3))
+    def to_byte(x):
+        return np.round(x * 255).astype(np.uint32)
+    return (to_byte(r) << 16) | (to_byte(g) << 8) | to_byte(b)
+
+def rgb_to_hex_batch(rgb):
+    """0xRRGGBB の配列を '#rrggbb' 文字列の配列（dtype 'U7'）にする。"""
+    rgb = np.asarray(rgb, dtype=np.uint32).ravel()
+    nibbles = (rgb[:, None] >> np.arange(20, -1, -4, dtype=np.uint32)) & 0xF
+    chars = np.empty((len(rgb), 7), dtype=np.uint8)
+    chars[:, 0] = ord('#')
+    chars[:, 1:] = _HEX_DIGITS[nibbles]
+    return chars.view('S7').ravel().astype('U7')
+
+def hsl_to_hex_batch(H, S, L):
+    """hsl_to_hex のバッチ版。"""
+    return rgb_to_hex_batch(hsl_to_rgb_batch(H, S, L))
+
+def parse_path_strings(path_strs):
+    """results.csv の path 列（'31223121' のような 1始まりの文字列）を (N, 8) の 0始まり配列にする。"""
+    arr = np.asarray(path_strs, dtype=f'U{N_STEPS}')
+    digits = arr.view(np.uint32).reshape(len(arr), N_STEPS).astype(np.int64) - ord('1')
+    if digits.min(initial=0) < 0 or digits.max(initial=0) >= FIRST_RADIX:
+        raise ValueError("path 列に不正な値が含まれています")
+    return digits
+
+
+# ---------- 選択木の前計算テーブル ----------
+def encode_path(path: List[int]) -> int:
+    """
+    パス（0始まりの桁列、長さ 0〜8）をノード番号に変換する。
+    path_to_hsl_separated と同じく未選択の段階は 1（中央）で埋めるので、
+    途中段階のノードの色は埋めた先の葉の色と一致し、葉の番号をそのままノード番号として使える。
+    """
+    filled = list(path) + [1] * (N_STEPS - len(path))
+    code = filled[0]
+    for d in filled[1:]:
+        code = code * RADIX + d
+    return code
+
+def decode_path(code: int) -> List[int]:
+    """encode_path の逆変換（長さ 8 のパスを返す）。"""
+    digits = []
+    for _ in range(N_STEPS - 1):
+        code, d = divmod(code, RADIX)
+        digits.append(d)
+    digits.append(code)
+    return digits[::-1]
+
+def n_leaves(scheme: Dict = None) -> int:
+    """パレット方式の葉の数（段階1 の選択肢数 × 3^7）。"""
+    first_radix = FIRST_RADIX if scheme is None else len(scheme['baseHues'])
+    return first_radix * RADIX ** (N_STEPS - 1)
+
+def all_leaf_paths(first_radix: int = FIRST_RADIX) -> np.ndarray:
+    """全葉のパスを葉番号順に並べた (葉の数, 8) の配列。"""
+    return decode_paths(np.arange(first_radix * RADIX ** (N_STEPS - 1)))
+
+# 各桁の重み。先頭の桁だけ基数が 6 だが、最上位なので重みは他と同じ式になる
+_PLACE_VALUES = RADIX ** np.arange(N_STEPS - 1, -1, -1)
+
+def encode_paths(paths) -> np.ndarray:
+    """(N, 8) の 0始まりのパス配列をノード番号（uint16）にする。encode_path の一括版。"""
+    paths = np.asarray(paths, dtype=np.int64)
+    if paths.ndim != 2 or paths.shape[1] != N_STEPS:
+        raise ValueError(f"パスは (N, {N_STEPS}) の配列である必要があります: {paths.shape}")
+    return (paths @ _PLACE_VALUES).astype(np.uint16)
+
+def decode_paths(codes) -> np.ndarray:
+    """ノード番号の配列を (N, 8) の 0始まりのパス配列にする。decode_path の一括版。"""
+    codes = np.asarray(codes, dtype=np.int64).ravel()
+    digits = np.empty((len(codes), N_STEPS), dtype=np.int64)
+    for i in range(N_STEPS - 1, 0, -1):
+        codes, digits[:, i] = np.divmod(codes, RADIX)
+    digits[:, 0] = codes
+    return digits
+
+def path_strings_to_codes(path_strs) -> np.ndarray:
+    """path 列（'31223121' のような 1始まりの文字列）をノード番号（uint16）にする。"""
+    return encode_paths(parse_path_strings(path_strs))
+
+def codes_to_path_strings(codes) -> np.ndarray:
+    """ノード番号を path 列と同じ 1始まりの文字列にする。"""
+    chars = (decode_paths(codes) + ord('1')).astype(np.uint32)
+    return np.ascontiguousarray(chars).view(f'U{N_STEPS}').ravel()
+
+def build_palette_table(scheme: Dict = None) -> Dict[str, np.ndarray]:
+    """
+    全 13,122 葉（scheme によって異なる）の色を計算してテーブル（dict of ndarray）にする。
+    H は float32、S/L は uint16、RGB は 0xRRGGBB の uint32 で持つ。
+    """
+    first_radix = FIRST_RADIX if scheme is None else len(scheme['baseHues'])
+    H, S, L = paths_to_hsl_batch(all_leaf_paths(first_radix), scheme)
+    rgb = hsl_to_rgb_batch(H, S, L)
+    table = {
+        'H': H.astype(np.float32), 'S': S.astype(np.uint16), 'L': L.astype(np.uint16),
+        'rgb': rgb, 'hex': rgb_to_hex_batch(rgb),
+    }
+    for arr in table.values():
+        arr.setflags(write=False)
+    return table
+
+def palette_color(table: Dict[str, np.ndarray], path: List[int]) -> Dict:
+    """テーブルからパス（途中段階でもよい）の色を引く。返り値は {'hex','H','S','L'}。"""
+    code = encode_path(path)
+    return {
+        'hex': str(table['hex'][code]),
+        'H': float(table['H'][code]),
+        'S': int(table['S'][code]),
+        'L': int(table['L'][code]),
+    }
+
+def build_collision_index(table: Dict[str, np.ndarray] = None) -> Dict:
+    """
+    同じ HEX になる葉を同値類にまとめた索引。類番号はその類で最小の葉番号の順に振る。
+      'class_of'     : 葉番号 → 類番号
+      'canonical'    : 葉番号 → 同じ類で最小の葉番号（代表）
+      'class_rgb', 'class_hex' : 類番号 → 色
+      'class_starts', 'class_codes' : 類 c の葉番号（昇順）は class_codes[class_starts[c]:class_starts[c+1]]
+      'by_hex'       : HEX → 類番号
+      'n_leaves', 'n_distinct' : 葉の数と、実質的に異なる色の数
+    """
+    if table is None:
+        table = build_palette_table()
+    rgb, first_leaf, inverse = np.unique(table['rgb'], return_index=True, return_inverse=True)
+    perm = np.argsort(first_leaf)
+    class_rgb = rgb[perm]
+    class_of = np.argsort(perm)[inverse.ravel()].astype(np.int32)
+    class_codes = np.argsort(class_of, kind='stable').astype(np.int32)
+    class_starts = np.searchsorted(class_of[class_codes], np.arange(len(class_rgb) + 1)).astype(np.int32)
+    class_hex = rgb_to_hex_batch(class_rgb)
+    index = {
+        'class_of': class_of,
+        'canonical': class_codes[class_starts[class_of]],
+        'class_rgb': class_rgb,
+        'class_hex': class_hex,
+        'class_starts': class_starts,
+        'class_codes': class_codes,
+    }
+    for arr in index.values():
+        arr.setflags(write=False)
+    index['by_hex'] = {h: c for c, h in enumerate(class_hex.tolist())}
+    index['n_leaves'] = len(class_of)
+    index['n_distinct'] = len(class_rgb)
+    return index
+
+def equivalent_codes(index: Dict, hexc: str) -> np.ndarray:
+    """その HEX になる葉番号の一覧（昇順）。どの葉の色でもなければ空。"""
+    c = index['by_hex'].get(hexc.lower())
+    if c is None:
+        return index['class_codes'][:0]
+    return index['class_codes'][index['class_starts'][c]:index['class_starts'][c + 1]]
@@ -0,0 +1,155 @@
+"""
+知覚的な色差計算（段階的選択の finalHex とカラーピッカーの pickedHex の比較用）。
+
+HEX / HSL の配列を線形 sRGB → XYZ(D65) → CIELAB、線形 sRGB → OKLab に変換し、
+ΔE76 / ΔE2000 / ΔEOK を NumPy のブロードキャストでまとめて計算する。
+色の配列は最後の軸が 3 成分の (..., 3) とし、2つの配列の形はブロードキャスト可能であればよい
+（例: (N, 1, 3) と (1, M, 3) で N×M の総当たり）。
+"""
+import numpy as np
+
+from color_tree import hsl_to_rgb_batch
+from hsl_lut import parse_hex_batch
+
+# sRGB (D65) → XYZ
+_SRGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_WHITE_D65 = np.array([0.95047, 1.0, 1.08883])
+
+# 線形 sRGB → LMS → OKLab（Björn Ottosson による定義）
+_SRGB_TO_LMS = np.array([
+    [0.4122214708, 0.5363325363, 0.0514459929],
+    [0.2119034982, 0.6806995451, 0.1073969566],
+    [0.0883024619, 0.2817188376, 0.6299787005],
+])
+_LMS_TO_OKLAB = np.array([
+    [0.2104542553, 0.7936177850, -0.0040720468],
+    [1.9779984951, -2.4285922050, 0.4505937099],
+    [0.0259040371, 0.7827717662, -0.8086757660],
+])
+
+
+# ---------- 変換 ----------
+def rgb_to_srgb(rgb):
+    """0xRRGGBB の配列を 0〜1 の sRGB (..., 3) にする。"""
+    rgb = np.asarray(rgb, dtype=np.uint32)
+    out = np.stack([(rgb >> 16) & 0xFF, (rgb >> 8) & 0xFF, rgb & 0xFF], axis=-1)
+    return out / 255.0
+
+def hex_to_srgb(hex_strs):
+    """'#rrggbb' の配列を 0〜1 の sRGB (N, 3) にする。"""
+    return rgb_to_srgb(parse_hex_batch(hex_strs))
+
+def hsl_to_srgb(H, S, L):
+    """H, S, L の配列を sRGB (N, 3) にする（hsl_to_hex と同じく 8bit に丸めた、実際に表示される色）。"""
+    return rgb_to_srgb(hsl_to_rgb_batch(H, S, L))
+
+def srgb_to_linear(srgb):
+    srgb = np.asarray(srgb, dtype=np.float64)
+    return np.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+
+def linear_to_xyz(lin):
+    return np.asarray(lin, dtype=np.float64) @ _SRGB_TO_XYZ.T
+
+def xyz_to_lab(xyz):
+    t = np.asarray(xyz, dtype=np.float64) / _WHITE_D65
+    delta = 6 / 29
+    f = np.where(t > delta ** 3, np.cbrt(t), t / (3 * delta ** 2) + 4 / 29)
+    L = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+    return np.stack([L, a, b], axis=-1)
+
+def linear_to_oklab(lin):
+    lms = np.cbrt(np.asarray(lin, dtype=np.float64) @ _SRGB_TO_LMS.T)
+    return lms @ _LMS_TO_OKLAB.T
+
+def srgb_to_lab(srgb):
+    return xyz_to_lab(linear_to_xyz(srgb_to_linear(srgb)))
+
+def srgb_to_oklab(srgb):
+    return linear_to_oklab(srgb_to_linear(srgb))
+
+def hex_to_lab(hex_strs):
+    return srgb_to_lab(hex_to_srgb(hex_strs))
+
+def hex_to_oklab(hex_strs):
+    return srgb_to_oklab(hex_to_srgb(hex_strs))
+
+
+# ---------- 色差 ----------
+def delta_e76(lab1, lab2):
+    """CIE76（CIELAB のユークリッド距離）。"""
+    return np.linalg.norm(np.asarray(lab1, dtype=np.float64) - np.asarray(lab2, dtype=np.float64), axis=-1)
+
+def delta_e_ok(oklab1, oklab2):
+    """ΔEOK（OKLab のユークリッド距離）。値は 0〜1 程度のスケール。"""
+    return np.linalg.norm(np.asarray(oklab1, dtype=np.float64) - np.asarray(oklab2, dtype=np.float64), axis=-1)
+
+def delta_e2000(lab1, lab2, kL=1.0, kC=1.0, kH=1.0):
+    """CIEDE2000。Sharma et al. (2005) の実装ノートに従う。"""
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    C1 = np.hypot(a1, b1)
+    C2 = np.hypot(a2, b2)
+    C_bar7 = ((C1 + C2) / 2) ** 7
+    G = 0.5 * (1 - np.sqrt(C_bar7 / (C_bar7 + 25.0 ** 7)))
+    a1p = (1 + G) * a1
+    a2p = (1 + G) * a2
+    C1p = np.hypot(a1p, b1)
+    C2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+
+    dLp = L2 - L1
+    dCp = C2p - C1p
+    chroma_zero = (C1p * C2p) == 0
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180, dhp - 360, np.where(dhp < -180, dhp + 360, dhp))
+    dhp = np.where(chroma_zero, 0.0, dhp)
+    dHp = 2 * np.sqrt(C1p * C2p) * np.sin(np.radians(dhp) / 2)
+
+    Lp_bar = (L1 + L2) / 2
+    Cp_bar = (C1p + C2p) / 2
+    h_sum = h1p + h2p
+    far = np.abs(h1p - h2p) > 180
+    hp_bar = np.where(far, np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2), h_sum / 2)
+    hp_bar = np.where(chroma_zero, h_sum, hp_bar)
+
+    T = (1 - 0.17 * np.cos(np.radians(hp_bar - 30))
+         + 0.24 * np.cos(np.radians(2 * hp_bar))
+         + 0.32 * np.cos(np.radians(3 * hp_bar + 6))
+         - 0.20 * np.cos(np.radians(4 * hp_bar - 63)))
+    d_theta = 30 * np.exp(-(((hp_bar - 275) / 25) ** 2))
+    Cp_bar7 = Cp_bar ** 7
+    R_C = 2 * np.sqrt(Cp_bar7 / (Cp_bar7 + 25.0 ** 7))
+    S_L = 1 + (0.015 * (Lp_bar - 50) ** 2) / np.sqrt(20 + (Lp_bar - 50) ** 2)
+    S_C = 1 + 0.045 * Cp_bar
+    S_H = 1 + 0.015 * Cp_bar * T
+    R_T = -np.sin(np.radians(2 * d_theta)) * R_C
+
+    tL = dLp / (kL * S_L)
+    tC = dCp / (kC * S_C)
+    tH = dHp / (kH * S_H)
+    return np.sqrt(tL ** 2 + tC ** 2 + tH ** 2 + R_T * tC * tH)
+
+def delta_e_hex(hex1, hex2, metric: str = '2000'):
+    """
+    HEX 文字列の配列どうしの色差を要素ごとに返す。
+    metric は '76'（CIELAB ユークリッド）, '2000'（CIEDE2000）, 'ok'（OKLab ユークリッド）。
+    """
+    srgb1, srgb2 = hex_to_srgb(hex1), hex_to_srgb(hex2)
+    if metric == 'ok':
+        return delta_e_ok(srgb_to_oklab(srgb1), srgb_to_oklab(srgb2))
+    lab1, lab2 = srgb_to_lab(srgb1), srgb_to_lab(srgb2)
+    if metric == '76':
+        return delta_e76(lab1, lab2)
+    if metric == '2000':
+        return delta_e2000(lab1, lab2)
+    raise ValueError(f"未知の metric です: {metric}")
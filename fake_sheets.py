@@ -0,0 +1,302 @@
+"""
+Google Sheets の代わりに使う、プロセス内の偽物（負荷試験・ベンチマーク用。ネットワークも認証情報も要らない）。
+
+環境変数 FAKE_GSHEETS を設定すると sc.py の書き込みキューと sheets_sync.py が本物の代わりにこれを使う。
+    FAKE_GSHEETS=1                                   既定の設定
+    FAKE_GSHEETS="latency_ms=300,sigma=0.6,rpm=60,fail=0.02,ambiguous=0.5,seed=1"
+
+  latency_ms : 1回の呼び出しにかかる時間の中央値（ミリ秒）。対数正規分布に従ってばらつく
+  sigma      : その対数正規分布の σ（0 なら毎回 latency_ms）
+  per_row_ms : append_rows で1行増えるごとに足す時間（ミリ秒）
+  rpm        : 1分あたりに受け付ける要求の数。超えた分は 429（クォータ超過）を返す（0 なら無制限）
+  fail       : 要求が 503 で失敗する確率
+  ambiguous  : 失敗のうち、書き込みは反映された後でエラーを返すものの割合（応答だけが失われた場合）
+  seed       : 乱数の種
+  path       : 内容を保存する JSON ファイル（アプリと sheets_sync.py で中身を共有する）。none なら保存しない。
+               複数のプロセスから使えるよう、内容を変える時は <path>.lock をロック（fcntl / msvcrt）した上で
+               ファイルを読み直してから変更して書き戻し、読む時もファイルが変わっていれば読み直す
+
+gspread のうち、このリポジトリで使う部分だけを持つ:
+  Client.open_by_key / Spreadsheet.worksheet, worksheets, add_worksheet, values_batch_get /
+  Worksheet.append_row, append_rows, get_all_values, update
+エラーは本物と同じ gspread.exceptions.APIError（429 / 503）と WorksheetNotFound。
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import gspread
+
+try:
+    import fcntl
+except ImportError:      # Windows
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+from result_store import TABLES
+
+ENV_VAR = 'FAKE_GSHEETS'
+FAKE_SHEET_KEY = 'fake-sheet'
+DEFAULTS = {'latency_ms': 300.0, 'sigma': 0.5, 'per_row_ms': 0.05, 'rpm': 60, 'fail': 0.0,
+            'ambiguous': 0.0, 'seed': None, 'path': str(Path('cache') / 'fake_sheets.json')}
+
+
+def parse_config(spec: str) -> Dict:
+    """FAKE_GSHEETS の値（'1' または 'key=value,...'）を設定にする。"""
+    config = dict(DEFAULTS)
+    spec = (spec or '').strip()
+    if spec.lower() in ('', '1', 'true', 'yes', 'on'):
+        return config
+    for item in spec.split(','):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key not in DEFAULTS:
+            raise ValueError(f"{ENV_VAR} に不明な設定があります: {key}")
+        value = value.strip()
+        if key == 'path':
+            config[key] = None if value.lower() in ('', 'none') else value
+        elif key in ('rpm', 'seed'):
+            config[key] = int(value)
+        else:
+            config[key] = float(value)
+    return config
+
+def client_from_env() -> Optional['FakeClient']:
+    """FAKE_GSHEETS が設定されていれば偽物のクライアント（プロセスに1つ）、なければ None。"""
+    spec = os.environ.get(ENV_VAR)
+    if not spec or spec.strip().lower() in ('0', 'false', 'no', 'off'):
+        return None
+    global _ENV_CLIENT
+    with _ENV_LOCK:
+        if _ENV_CLIENT is None:
+            _ENV_CLIENT = FakeClient(**parse_config(spec))
+        return _ENV_CLIENT
+
+_ENV_CLIENT = None
+_ENV_LOCK = threading.Lock()
+
+
+class _Response:
+    """gspread.exceptions.APIError に渡す、requests.Response の代わり。"""
+
+    def __init__(self, status: int, message: str):
+        self.status_code = status
+        self.text = message
+        self._body = {'error': {'code': status, 'message': message, 'status': 'FAKE'}}
+
+    def json(self):
+        return self._body
+
+
+class FakeClient:
+    """gspread.Client の代わり。設定（遅延・クォータ・失敗）と内容をすべてのスプレッドシートで共有する。"""
+
+    def __init__(self, latency_ms=300.0, sigma=0.5, per_row_ms=0.05, rpm=60, fail=0.0, ambiguous=0.0,
+                 seed=None, path=None):
+        self.latency_ms, self.sigma, self.per_row_ms = latency_ms, sigma, per_row_ms
+        self.rpm, self.fail, self.ambiguous = rpm, fail, ambiguous
+        self.path = Path(path) if path else None
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.recent = deque()           # 直近1分の要求の時刻（クォータ用）
+        self.stats = {'calls': 0, 'quota_errors': 0, 'failures': 0, 'rows_appended': 0}
+        self.sheets = {}                # キー → {ワークシート名 → 行のリスト}
+        self.loaded_stamp = None        # 最後に読み込んだ・書いたファイルの (mtime_ns, size)
+        with self.lock, self._file_lock():
+            self._reload()
+
+    def open_by_key(self, key: str) -> 'FakeSpreadsheet':
+        with self.lock, self._file_lock():
+            self._reload()
+            if key not in self.sheets:
+                # 実験用に用意したスプレッドシートと同じく、各表のワークシートと1行目の列名を置いておく
+                self.sheets[key] = {name: [list(columns)] for name, columns in TABLES.items()}
+                self._save()
+        return FakeSpreadsheet(self, key)
+
+    def _call(self, rows: int = 0, write=None):
+        """
+        1回の API 呼び出しを真似る: 遅延のあと、クォータ超過なら 429、確率 fail で 503 を送出する。
+        write（内容を変える関数）は成功した時と、応答だけが失われる失敗の時に実行する。
+        """
+        with self.lock:
+            delay = self.latency_ms * (self.rng.lognormvariate(0, self.sigma) if self.sigma else 1.0)
+            delay = (delay + self.per_row_ms * rows) / 1000
+            failing = self.rng.random() < self.fail
+            applied = failing and self.rng.random() < self.ambiguous
+        time.sleep(delay)
+        with self.lock:
+            now = time.monotonic()
+            self.stats['calls'] += 1
+            while self.recent and now - self.recent[0] >= 60:
+                self.recent.popleft()
+            if self.rpm and len(self.recent) >= self.rpm:
+                self.stats['quota_errors'] += 1
+                raise gspread.exceptions.APIError(_Response(429, 'Quota exceeded (fake)'))
+            self.recent.append(now)
+            result = None
+            if write is not None and (applied or not failing):
+                # 他のプロセスが書いた分を読み直してから変え、ロックしたまま書き戻す
+                with self._file_lock():
+                    self._reload()
+                    result = write()
+                    self._save()
+            elif write is None:
+                self._reload()
+            if failing:
+                self.stats['failures'] += 1
+                raise gspread.exceptions.APIError(_Response(503, 'The service is currently unavailable (fake)'))
+            return result
+
+    @contextmanager
+    def _file_lock(self):
+        """保存先のファイルをプロセス間で排他する（<path>.lock をロックする。保存しない設定なら何もしない）。"""
+        if self.path is None or (fcntl is None and msvcrt is None):
+            yield
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(self.path.name + '.lock'), 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _stamp(self):
+        try:
+            info = self.path.stat()
+        except OSError:
+            return None
+        return (info.st_mtime_ns, info.st_size)
+
+    def _reload(self):
+        """保存先のファイルが前回読み書きした時から変わっていれば読み直す（self.lock を持って呼ぶ）。"""
+        if self.path is None:
+            return
+        stamp = self._stamp()
+        if stamp is None or stamp == self.loaded_stamp:
+            return
+        self.sheets = json.loads(self.path.read_text(encoding='utf-8'))
+        self.loaded_stamp = stamp
+
+    def _save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self.sheets, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp, self.path)
+        self.loaded_stamp = self._stamp()
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: FakeClient, key: str):
+        self.client, self.id = client, key
+
+    @property
+    def _data(self) -> Dict[str, List[List[str]]]:
+        return self.client.sheets[self.id]
+
+    def worksheet(self, title: str) -> 'FakeWorksheet':
+        self.client._call()
+        if title not in self._data:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return FakeWorksheet(self, title)
+
+    def worksheets(self) -> List['FakeWorksheet']:
+        self.client._call()
+        return [FakeWorksheet(self, t) for t in list(self._data)]
+
+    def add_worksheet(self, title: str, rows: int = 1, cols: int = 1) -> 'FakeWorksheet':
+        def write():
+            self._data.setdefault(title, [])
+        self.client._call(write=write)
+        return FakeWorksheet(self, title)
+
+    def values_batch_get(self, ranges: List[str]) -> Dict:
+        self.client._call()
+        out = []
+        with self.client.lock:
+            for rng in ranges:
+                title, first, last = _parse_range(rng)
+                if title not in self._data:
+                    raise gspread.exceptions.APIError(_Response(400, f'Unable to parse range: {rng}'))
+                values = [row[first:last] for row in self._data[title]]
+                out.append({'range': rng, 'values': [v for v in values if v]})
+        return {'valueRanges': out}
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: FakeSpreadsheet, title: str):
+        self.spreadsheet, self.title = spreadsheet, title
+
+    @property
+    def _rows(self) -> List[List[str]]:
+        return self.spreadsheet._data[self.title]
+
+    def append_rows(self, values, value_input_option=None, table_range=None, **kwargs):
+        rows = [['' if v is None else str(v) for v in row] for row in values]
+
+        def write():
+            self._rows.extend(rows)
+            self.spreadsheet.client.stats['rows_appended'] += len(rows)
+        self.spreadsheet.client._call(len(rows), write)
+
+    def append_row(self, values, value_input_option=None, **kwargs):
+        self.append_rows([values], value_input_option=value_input_option, **kwargs)
+
+    def get_all_values(self) -> List[List[str]]:
+        self.spreadsheet.client._call()
+        with self.spreadsheet.client.lock:
+            return [list(row) for row in self._rows]
+
+    def update(self, values, range_name: str = 'A1', **kwargs):
+        """range_name の左上から values を書く（このリポジトリでは1行目の列名を書くのにだけ使う）。"""
+        _, first, _ = _parse_range(range_name)
+        start = int(re.sub(r'[^0-9]', '', range_name.split(':')[0]) or 1) - 1
+
+        def write():
+            rows = self._rows
+            for i, row in enumerate(values):
+                while len(rows) <= start + i:
+                    rows.append([])
+                target = rows[start + i]
+                target.extend([''] * (first + len(row) - len(target)))
+                target[first:first + len(row)] = ['' if v is None else str(v) for v in row]
+        self.spreadsheet.client._call(write=write)
+
+
+def _column_index(letters: str) -> int:
+    n = 0
+    for ch in letters.upper():
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+def _parse_range(rng: str):
+    """"'表'!A:C" や 'A1' を (ワークシート名, 最初の列, 最後の列+1) にする（列の指定がなければ全列）。"""
+    title = None
+    if '!' in rng:
+        title, rng = rng.rsplit('!', 1)
+        title = title.strip("'").replace("''", "'")
+    cols = [re.sub(r'[^A-Za-z]', '', part) for part in rng.split(':')]
+    first = _column_index(cols[0]) if cols[0] else 0
+    last = _column_index(cols[-1]) + 1 if len(cols) > 1 and cols[-1] else None
+    return title, first, last
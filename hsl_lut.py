@@ -0,0 +1,110 @@
+"""
+カラーピッカーの回答（HEX）→ HSL 変換。
+
+hex_to_hsl は sc.py の color_picker ページ内にあった関数をそのまま移したもの。
+全 16,777,216 色の HSL を 0.01 刻みの uint16 で前計算したルックアップテーブル（約 96MB）を
+ファイルに置いておけば、np.memmap で開いて添字参照だけで変換できる。
+memmap は OS のページキャッシュ経由で同じマシンの全ワーカープロセスから共有される。
+
+テーブルの作成（一度だけ）:
+    python hsl_lut.py build
+"""
+import os
+import sys
+from pathlib import Path
+import numpy as np
+
+LUT_PATH = Path('cache') / 'rgb_hsl_lut_v1.u16'
+N_COLORS = 1 << 24
+CHUNK = 1 << 20
+
+
+def hex_to_hsl(hexc):
+    hexc=hexc.lstrip('#'); r=int(hexc[0:2],16)/255.0; g=int(hexc[2:4],16)/255.0; b=int(hexc[4:6],16)/255.0
+    maxc,minc=max(r,g,b),min(r,g,b); l=(maxc+minc)/2
+    if maxc==minc: h=s=0
+    else:
+        d=maxc-minc; s=d/(2-maxc-minc) if l>0.5 else d/(maxc+minc)
+        if maxc==r: h=(g-b)/d+(6 if g<b else 0)
+        elif maxc==g: h=(b-r)/d+2
+        else: h=(r-g)/d+4
+        h=(h*60)%360
+    return {'H': round(h,2), 'S': round(s*100,2), 'L': round(l*100,2)}
+
+def rgb_to_hsl_batch(rgb):
+    """0xRRGGBB の配列から H, S, L（丸め前の float64）を返す。hex_to_hsl と同じ式。"""
+    rgb = np.asarray(rgb, dtype=np.uint32)
+    r = ((rgb >> 16) & 0xFF) / 255.0
+    g = ((rgb >> 8) & 0xFF) / 255.0
+    b = (rgb & 0xFF) / 255.0
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    l = (maxc + minc) / 2
+    gray = maxc == minc
+    d = np.where(gray, 1.0, maxc - minc)
+    s = np.where(l > 0.5, d / np.where(gray, 1.0, 2 - maxc - minc), d / np.where(gray, 1.0, maxc + minc))
+    h = np.where(maxc == r, (g - b) / d + np.where(g < b, 6, 0),
+                 np.where(maxc == g, (b - r) / d + 2, (r - g) / d + 4))
+    h = (h * 60) % 360
+    h = np.where(gray, 0.0, h)
+    s = np.where(gray, 0.0, s)
+    return h, s * 100, l * 100
+
+def parse_hex_batch(hex_strs):
+    """'#rrggbb' 文字列の配列を 0xRRGGBB の uint32 配列にする（大文字・小文字どちらも可）。"""
+    arr = np.char.lstrip(np.asarray(hex_strs, dtype='U7'), '#')
+    if arr.size and np.char.str_len(arr).min() != 6:
+        raise ValueError("HEX は '#rrggbb' 形式である必要があります")
+    chars = np.char.lower(arr.astype('U6')).view(np.uint32).reshape(-1, 6)
+    nib = np.where(chars >= ord('a'), chars - ord('a') + 10, chars - ord('0'))
+    if nib.size and (nib.min() < 0 or nib.max() > 15):
+        raise ValueError("HEX に不正な文字が含まれています")
+    rgb = np.zeros(len(chars), dtype=np.uint32)
+    for i in range(6):
+        rgb = (rgb << 4) | nib[:, i].astype(np.uint32)
+    return rgb
+
+def build_lut(path: Path = LUT_PATH):
+    """全色の HSL を 0.01 刻みで量子化して (2^24, 3) の uint16 ファイルに書き出す。"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    lut = np.memmap(tmp, dtype=np.uint16, mode='w+', shape=(N_COLORS, 3))
+    for start in range(0, N_COLORS, CHUNK):
+        rgb = np.arange(start, start + CHUNK, dtype=np.uint32)
+        h, s, l = rgb_to_hsl_batch(rgb)
+        lut[start:start + CHUNK, 0] = np.round(h * 100)
+        lut[start:start + CHUNK, 1] = np.round(s * 100)
+        lut[start:start + CHUNK, 2] = np.round(l * 100)
+    lut.flush()
+    del lut
+    # 他プロセスが書きかけのファイルを開かないよう、書き終えてから置き換える
+    os.replace(tmp, path)
+    return path
+
+def open_lut(path: Path = LUT_PATH):
+    """テーブルを読み取り専用の memmap で開く。ファイルがなければ None。"""
+    path = Path(path)
+    if not path.exists() or path.stat().st_size != N_COLORS * 3 * 2:
+        return None
+    return np.memmap(path, dtype=np.uint16, mode='r', shape=(N_COLORS, 3))
+
+def lookup_hsl_batch(lut, hex_strs):
+    """HEX 文字列の配列を H, S, L（0.01 刻みの float64 配列）に変換する。"""
+    q = lut[parse_hex_batch(hex_strs)]
+    return q[:, 0] / 100, q[:, 1] / 100, q[:, 2] / 100
+
+def lookup_hsl(lut, hexc):
+    """1色分の変換。lut が None なら hex_to_hsl で計算する。"""
+    if lut is None:
+        return hex_to_hsl(hexc)
+    h = hexc.lstrip('#')
+    q = lut[int(h, 16)]
+    return {'H': int(q[0]) / 100, 'S': int(q[1]) / 100, 'L': int(q[2]) / 100}
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['build']:
+        print(f"作成しました: {build_lut()}")
+    else:
+        print(__doc__)
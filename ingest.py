@@ -0,0 +1,238 @@
+"""
+音刺激の軽量版（配信用の派生ファイル）を作る。uploads/ の元ファイルは変えない。
+
+WAV はモノラルにまとめ、前後の無音を切り、サンプリング周波数を下げて 16bit PCM の WAV にする。
+参加者は各刺激を一度ダウンロードするので、1ファイルの大きさが BYTE_BUDGET に収まる
+いちばん高い周波数（RATE_LADDER の順に試す）を選ぶ。元より高い周波数にはしない。
+音量は変えない（刺激間の音量差を保つため）。クリップする float の WAV だけ、ピークが 0dBFS に収まるよう下げる。
+周波数を下げると帯域がその半分までになる（11,025 Hz なら約 5.5 kHz）ので、刺激そのものが変わる。
+そのため既定では使わず、secrets.toml で stimulus_rendition = true にした時だけ sc.py が配信に使い、
+管理者ページに配信している版の周波数を表示する。
+
+変換結果は元ファイルのハッシュと設定のハッシュで cache/ingest/ に置くので、
+同じファイルをもう一度読み込んでも変換し直さない。
+MP3 などの圧縮形式は標準ライブラリと NumPy だけでは扱えないので、そのまま通す。
+
+確認用:
+    python ingest.py audio/practice.wav
+"""
+import hashlib
+import io
+import json
+import math
+import os
+import struct
+import sys
+import wave
+from pathlib import Path
+from typing import Dict, Tuple
+import numpy as np
+
+INGEST_CACHE_DIR = Path('cache') / 'ingest'
+RATE_LADDER = (22050, 16000, 11025)
+BYTE_BUDGET = 512 * 1024
+SILENCE_DBFS = -50.0     # これより小さいフレームを無音とみなす
+FRAME_SEC = 0.01         # 無音判定のフレーム長
+PAD_SEC = 0.02           # 切った端に残す余白
+FADE_SEC = 0.005         # 切った端に付けるフェード
+SETTINGS_VERSION = 1     # 変換の中身を変えたら上げる（キャッシュを作り直す）
+
+_FORMAT_PCM = 1
+_FORMAT_FLOAT = 3
+_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+# ---------- 読み書き ----------
+def _riff_chunks(data: bytes) -> Dict[bytes, bytes]:
+    """RIFF/WAVE のチャンクを {チャンクID: 中身} にする。"""
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError("WAV（RIFF/WAVE）ではありません")
+    chunks = {}
+    pos = 12
+    while pos + 8 <= len(data):
+        cid, size = data[pos:pos + 4], struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        chunks.setdefault(cid, data[pos + 8:pos + 8 + size])
+        pos += 8 + size + (size & 1)
+    if b'fmt ' not in chunks or b'data' not in chunks:
+        raise ValueError("WAV に fmt / data チャンクがありません")
+    return chunks
+
+def _pcm_to_float(raw: bytes, width: int) -> np.ndarray:
+    """PCM のバイト列を -1〜1 の float32 にする（8bit は符号なし、それ以外は符号付き）。"""
+    if width == 1:
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    if width == 3:
+        b = np.frombuffer(raw[:len(raw) // 3 * 3], dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        v = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        v = np.where(v >= 1 << 23, v - (1 << 24), v)
+        return v.astype(np.float32) / float(1 << 23)
+    if width in (2, 4):
+        dtype = np.dtype(f'<i{width}')
+        return np.frombuffer(raw[:len(raw) // width * width], dtype=dtype).astype(np.float32) / float(1 << (8 * width - 1))
+    raise ValueError(f"未対応のサンプル幅です: {width * 8}bit")
+
+def read_wav(data: bytes) -> Tuple[np.ndarray, int]:
+    """
+    WAV を (サンプル数, チャンネル数) の float32 配列とサンプリング周波数にする。
+    PCM は wave モジュールで読む。wave が読めない IEEE float / WAVE_FORMAT_EXTENSIBLE は fmt チャンクを直接読む。
+    """
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as w:
+            channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+            raw = w.readframes(w.getnframes())
+        samples = _pcm_to_float(raw, width)
+    except wave.Error:
+        chunks = _riff_chunks(data)
+        fmt = chunks[b'fmt ']
+        tag, channels, rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+        if tag == _FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            tag = struct.unpack('<H', fmt[24:26])[0]   # SubFormat GUID の先頭2バイト
+        raw = chunks[b'data']
+        if tag == _FORMAT_FLOAT and bits in (32, 64):
+            dtype = np.dtype(f'<f{bits // 8}')
+            samples = np.frombuffer(raw[:len(raw) // dtype.itemsize * dtype.itemsize], dtype=dtype).astype(np.float32)
+        elif tag == _FORMAT_PCM:
+            samples = _pcm_to_float(raw, bits // 8)
+        else:
+            raise ValueError(f"未対応の WAV 形式です: format={tag}, {bits}bit")
+    if channels < 1:
+        raise ValueError("チャンネル数が不正です")
+    samples = samples[:len(samples) // channels * channels]
+    return samples.reshape(-1, channels), rate
+
+def wav_duration(data: bytes) -> float:
+    """WAV のヘッダー（fmt の block align と data の長さ）だけから長さ（秒）を求める。"""
+    chunks = _riff_chunks(data)
+    _, _, rate, _, block_align, _ = struct.unpack('<HHIIHH', chunks[b'fmt '][:16])
+    if rate == 0 or block_align == 0:
+        raise ValueError("WAV の fmt チャンクが不正です")
+    return len(chunks[b'data']) // block_align / rate
+
+def write_wav(mono: np.ndarray, rate: int) -> bytes:
+    """-1〜1 のモノラル信号を 16bit PCM の WAV にする。"""
+    pcm = np.clip(np.round(mono * 32767.0), -32768, 32767).astype('<i2')
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+# ---------- 信号処理 ----------
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """チャンネルの平均でモノラルにする。"""
+    return samples.mean(axis=1, dtype=np.float64).astype(np.float32)
+
+def resample(mono: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """
+    FFT で周波数を変える（帯域制限つき）。dst_rate の方が高い場合は何もしない。
+    新しいナイキスト周波数の手前 5% は余弦で落とし、端の折り返しを防ぐため前後に無音を足してから変換する。
+    """
+    if dst_rate >= src_rate or len(mono) == 0:
+        return mono
+    step = src_rate // math.gcd(src_rate, dst_rate)   # 出力側でも整数サンプルになる余白の単位
+    pad = step * -(-int(src_rate * 0.05) // step)
+    x = np.concatenate([np.zeros(pad, np.float32), mono, np.zeros(pad, np.float32)])
+    n = len(x)
+    m = max(1, int(round(n * dst_rate / src_rate)))
+    spec = np.fft.rfft(x)[:m // 2 + 1]
+    taper = max(1, len(spec) // 20)
+    spec[-taper:] *= 0.5 * (1 + np.cos(np.linspace(0, np.pi, taper)))
+    y = np.fft.irfft(spec, m) * (m / n)
+    out_pad = pad * dst_rate // src_rate
+    return y[out_pad:m - out_pad].astype(np.float32)
+
+def trim_silence(mono: np.ndarray, rate: int, threshold_dbfs: float = SILENCE_DBFS) -> np.ndarray:
+    """前後の無音（フレームの RMS が threshold_dbfs 未満）を切る。切った端には短い余白とフェードを付ける。"""
+    frame = max(1, int(rate * FRAME_SEC))
+    n_frames = len(mono) // frame
+    if n_frames == 0:
+        return mono
+    rms = np.sqrt(np.mean(np.square(mono[:n_frames * frame].reshape(n_frames, frame), dtype=np.float64), axis=1))
+    loud = np.nonzero(rms >= 10 ** (threshold_dbfs / 20))[0]
+    if len(loud) == 0:
+        return mono    # 全体が無音なら手を付けない
+    pad = int(rate * PAD_SEC)
+    start = max(0, loud[0] * frame - pad)
+    end = min(len(mono), (loud[-1] + 1) * frame + pad)
+    out = mono[start:end].copy()
+    fade = min(int(rate * FADE_SEC), len(out) // 2)
+    if fade > 0:
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)
+        if start > 0:
+            out[:fade] *= ramp
+        if end < len(mono):
+            out[-fade:] *= ramp[::-1]
+    return out
+
+def choose_rate(n_seconds: float, src_rate: int, budget: int = BYTE_BUDGET) -> int:
+    """16bit モノラルで budget バイトに収まるいちばん高い周波数（どれも収まらなければ最低の周波数）。"""
+    ladder = [r for r in RATE_LADDER if r < src_rate] or [src_rate]
+    for rate in ladder:
+        if 44 + n_seconds * rate * 2 <= budget:
+            return rate
+    return ladder[-1]
+
+
+# ---------- 取り込み ----------
+def _settings_hash(budget: int) -> str:
+    settings = {'v': SETTINGS_VERSION, 'ladder': RATE_LADDER, 'budget': budget,
+                'silence': SILENCE_DBFS, 'pad': PAD_SEC, 'fade': FADE_SEC}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:8]
+
+def ingest_wav(data: bytes, budget: int = BYTE_BUDGET, cache_dir: Path = INGEST_CACHE_DIR) -> Dict:
+    """
+    WAV を変換して {'data', 'rate', 'seconds', 'source_hash', 'cached'} を返す。
+    同じ元ファイル・同じ設定の変換結果が cache_dir にあれば読み込むだけにする。
+    """
+    source_hash = hashlib.sha256(data).hexdigest()[:16]
+    cache_path = Path(cache_dir) / f"{source_hash}.{_settings_hash(budget)}.wav"
+    if cache_path.exists():
+        out = cache_path.read_bytes()
+        with wave.open(io.BytesIO(out), 'rb') as w:
+            rate, frames = w.getframerate(), w.getnframes()
+        return {'data': out, 'rate': rate, 'seconds': frames / rate, 'source_hash': source_hash, 'cached': True}
+
+    samples, src_rate = read_wav(data)
+    mono = trim_silence(downmix(samples), src_rate)
+    peak = float(np.max(np.abs(mono))) if len(mono) else 0.0
+    if peak > 1.0:
+        mono = mono / peak
+    rate = choose_rate(len(mono) / src_rate, src_rate, budget)
+    mono = resample(mono, src_rate, rate)
+    out = write_wav(mono, rate)
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(out)
+    os.replace(tmp, cache_path)
+    return {'data': out, 'rate': rate, 'seconds': len(mono) / rate, 'source_hash': source_hash, 'cached': False}
+
+def stimulus_rendition(data: bytes, name: str, budget: int = BYTE_BUDGET) -> Tuple[bytes, Dict]:
+    """
+    音刺激の配信用の軽量版を作る。(配信するバイト列, 情報) を返す（data は変えない）。
+    WAV 以外や読めない WAV は元のまま返す（情報の 'converted' が False）。
+    """
+    info = {'converted': False, 'original_size': len(data)}
+    if Path(name).suffix.lower() != '.wav':
+        return data, info
+    try:
+        result = ingest_wav(data, budget)
+    except (ValueError, wave.Error, EOFError, struct.error):
+        return data, info
+    info.update(converted=True, rate=result['rate'], seconds=result['seconds'],
+                cached=result['cached'], size=len(result['data']))
+    return result['data'], info
+
+
+if __name__ == '__main__':
+    for arg in sys.argv[1:]:
+        src = Path(arg).read_bytes()
+        _, info = stimulus_rendition(src, arg)
+        if info['converted']:
+            print(f"{arg}: {info['original_size']:,} → {info['size']:,} bytes, "
+                  f"{info['rate']} Hz, {info['seconds']:.2f} s{' (cache)' if info['cached'] else ''}")
+        else:
+            print(f"{arg}: 変換しません（WAV 以外か、読めない WAV）")
@@ -0,0 +1,149 @@
+"""
+カラーピッカーの回答に最も近い段階的選択のパスを探す。
+
+選択木の 13,122 葉は丸めとクリップのため同じ色になるものが多いので、
+異なる色（約 4,200 色, color_tree.build_collision_index の同値類）だけを OKLab 上の格子（グリッドバケット）に入れ、色ごとに葉番号の一覧を持つ。
+問い合わせ色の周囲 (2r+1)^3 セルを候補にし、k 番目までの距離が r×セル幅 以下なら
+ブロックの外により近い色はないので結果は厳密。満たさない色だけ r を広げて探し直し、
+それでも残れば全色との総当たりにする。距離は ΔEOK（OKLab のユークリッド距離）。
+"""
+from functools import lru_cache
+import numpy as np
+
+from color_tree import build_palette_table, build_collision_index
+from colorspace import rgb_to_srgb, srgb_to_oklab, hex_to_oklab
+
+DEFAULT_CELL = 0.03
+MAX_RING = 3
+CANDIDATE_BUDGET = 1 << 22   # 1チャンクあたりの候補数（問い合わせ数×候補色数）の上限
+
+
+def _ring_offsets(r: int):
+    span = np.arange(-r, r + 1)
+    return np.stack(np.meshgrid(span, span, span, indexing='ij'), axis=-1).reshape(-1, 3)
+
+def build_nearest_index(table=None, cell: float = DEFAULT_CELL):
+    """葉の色（OKLab）の索引を作る。"""
+    if table is None:
+        table = build_palette_table()
+    collisions = build_collision_index(table)
+    # 色番号は同値類の番号（その色の最小の葉番号の順）。色どうしが同距離のときに
+    # 色番号の小さい方を選べば、葉を (距離, 葉番号) 順に選んだ結果と一致する
+    points = srgb_to_oklab(rgb_to_srgb(collisions['class_rgb']))
+    group_starts, leaf_order = collisions['class_starts'], collisions['class_codes']
+
+    origin = points.min(axis=0) - 1e-9
+    coords = np.floor((points - origin) / cell).astype(np.int64)
+    dims = coords.max(axis=0) + 1
+    flat = np.ravel_multi_index(coords.T, dims)
+    order = np.argsort(flat, kind='stable')
+    starts = np.searchsorted(flat[order], np.arange(np.prod(dims) + 1))
+    return {
+        'cell': cell, 'origin': origin, 'dims': dims, 'starts': starts,
+        'color_ids': order, 'points': points, 'sorted_points': points[order],
+        'max_bucket': int(np.diff(starts).max()),
+        'group_starts': group_starts, 'group_codes': leaf_order,
+        'max_group': int(np.diff(group_starts).max()),
+    }
+
+@lru_cache(maxsize=1)
+def _default_index():
+    return build_nearest_index()
+
+def _select_k(d2, ids, k):
+    """各行の距離二乗 d2 から (距離, id) の昇順で k 個選ぶ。"""
+    k = min(k, d2.shape[1])
+    part = np.argpartition(d2, k - 1, axis=1)[:, :k]
+    pd = np.take_along_axis(d2, part, axis=1)
+    pi = np.take_along_axis(ids, part, axis=1)
+    # k 番目と同じ距離の候補が取りこぼされた行（argpartition は同距離の選び方が不定）は並べ直す
+    kth = pd.max(axis=1, keepdims=True)
+    tied = np.nonzero((d2 == kth).sum(axis=1) > (pd == kth).sum(axis=1))[0]
+    if len(tied):
+        o = np.lexsort((ids[tied], d2[tied]), axis=1)[:, :k]
+        pd[tied] = np.take_along_axis(d2[tied], o, axis=1)
+        pi[tied] = np.take_along_axis(ids[tied], o, axis=1)
+    order = np.lexsort((pi, pd), axis=1)
+    return np.take_along_axis(pi, order, axis=1), np.take_along_axis(pd, order, axis=1)
+
+def _nearest_colors_brute(index, q, k):
+    points = index['points']
+    ids = np.broadcast_to(np.arange(len(points)), (len(q), len(points)))
+    d2 = ((q[:, None, :] - points[None, :, :]) ** 2).sum(axis=-1)
+    return _select_k(d2, ids, k)
+
+def _nearest_colors_ring(index, q, k, r):
+    """周囲 (2r+1)^3 セルから k 色を探す。厳密と保証できない行は ok=False。"""
+    dims, starts, B = index['dims'], index['starts'], index['max_bucket']
+    offsets = _ring_offsets(r)
+    cells = np.floor((q - index['origin']) / index['cell']).astype(np.int64)
+    nb = cells[:, None, :] + offsets[None, :, :]                         # (m, n_cells, 3)
+    inside = np.all((nb >= 0) & (nb < dims), axis=-1)
+    flat = np.ravel_multi_index(np.clip(nb, 0, dims - 1).transpose(2, 0, 1), dims)
+    lo = starts[flat]
+    cnt = np.where(inside, starts[flat + 1] - lo, 0)
+    slot = np.arange(B)
+    valid = (slot[None, None, :] < cnt[:, :, None]).reshape(len(q), -1)
+    pos = (lo[:, :, None] + slot[None, None, :]).reshape(len(q), -1)
+    pos = np.where(valid, pos, 0)
+    ids = index['color_ids'][pos]
+    diff = index['sorted_points'][pos] - q[:, None, :]
+    d2 = np.einsum('ijk,ijk->ij', diff, diff)
+    d2[~valid] = np.inf
+    ids, d2 = _select_k(d2, ids, k)
+    ok = d2[:, -1] < (r * index['cell']) ** 2
+    return ids, d2, ok
+
+def _nearest_colors(index, q, k):
+    """各問い合わせに最も近い k 色（色番号, 距離二乗）。"""
+    ids = np.empty((len(q), k), dtype=np.int64)
+    d2 = np.empty((len(q), k), dtype=np.float64)
+    todo = np.arange(len(q))
+    for r in range(1, MAX_RING + 1):
+        if len(todo) == 0:
+            break
+        per_query = (2 * r + 1) ** 3 * index['max_bucket']
+        if per_query < k:
+            continue
+        chunk = max(1, CANDIDATE_BUDGET // per_query)
+        retry = []
+        for s in range(0, len(todo), chunk):
+            rows = todo[s:s + chunk]
+            ri, rd, ok = _nearest_colors_ring(index, q[rows], k, r)
+            ids[rows[ok]], d2[rows[ok]] = ri[ok], rd[ok]
+            retry.append(rows[~ok])
+        todo = np.concatenate(retry)
+    chunk = max(1, CANDIDATE_BUDGET // len(index['points']))
+    for s in range(0, len(todo), chunk):
+        rows = todo[s:s + chunk]
+        ids[rows], d2[rows] = _nearest_colors_brute(index, q[rows], k)
+    return ids, d2
+
+def nearest_paths_oklab(oklab, k: int = 1, index=None):
+    """OKLab 座標 (N, 3) に対して、近い順に k 個の葉番号 (N, k) と ΔEOK (N, k) を返す。"""
+    if index is None:
+        index = _default_index()
+    n = len(index['group_codes'])
+    if not 1 <= k <= n:
+        raise ValueError(f"k は 1〜{n} の範囲で指定してください: {k}")
+    q, back = np.unique(np.asarray(oklab, dtype=np.float64).reshape(-1, 3), axis=0, return_inverse=True)
+    back = back.ravel()
+    # 同じ色の葉が複数あるので、まず近い色を最大 k 色求め、その色の葉を (距離, 葉番号) 順に k 個取る
+    kc = min(k, len(index['points']))
+    color_ids, color_d2 = _nearest_colors(index, q, kc)
+    gs, G = index['group_starts'], index['max_group']
+    lo = gs[color_ids]
+    cnt = gs[color_ids + 1] - lo
+    slot = np.arange(G)
+    valid = (slot[None, None, :] < cnt[:, :, None]).reshape(len(q), -1)
+    codes = index['group_codes'][np.where(valid, (lo[:, :, None] + slot).reshape(len(q), -1), 0)]
+    d2 = np.where(valid, np.repeat(color_d2, G, axis=1), np.inf)
+    codes, d2 = _select_k(d2, codes, k)
+    return codes[back], np.sqrt(d2)[back]
+
+def nearest_paths(hex_array, k: int = 1, index=None):
+    """
+    HEX 文字列の配列（例: color_results の pickedHex 列）に対して、
+    近い順に k 個の葉番号 (N, k) と ΔEOK (N, k) を返す。葉番号は color_tree.decode_path でパスに戻せる。
+    """
+    return nearest_paths_oklab(hex_to_oklab(hex_array), k=k, index=index)
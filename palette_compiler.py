@@ -0,0 +1,125 @@
+"""
+名前付きパレット方式（color_tree.PALETTE_SCHEMES）を、選択木の全ノードの色表にコンパイルする。
+
+出力先は static/palettes/（Streamlit の静的配信で app/static/palettes/ として配信される）。
+  - <name>.<hash>.json : HTML ページ用。hex / H / S / L の配列とパレット定義
+  - <name>.<hash>.bin  : Python 用。H(float32) | S(uint16) | L(uint16) | RGB(uint32) をリトルエンディアンで連結
+  - index.json         : 名前 → 現在のハッシュとファイル名
+ファイル名に内容のハッシュが入るので、ブラウザは同じファイルをずっとキャッシュしてよい。
+結果の行にはこのハッシュを記録し、どの色表で選ばれた色かを後から特定できるようにする。
+ノード番号は color_tree.encode_path と同じ混合基数（未選択の段階は 1 で埋める）。
+
+    python palette_compiler.py            # 全パレット
+    python palette_compiler.py sc         # 指定したものだけ
+"""
+import hashlib
+import json
+import sys
+from pathlib import Path
+from typing import Dict
+import numpy as np
+
+from color_tree import (PALETTE_SCHEMES, RADIX, N_STEPS, build_palette_table, build_collision_index,
+                        rgb_to_hex_batch)
+
+PALETTE_DIR = Path('static') / 'palettes'
+STATIC_URL = 'app/static/palettes'
+FORMAT_VERSION = 1
+_BIN_FIELDS = [('H', '<f4'), ('S', '<u2'), ('L', '<u2'), ('rgb', '<u4')]
+
+
+def _canonical(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def _digest(scheme: Dict, blob: bytes) -> str:
+    return hashlib.sha256(_canonical({'version': FORMAT_VERSION, 'scheme': scheme}) + blob).hexdigest()[:16]
+
+def compile_scheme(name: str, scheme: Dict):
+    """パレット方式を色表にして (メタ情報, JSON バイト列, バイナリ) を返す。"""
+    table = build_palette_table(scheme)
+    blob = b''.join(np.ascontiguousarray(table[key], dtype=dt).tobytes() for key, dt in _BIN_FIELDS)
+    digest = _digest(scheme, blob)
+    meta = {
+        'name': name,
+        'hash': digest,
+        'version': FORMAT_VERSION,
+        'leaves': len(table['rgb']),
+        'distinct': build_collision_index(table)['n_distinct'],
+        'firstRadix': len(scheme['baseHues']),
+        'radix': RADIX,
+        'steps': N_STEPS,
+        'json': f"{name}.{digest}.json",
+        'bin': f"{name}.{digest}.bin",
+    }
+    doc = {
+        **{k: meta[k] for k in ('name', 'hash', 'version', 'leaves', 'firstRadix', 'radix', 'steps')},
+        'scheme': scheme,
+        'hex': table['hex'].tolist(),
+        'H': [float(h) for h in table['H']],
+        'S': table['S'].tolist(),
+        'L': table['L'].tolist(),
+    }
+    return meta, _canonical(doc), blob
+
+def write_artifacts(names=None, out_dir: Path = PALETTE_DIR) -> Dict:
+    """色表を書き出して index.json を更新する。古いハッシュのファイルは削除する。"""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    index_path = out_dir / 'index.json'
+    index = json.loads(index_path.read_text(encoding='utf-8')) if index_path.exists() else {}
+    for name in (names or list(PALETTE_SCHEMES)):
+        meta, doc, blob = compile_scheme(name, PALETTE_SCHEMES[name])
+        for stale in out_dir.glob(f"{name}.*"):
+            if stale.name not in (meta['json'], meta['bin']):
+                stale.unlink()
+        (out_dir / meta['json']).write_bytes(doc)
+        (out_dir / meta['bin']).write_bytes(blob)
+        index[name] = meta
+    index_path.write_text(json.dumps(index, ensure_ascii=False, indent=2, sort_keys=True) + '\n', encoding='utf-8')
+    return index
+
+def _table_from_blob(meta: Dict, blob: bytes) -> Dict:
+    n = meta['leaves']
+    table, offset = {}, 0
+    for key, dt in _BIN_FIELDS:
+        arr = np.frombuffer(blob, dtype=dt, count=n, offset=offset)
+        offset += arr.nbytes
+        table[key] = arr.astype(arr.dtype.newbyteorder('='))
+    table['hex'] = rgb_to_hex_batch(table['rgb'])
+    for arr in table.values():
+        arr.setflags(write=False)
+    return table
+
+def load_palette(name: str, out_dir: Path = PALETTE_DIR) -> Dict:
+    """
+    コンパイル済みの色表を読み込み、palette_color で使えるテーブルに 'name' と 'hash' を付けて返す。
+    読み込んだバイナリと現在のパレット定義からハッシュを計算し直し、index.json と食い違えば例外にする
+    （定義を変えたのに再コンパイルしていない場合）。成果物がなければその場でコンパイルする。
+    'json' は配信されている HTML 用の色表のファイル名（成果物がなければ None）。
+    """
+    if name not in PALETTE_SCHEMES:
+        raise KeyError(f"未知のパレット方式です: {name}")
+    scheme = PALETTE_SCHEMES[name]
+    index_path = Path(out_dir) / 'index.json'
+    entry = None
+    if index_path.exists():
+        entry = json.loads(index_path.read_text(encoding='utf-8')).get(name)
+    if entry is not None and (Path(out_dir) / entry['bin']).exists():
+        meta = entry
+        blob = (Path(out_dir) / entry['bin']).read_bytes()
+        if _digest(scheme, blob) != entry['hash']:
+            raise ValueError(f"パレット '{name}' の成果物 ({entry['hash']}) が現在の定義と一致しません。"
+                             "python palette_compiler.py で再生成してください。")
+    else:
+        meta, _, blob = compile_scheme(name, scheme)
+    table = _table_from_blob(meta, blob)
+    table['name'] = name
+    table['hash'] = meta['hash']
+    table['json'] = meta['json'] if (Path(out_dir) / meta['json']).exists() else None
+    return table
+
+
+if __name__ == '__main__':
+    index = write_artifacts(sys.argv[1:] or None)
+    for name, meta in sorted(index.items()):
+        print(f"{name}: {meta['hash']} ({meta['leaves']} 葉, 異なる色 {meta.get('distinct')}) → {PALETTE_DIR / meta['json']}")
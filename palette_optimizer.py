@@ -0,0 +1,151 @@
+"""
+選択木のパレット方式（color_tree.DEFAULT_SCHEME の定数）の候補を評価して順位付けする。
+
+各候補について全 13,122 葉の色を一括計算し、次の指標を出す。
+  - 兄弟間 ΔE2000: 各段階で同時に提示される選択肢どうしの色差（最小値、5パーセンタイル、
+    JND（ΔE2000 < 2.3）未満で見分けにくい組の割合）
+  - 色域カバー率: sRGB 全体から一様に取った色のうち、ΔEOK がしきい値以内の葉がある色の割合
+  - 葉の衝突: 同じ HEX になってしまう葉の数
+パラメータの格子探索はプロセスプールで並列に行い、結果を CSV に書き出す。
+
+    python palette_optimizer.py [--workers N] [--top N] [--out palette_report.csv]
+"""
+import argparse
+import csv
+import itertools
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+import numpy as np
+
+from color_tree import (DEFAULT_SCHEME, RADIX, N_STEPS, all_leaf_paths,
+                        build_palette_table)
+from colorspace import rgb_to_srgb, srgb_to_lab, srgb_to_oklab, delta_e2000
+from nearest_path import build_nearest_index, nearest_paths_oklab
+
+JND_DE2000 = 2.3
+COVERAGE_DE_OK = 0.05
+GAMUT_SAMPLES_PER_AXIS = 16   # 16^3 = 4,096 色
+
+# 既定の探索範囲（手調整された値の周辺）
+DEFAULT_GRID = {
+    'satBase': [60, 65, 70, 75],
+    'lightBase': [45, 50, 55],
+    'satSteps': [[25, 15], [20, 10], [18, 8], [30, 12]],
+    'lightSteps': [[20, 10], [15, 8], [12, 6], [25, 12]],
+}
+
+
+def _sibling_groups(scheme: Dict, level: int) -> np.ndarray:
+    """
+    段階 level（1〜8）で同時に提示される選択肢の葉番号を (親の数, 選択肢数) で返す。
+    段階1 の選択肢数は方式の baseHues の数（方式ごとに違う）。
+    """
+    first_radix = len(scheme['baseHues'])
+    paths = all_leaf_paths(first_radix)
+    # 段階 level より後の桁が全て 1（未選択扱い）の葉が、その段階の選択肢の色になる
+    mask = np.all(paths[:, level:] == 1, axis=1)
+    codes = np.nonzero(mask)[0]
+    radix = first_radix if level == 1 else RADIX
+    return codes.reshape(-1, radix)
+
+def _gamut_samples() -> np.ndarray:
+    axis = np.linspace(0, 255, GAMUT_SAMPLES_PER_AXIS).round().astype(np.uint32)
+    r, g, b = np.meshgrid(axis, axis, axis, indexing='ij')
+    return ((r << 16) | (g << 8) | b).ravel()
+
+def evaluate_scheme(scheme: Dict) -> Dict:
+    """1つのパレット方式を評価して指標の dict を返す。"""
+    table = build_palette_table(scheme)
+    lab = srgb_to_lab(rgb_to_srgb(table['rgb']))
+
+    sibling_de = []
+    for level in range(1, N_STEPS + 1):
+        groups = _sibling_groups(scheme, level)
+        for i, j in itertools.combinations(range(groups.shape[1]), 2):
+            sibling_de.append(delta_e2000(lab[groups[:, i]], lab[groups[:, j]]))
+    sibling_de = np.concatenate(sibling_de)
+
+    samples = srgb_to_oklab(rgb_to_srgb(_gamut_samples()))
+    _, dist = nearest_paths_oklab(samples, k=1, index=build_nearest_index(table))
+    n_distinct = len(np.unique(table['rgb']))
+    return {
+        'sibling_de_min': float(sibling_de.min()),
+        'sibling_de_p05': float(np.percentile(sibling_de, 5)),
+        'sibling_below_jnd': float(np.mean(sibling_de < JND_DE2000)),
+        'gamut_coverage': float(np.mean(dist[:, 0] <= COVERAGE_DE_OK)),
+        'distinct_leaves': n_distinct,
+        'leaf_collisions': len(table['rgb']) - n_distinct,
+    }
+
+def score(metrics: Dict) -> float:
+    """
+    順位付け用の総合点（大きいほど良い）。
+    見分けにくい兄弟の割合と衝突率を減点し、兄弟間 ΔE の5パーセンタイルと色域カバー率を加点する。
+    """
+    collision_rate = metrics['leaf_collisions'] / (metrics['leaf_collisions'] + metrics['distinct_leaves'])
+    return (metrics['sibling_de_p05']
+            + 20 * metrics['gamut_coverage']
+            - 20 * metrics['sibling_below_jnd']
+            - 10 * collision_rate)
+
+def grid_schemes(grid: Dict[str, List], base: Dict = None) -> List[Dict]:
+    """base のうち grid に挙げたキーだけを差し替えた全組み合わせ。"""
+    base = DEFAULT_SCHEME if base is None else base
+    keys = list(grid)
+    schemes = []
+    for values in itertools.product(*(grid[k] for k in keys)):
+        scheme = json.loads(json.dumps(base))
+        scheme.update(dict(zip(keys, values)))
+        schemes.append(scheme)
+    return schemes
+
+def _evaluate_row(scheme: Dict) -> Dict:
+    metrics = evaluate_scheme(scheme)
+    return {'score': score(metrics), **metrics, 'scheme': json.dumps(scheme, ensure_ascii=False)}
+
+def rank_schemes(schemes: List[Dict], workers: int = None) -> List[Dict]:
+    """候補をプロセスプールで評価し、総合点の高い順に並べて返す。"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(_evaluate_row, schemes, chunksize=4))
+    rows.sort(key=lambda r: r['score'], reverse=True)
+    for rank, row in enumerate(rows, 1):
+        row['rank'] = rank
+    return rows
+
+def write_report(rows: List[Dict], path: str):
+    header = ['rank', 'score', 'sibling_de_min', 'sibling_de_p05', 'sibling_below_jnd',
+              'gamut_coverage', 'distinct_leaves', 'leaf_collisions', 'scheme']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=header)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="パレット方式の格子探索")
+    parser.add_argument('--workers', type=int, default=None, help="プロセス数（既定: CPU数）")
+    parser.add_argument('--top', type=int, default=10, help="表示する上位件数")
+    parser.add_argument('--out', default='palette_report.csv', help="CSV レポートの出力先")
+    args = parser.parse_args()
+
+    schemes = grid_schemes(DEFAULT_GRID)
+    rows = rank_schemes(schemes, workers=args.workers)
+    write_report(rows, args.out)
+
+    current = _evaluate_row(DEFAULT_SCHEME)
+    print(f"候補 {len(rows)} 件を評価しました → {args.out}")
+    print(f"現行方式: score={current['score']:.2f} 兄弟ΔE p05={current['sibling_de_p05']:.2f} "
+          f"JND未満={current['sibling_below_jnd']:.1%} カバー率={current['gamut_coverage']:.1%} "
+          f"衝突={current['leaf_collisions']}")
+    for row in rows[:args.top]:
+        s = json.loads(row['scheme'])
+        print(f"#{row['rank']:>3} score={row['score']:.2f} p05={row['sibling_de_p05']:.2f} "
+              f"JND未満={row['sibling_below_jnd']:.1%} カバー率={row['gamut_coverage']:.1%} "
+              f"衝突={row['leaf_collisions']} | satBase={s['satBase']} lightBase={s['lightBase']} "
+              f"satSteps={s['satSteps']} lightSteps={s['lightSteps']}")
+
+
+if __name__ == '__main__':
+    main()
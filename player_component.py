@@ -0,0 +1,41 @@
+"""
+再実行されても作り直されない音声プレーヤー（components/audio_player/）。
+
+ページごとに同じ key・同じ位置で1つだけ表示すれば、Streamlit は iframe を作り直さず引数だけを送るので、
+復号済みの音声（AudioBuffer）が残り、ループ再生の切り替えで読み込みや再生が最初からやり直しにならない。
+ループは Web Audio の AudioBufferSourceNode.loop で行うため、MP3 でも継ぎ目が入らない。
+
+mode:
+  'once' : 1回再生（autoplay=True なら引数を受け取った時点で再生、False なら ▶ を押すまで待つ）
+  'loop' : ループ再生
+  'stop' : 停止
+同じ mode のまま再生をやり直したい時（次の試行など）は token を変える。
+
+戻り値は、今の token・url で1回再生が最後まで終わっていれば
+{'event': 'ended', 'played': 再生した秒数, 'duration': 音声の長さ（秒）}、再生できなかった時は {'event': 'error'}、
+それ以外は None（前の試行の値は token が違うので返さない）。
+"""
+from pathlib import Path
+from typing import Dict, Optional
+import streamlit.components.v1 as components
+
+from stimuli import STIMULUS_CACHE_NAME
+
+_COMPONENT_DIR = Path(__file__).resolve().parent / 'components' / 'audio_player'
+_player = components.declare_component('audio_player', path=str(_COMPONENT_DIR))
+
+MODES = ('once', 'loop', 'stop')
+
+
+def audio_player(url: str, mode: str = 'once', autoplay: bool = False, token: str = '',
+                 key: Optional[str] = None) -> Optional[Dict]:
+    """プレーヤーを表示し、url の音声を mode の状態にする。再生終了・失敗の知らせがあれば返す。"""
+    if mode not in MODES:
+        raise ValueError(f"未知の mode です: {mode}")
+    value = _player(url=url, mode=mode, autoplay=autoplay, token=str(token),
+                    cacheName=STIMULUS_CACHE_NAME, key=key, default=None)
+    if not value or value.get('token') != str(token) or value.get('url') != url:
+        return None
+    if value.get('event') not in ('ended', 'error'):
+        raise ValueError(f"音声プレーヤーから不正な値を受け取りました: {value}")
+    return value
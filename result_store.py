@@ -0,0 +1,235 @@
+"""
+実験結果の保存先（SQLite, WAL モード）。CSV はここから書き出す表示用のファイルにする。
+
+    python result_store.py export [--db results.db] [--out-dir .]
+
+  - 記録の種類ごとに1つの表（results / color_results / meta_results）。列は CSV と同じで、値は CSV に
+    書かれるのと同じ文字列で持つ（書き出した CSV が以前の CSV と同じになる）
+  - 書き込みはプロセスに1つの書き込みスレッドが持つ1本の接続だけで行う。複数のセッションから同時に
+    届いた行は1つのトランザクションにまとめてコミットし（グループコミット）、コミットが終わってから
+    insert_row が戻る
+  - 読み出し（CSV の書き出し）は別の接続で行う。WAL なので書き込み中でも待たない
+  - データベースを作った時に、同じ場所にある以前の CSV（results.csv と、ヘッダーが変わった時に退避した
+    results.v1.csv などの古い版）を古い順に取り込む。列を足す前のヘッダーのままの CSV に新しい列数の
+    行が追記されていてもずれないよう、列は位置で合わせる
+    （列はこれまで末尾に足しただけなので、古い行の列は今の列の先頭と同じ並び）
+"""
+import argparse
+import csv
+import io
+import queue
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+RESULTS_DB = Path('results.db')
+GROUP_COMMIT_ROWS = 256
+INSERT_TIMEOUT_SEC = 30.0
+
+RESULT_COLUMNS = ['participant_id','trial','audioName','path','finalHex','finalH','finalS','finalL','stepRTs_ms','totalRT_ms','timestamp','practice','loop_playback_used','reset_count','paletteHash','pathCode','stepRTsPacked']
+COLOR_COLUMNS = ['participant_id','trial','audioName','pickedHex','pickedH','pickedS','pickedL','timestamp','loop_playback_used', 'totalRT_ms']
+META_COLUMNS = ['participant_id','task_order','timestamp'] + [f"q{i}" for i in range(1,19)] + ['n_color_picks','n_hierarchical_trials']
+
+# 表名 → 列。表名はそのまま CSV のファイル名（<表名>.csv）と Google Sheets のワークシート名にもなる
+TABLES = {'results': RESULT_COLUMNS, 'color_results': COLOR_COLUMNS, 'meta_results': META_COLUMNS}
+# 表名 → 1件の記録を決める列（索引と、Google Sheets との同期で重複を見分けるのに使う）
+KEY_COLUMNS = {'results': ('participant_id', 'trial'), 'color_results': ('participant_id', 'trial'),
+               'meta_results': ('participant_id',)}
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path), timeout=INSERT_TIMEOUT_SEC, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=FULL')    # コミットが戻った行は電源断でも残す
+    return conn
+
+def _cell(value) -> str:
+    """csv.DictWriter が書くのと同じ文字列にする（None は空文字）。"""
+    return '' if value is None else str(value)
+
+def _create_schema(conn: sqlite3.Connection) -> List[str]:
+    """表と索引を作る。新しく作った表の名前を返す。"""
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    created = []
+    with conn:
+        for table, columns in TABLES.items():
+            cols = ', '.join(f'"{c}" TEXT NOT NULL DEFAULT \'\'' for c in columns)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (id INTEGER PRIMARY KEY AUTOINCREMENT, {cols})')
+            # 列を足した場合は既存の表にも足す
+            have = {r[1] for r in conn.execute(f'PRAGMA table_info("{table}")')}
+            for c in columns:
+                if c not in have:
+                    conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{c}" TEXT NOT NULL DEFAULT \'\'')
+            index_cols = ', '.join(f'"{c}"' for c in KEY_COLUMNS[table])
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_by_participant" ON "{table}" ({index_cols})')
+            if table not in existing:
+                created.append(table)
+    return created
+
+def _insert_sql(table: str) -> str:
+    columns = TABLES[table]
+    cols = ', '.join(f'"{c}"' for c in columns)
+    return f'INSERT INTO "{table}" ({cols}) VALUES ({", ".join("?" * len(columns))})'
+
+def import_csv(conn: sqlite3.Connection, table: str, path: Path) -> Dict:
+    """
+    以前の CSV を表に取り込む。行の列は今の列に位置で合わせ、今の列より長い行は取り込まない。
+    {'imported': 件数, 'skipped': 件数} を返す。
+    """
+    columns = TABLES[table]
+    imported = skipped = 0
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return {'imported': 0, 'skipped': 0}
+        if header != columns[:len(header)]:
+            raise ValueError(f"{path} のヘッダーが {table} の列と合いません: {header}")
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            if len(row) > len(columns):
+                skipped += 1
+                continue
+            rows.append(row + [''] * (len(columns) - len(row)))
+        with conn:
+            conn.executemany(_insert_sql(table), rows)
+        imported = len(rows)
+    return {'imported': imported, 'skipped': skipped}
+
+
+def legacy_csv_files(legacy_dir: Path, table: str) -> List[Path]:
+    """取り込む以前の CSV を古い順に返す（<表名>.v1.csv, <表名>.v2.csv, …, <表名>.csv のうちあるもの）。"""
+    pattern = re.compile(rf'{re.escape(table)}\.v(\d+)\.csv')
+    rotated = sorted((int(m.group(1)), p) for p in Path(legacy_dir).glob(f'{table}.v*.csv')
+                     if (m := pattern.fullmatch(p.name)))
+    current = Path(legacy_dir) / f'{table}.csv'
+    return [p for _, p in rotated] + ([current] if current.exists() else [])
+
+
+# ---------- 書き込み（プロセスに1つ） ----------
+def new_result_store(path: Path = RESULTS_DB, legacy_csv_dir: Optional[Path] = None) -> Dict:
+    """
+    結果のデータベースを開いて書き込みスレッドを起動する（sc.py では st.cache_resource で1つだけ作る）。
+    新しく表を作った時は legacy_csv_dir（既定はデータベースと同じ場所）の以前の CSV（legacy_csv_files）を
+    取り込む（結果は 'imports' にファイル名 → import_csv の戻り値、または {'error': 理由}）。
+      'queue'   : (表名, 値のリスト, 完了通知) の待ち行列
+      'metrics' : コミット回数・行数・1回のコミットでまとめた最大行数
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = _connect(path)
+    created = _create_schema(conn)
+    legacy_dir = Path(legacy_csv_dir) if legacy_csv_dir is not None else path.parent
+    imports = {}
+    for table in created:
+        for csv_path in legacy_csv_files(legacy_dir, table):
+            try:
+                imports[csv_path.name] = import_csv(conn, table, csv_path)
+            except (OSError, ValueError, csv.Error) as e:
+                imports[csv_path.name] = {'error': str(e)}
+    store = {'path': path, 'conn': conn, 'queue': queue.Queue(), 'imports': imports,
+             'lock': threading.Lock(), 'metrics': {'commits': 0, 'rows': 0, 'max_group': 0}}
+    thread = threading.Thread(target=_run, args=(store,), name='result-store-writer', daemon=True)
+    store['thread'] = thread
+    thread.start()
+    return store
+
+def insert_row(store: Dict, table: str, row: Dict, timeout: float = INSERT_TIMEOUT_SEC) -> int:
+    """
+    1行を保存し、コミットが終わってから行の id を返す。
+    表にない列が row にあれば ValueError（csv.DictWriter と同じ）。コミットに失敗すればその例外を送出する。
+    """
+    columns = TABLES[table]
+    extra = set(row) - set(columns)
+    if extra:
+        raise ValueError(f"{table} にない列があります: {sorted(extra)}")
+    done = {'event': threading.Event(), 'id': None, 'error': None}
+    store['queue'].put((table, [_cell(row.get(c)) for c in columns], done))
+    if not done['event'].wait(timeout):
+        raise TimeoutError(f"{table} への保存が {timeout} 秒以内に終わりませんでした")
+    if done['error'] is not None:
+        raise done['error']
+    return done['id']
+
+def store_metrics(store: Dict) -> Dict:
+    with store['lock']:
+        out = dict(store['metrics'])
+    out['queue_depth'] = store['queue'].qsize()
+    return out
+
+def _run(store: Dict):
+    conn, q = store['conn'], store['queue']
+    while True:
+        group = [q.get()]
+        while len(group) < GROUP_COMMIT_ROWS:
+            try:
+                group.append(q.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with conn:
+                for table, values, done in group:
+                    done['id'] = conn.execute(_insert_sql(table), values).lastrowid
+        except Exception as e:
+            for _, _, done in group:
+                done['error'] = e
+        else:
+            with store['lock']:
+                m = store['metrics']
+                m['commits'] += 1
+                m['rows'] += len(group)
+                m['max_group'] = max(m['max_group'], len(group))
+        for _, _, done in group:
+            done['event'].set()
+
+
+# ---------- 読み出し・CSV への書き出し ----------
+def read_rows(path: Path, table: str) -> List[tuple]:
+    """表の行を保存順に、TABLES の列の並びの文字列のタプルで返す（読み取り専用の接続で読む）。"""
+    if not Path(path).exists():
+        return []
+    conn = sqlite3.connect(f'file:{Path(path).resolve().as_posix()}?mode=ro', uri=True)
+    try:
+        cols = ', '.join(f'"{c}"' for c in TABLES[table])
+        return conn.execute(f'SELECT {cols} FROM "{table}" ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+def export_csv(path: Path, table: str) -> bytes:
+    """表を CSV（ヘッダー付き、保存順）にして返す。データベースがなければヘッダーだけ。"""
+    buf = io.StringIO(newline='')
+    writer = csv.writer(buf, lineterminator='\r\n')
+    writer.writerow(TABLES[table])
+    writer.writerows(read_rows(path, table))
+    return buf.getvalue().encode('utf-8')
+
+def count_rows(path: Path, table: str) -> int:
+    if not Path(path).exists():
+        return 0
+    conn = sqlite3.connect(f'file:{Path(path).resolve().as_posix()}?mode=ro', uri=True)
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest='command', required=True)
+    ex = sub.add_parser('export', help='表を <表名>.csv に書き出す')
+    ex.add_argument('--db', type=Path, default=RESULTS_DB)
+    ex.add_argument('--out-dir', type=Path, default=Path('.'))
+    args = ap.parse_args()
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    for table in TABLES:
+        out = args.out_dir / f'{table}.csv'
+        out.write_bytes(export_csv(args.db, table))
+        print(f"{out}: {count_rows(args.db, table)} 行")
+
+
+if __name__ == '__main__':
+    main()
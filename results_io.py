@@ -0,0 +1,67 @@
+"""
+results.csv（段階的選択の結果）の列の符号化と、解析用の一括読み込み。
+
+パスは color_tree のノード番号（混合基数, uint16 に収まる）を pathCode 列に、
+段階ごとの反応時間は 8 個の uint32（リトルエンディアン）を16進文字列にしたものを stepRTsPacked 列に保存する。
+path（'31223121'）と stepRTs_ms（'812|604|...'）は人が読むための派生列として残しておく。
+読み込みは pathCode / stepRTsPacked を優先し、これらの列がない古い行だけ文字列の列から復元する。
+"""
+import csv
+from typing import Dict, List
+import numpy as np
+
+from color_tree import N_STEPS, encode_path, path_strings_to_codes
+
+RT_DTYPE = np.dtype('<u4')
+
+
+def pack_rts(rts: List[int]) -> str:
+    """段階ごとの反応時間（ms）を stepRTsPacked 列の文字列にする。"""
+    if len(rts) != N_STEPS:
+        raise ValueError(f"反応時間は {N_STEPS} 個である必要があります: {rts}")
+    return np.asarray(rts, dtype=RT_DTYPE).tobytes().hex()
+
+def unpack_rts_batch(packed) -> np.ndarray:
+    """stepRTsPacked 列の配列を (N, 8) の uint32 配列にする。"""
+    packed = list(packed)
+    if any(len(p) != N_STEPS * RT_DTYPE.itemsize * 2 for p in packed):
+        raise ValueError("stepRTsPacked 列に不正な値が含まれています")
+    return np.frombuffer(bytes.fromhex(''.join(packed)), dtype=RT_DTYPE).reshape(-1, N_STEPS).astype(np.uint32)
+
+def stage_columns(path: List[int], rts: List[int]) -> Dict:
+    """1試行分のパス（0始まり）と反応時間から、results.csv の符号化列と派生列を作る。"""
+    return {
+        'pathCode': encode_path(path),
+        'stepRTsPacked': pack_rts(rts),
+        'path': ''.join(str(d + 1) for d in path),
+        'stepRTs_ms': '|'.join(map(str, rts)),
+        'totalRT_ms': sum(rts),
+    }
+
+def load_stage_results(path: str = 'results.csv') -> Dict[str, np.ndarray]:
+    """
+    results.csv を列ごとの NumPy 配列として読み込む。
+    pathCode は uint16、stepRTs は (N, 8) の uint32。その他の列は文字列のまま返す。
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    n = len(rows)
+    codes = np.zeros(n, dtype=np.uint16)
+    rts = np.zeros((n, N_STEPS), dtype=np.uint32)
+
+    packed = np.array([bool(r.get('pathCode')) and bool(r.get('stepRTsPacked')) for r in rows], dtype=bool)
+    new_rows = np.nonzero(packed)[0]
+    old_rows = np.nonzero(~packed)[0]
+    if len(new_rows):
+        codes[new_rows] = np.array([int(rows[i]['pathCode']) for i in new_rows], dtype=np.uint16)
+        rts[new_rows] = unpack_rts_batch(rows[i]['stepRTsPacked'] for i in new_rows)
+    if len(old_rows):
+        codes[old_rows] = path_strings_to_codes([rows[i]['path'] for i in old_rows])
+        rts[old_rows] = np.array([rows[i]['stepRTs_ms'].split('|') for i in old_rows], dtype=np.uint32)
+
+    out = {key: np.array([r.get(key) or '' for r in rows], dtype=str)
+           for key in ('participant_id', 'audioName', 'finalHex', 'timestamp', 'paletteHash')}
+    out['trial'] = np.array([int(r['trial']) for r in rows], dtype=np.int32)
+    out['pathCode'] = codes
+    out['stepRTs'] = rts
+    return out
@@ -1,22 +1,35 @@
 import streamlit as st
-import time, random, io, csv, base64, os
+import time, random, os
 from typing import List, Dict
 import streamlit.components.v1 as components
 from pathlib import Path
 import json
 import gspread
-from google.oauth2.service_account import Credentials
-import traceback
-import time
-import math
+from color_tree import palette_color
+from palette_compiler import load_palette
+from hsl_lut import open_lut, lookup_hsl
+from selector_component import selector_palette, hierarchical_selector
+from results_io import stage_columns
+from stimuli import (new_stimulus_store, load_stimulus_file, STIMULUS_CACHE_NAME,
+                     new_stimulus_manifest, sync_manifest, manifest_add, manifest_remove,
+                     manifest_check_sound, load_manifest_stimuli)
+from player_component import audio_player
+from stimulus_server import mount_stimulus_route, ROUTE_URL as STIMULUS_ROUTE_URL
+from ingest import stimulus_rendition
+from thumbnails import thumbnail_for
+from sheet_writer import new_sheet_writer, enqueue_rows, writer_metrics
+import fake_sheets
+from result_store import new_result_store, insert_row, export_csv, RESULTS_DB, TABLES
+from html import escape as html_escape
 
 # ---------- 設定 ----------
 st.set_page_config(page_title="色選択手法比較実験", layout="wide")
-RESULTS_CSV = 'results.csv'
-COLOR_RESULTS_CSV = 'color_results.csv'
 UPLOAD_DIR = Path('uploads')
 UPLOAD_DIR.mkdir(exist_ok=True)
-META_RESULTS_CSV = 'meta_results.csv'
+PALETTE_SCHEME = 'sc'  # static/palettes/ のコンパイル済み色表（palette_compiler.py）
+LISTEN_SLACK_SEC = 0.25  # 再生終了の判定で、再生した時間が刺激の長さに足りなくてもよい秒数
+# このページに来た時に、セッションで溜めた結果を Google Sheets に送る（タスクの区切り）
+SHEET_FLUSH_PAGES = ('questionnaire', 'post_questionnaire', 'final_survey', 'end')
 
 
 
@@ -43,80 +56,135 @@ def safe_rerun():
     except Exception:
         return
 
-def clamp(v, a, b):
-    return max(a, min(b, v))
-
-def path_to_hsl_separated(path: List[int]):
-    baseHues = [0, 60, 120, 180, 240, 300]
-    hueDeltas = [0, 30, 15, 8, 4, 2, 1, 0.5] 
-    satBase = 70
-    lightBase = 50
-    stepAttribute = ['hue','hue','hue','lightness','lightness','saturation','saturation','final']
-    filled = path + [1] * (8 - len(path))
-    H = baseHues[filled[0]] if filled[0] < len(baseHues) else 0
-    S = satBase
-    L = lightBase
-    for i in range(1, 8):
-        m = filled[i] - 1
-        attr = stepAttribute[i]
-        if attr == 'hue':
-            delta = hueDeltas[i] if i < len(hueDeltas) else 5
-            H += m * delta
-        elif attr == 'saturation':
-            satChange = 25 if i == 5 else 15 
-            S += m * satChange
-        elif attr == 'lightness':
-            lightChange = 20 if i == 3 else 10
-            L += m * lightChange
-        elif attr == 'final':
-            H += m * 1.5
-            S += m * 2
-            L += m * 1.2
-    H = (H % 360 + 360) % 360
-    S = clamp(round(S), 8, 95)
-    L = clamp(round(L), 3, 95)
-    return {'H': H, 'S': S, 'L': L}
-
-def hsl_to_hex(hsl: Dict[str, float]):
-    h = hsl['H'] / 360.0
-    s = hsl['S'] / 100.0
-    l = hsl['L'] / 100.0
-    def hue2rgb(p, q, t):
-        if t < 0: t += 1
-        if t > 1: t -= 1
-        if t < 1/6: return p + (q - p) * 6 * t
-        if t < 1/2: return q
-        if t < 2/3: return p + (q - p) * (2/3 - t) * 6
-        return p
-    if s == 0:
-        r = g = b = l
-    else:
-        q = l * (1 + s) if l < 0.5 else l + s - l * s
-        p = 2 * l - q
-        r = hue2rgb(p, q, h + 1/3)
-        g = hue2rgb(p, q, h)
-        b = hue2rgb(p, q, h - 1/3)
-    def to_hex(x):
-        return format(int(round(x * 255)), '02x')
-    return f"#{to_hex(r)}{to_hex(g)}{to_hex(b)}"
+@st.cache_resource
+def get_palette_table():
+    """選択木の全ノードの色テーブル（コンパイル済みの色表をプロセスごとに一度だけ読み込み、全セッションで共有）。"""
+    return load_palette(PALETTE_SCHEME)
+
+def node_color(path: List[int]) -> Dict:
+    """パス（途中段階でもよい）の色 {'hex','H','S','L'} をテーブルから引く。"""
+    return palette_color(get_palette_table(), path)
+
+@st.cache_resource
+def get_selector_palette():
+    """段階的選択コンポーネントに渡す全ノードの色（色表から一度だけ作る）。"""
+    return selector_palette(get_palette_table())
+
+def stimulus_rendition_enabled() -> bool:
+    """
+    WAV の刺激を軽量版（ingest.py: モノラル・前後の無音なし・低いサンプリング周波数）で配信するか。
+    刺激の帯域が変わるので既定では使わず、secrets.toml で stimulus_rendition = true にした時だけ使う。
+    uploads/ の元ファイルは変えない。
+    """
+    try:
+        return bool(st.secrets.get("stimulus_rendition", False))
+    except Exception:
+        return False
 
+@st.cache_resource
+def get_stimulus_store():
+    """全セッションで共有する音刺激ストア（音声データは内容ハッシュごとに1つ、読み取り専用で保持）。"""
+    return new_stimulus_store(render=stimulus_rendition if stimulus_rendition_enabled() else None)
 
+@st.cache_resource
+def get_stimulus_manifest():
+    """uploads/ の目録（起動時に一度だけディレクトリと突き合わせ、以後はアップロード・削除で更新する）。"""
+    return new_stimulus_manifest(UPLOAD_DIR)
 
-def render_audio_player(audio_bytes: bytes, mime: str='audio/wav', autoplay=False, loop=False, height=90):
-    if audio_bytes is None:
-        st.write("音声ファイルが読み込まれていません。")
+@st.cache_resource
+def get_stimulus_route() -> bool:
+    """/stimulus/ の配信ルートを Streamlit のサーバーに追加する（できなければ False で app/static/ の URL を使う）。"""
+    return mount_stimulus_route()
+
+def stimulus_url(entry: Dict) -> str:
+    """音刺激の URL（/stimulus/ ルートがあればそちら）。"""
+    return f"{STIMULUS_ROUTE_URL}/{entry['file']}" if get_stimulus_route() else entry['url']
+
+def stimulus_duration(entry: Dict):
+    """配信している音刺激の長さ（秒。軽量版ならその長さ、そうでなければ目録にヘッダーから求めた値があれば）。"""
+    rendition = entry.get('rendition')
+    if rendition and rendition.get('converted'):
+        return rendition['seconds']
+    record = get_stimulus_manifest()['files'].get(entry['safe_name'])
+    return record.get('duration') if record else None
+
+def stimulus_thumbnail(entry: Dict):
+    """音刺激の波形サムネイル（PNG のパス）。アップロード時に作るが、なければここで作る。作れなければ None。"""
+    try:
+        return thumbnail_for(UPLOAD_DIR / entry['safe_name'], entry['hash'])
+    except Exception:
+        return None
+
+def format_size(size: int) -> str:
+    return f"{size / 1024:,.0f} KB" if size < 1024 * 1024 else f"{size / 1024 / 1024:,.1f} MB"
+
+def listened_to_end(playback, entry: Dict) -> bool:
+    """プレーヤーから1回再生の終了が届き、再生した時間が刺激の長さに届いていれば True。"""
+    if not playback or playback.get('event') != 'ended':
+        return False
+    duration = stimulus_duration(entry) or playback.get('duration') or 0
+    return playback.get('played', 0) >= duration - LISTEN_SLACK_SEC
+
+def audio_entry(i: int) -> Dict:
+    """このセッションの i 番目の音刺激。セッションの audio_files にはストアの番号だけが入っている。"""
+    return get_stimulus_store()['entries'][st.session_state['audio_files'][i]]
+
+@st.cache_resource
+def get_hsl_lut():
+    """RGB→HSL ルックアップテーブル（cache/ にあれば memmap で開く。なければ None で逐次計算）。"""
+    return open_lut()
+
+def render_stimulus_preloader(urls: List[str], height=70):
+    """
+    このセッションで使う音声を再生順にブラウザの Cache Storage に先読みし、進み具合を表示する。
+    Cache Storage が使えない場合（http で localhost 以外など）は fetch だけ行い、HTTP キャッシュに載せる。
+    """
+    if not urls:
         return
-    b64 = base64.b64encode(audio_bytes).decode('ascii')
-    autoplay_attr = 'autoplay' if autoplay else ''
-    loop_attr = 'loop' if loop else ''
     html = f"""
-    <audio controls {autoplay_attr} {loop_attr} style="width:100%">
-      <source src="data:{mime};base64,{b64}">
-      Your browser does not support the audio element.
-    </audio>
+    <div style="font-family:sans-serif;font-size:14px;color:#31333f">
+      <div id="label">音声を読み込んでいます... 0 / {len(urls)}</div>
+      <progress id="bar" max="{len(urls)}" value="0" style="width:100%;height:14px"></progress>
+    </div>
+    <script>
+    (async () => {{
+      const urls = {json.dumps(urls)};
+      const label = document.getElementById('label'), bar = document.getElementById('bar');
+      let cache = null, done = 0, failed = 0;
+      try {{ if ('caches' in window) cache = await caches.open({json.dumps(STIMULUS_CACHE_NAME)}); }} catch (e) {{}}
+      for (const url of urls) {{
+        try {{
+          if (!(cache && await cache.match(url))) {{
+            const res = await fetch(url);
+            if (!res.ok) throw new Error(res.status);
+            if (cache) await cache.put(url, res); else await res.arrayBuffer();
+          }}
+        }} catch (e) {{ failed++; }}
+        done++;
+        bar.value = done;
+        label.textContent = '音声を読み込んでいます... ' + done + ' / ' + urls.length;
+      }}
+      // 今回使わない古い刺激は消しておく（ファイル名に内容ハッシュが入っているので、残っていても害はない）
+      if (cache) {{
+        const keep = new Set(urls.map(u => new URL(u, document.baseURI).href));
+        for (const req of await cache.keys()) if (!keep.has(req.url)) await cache.delete(req);
+      }}
+      label.textContent = failed ? '音声の読み込みに失敗したファイルがあります（' + failed + ' 件）。再生時に読み込みます。'
+                                 : '音声の読み込みが完了しました（' + urls.length + ' 件）';
+    }})();
+    </script>
     """
     components.html(html, height=height)
 
+def session_stimulus_urls() -> List[str]:
+    """このセッションの試行順（段階的選択 → カラーピッカー）で使う音声の URL（重複なし）。"""
+    order = st.session_state.get('trials_order', []) + st.session_state.get('color_trials_order', [])
+    urls = []
+    for i in order:
+        if i is not None and stimulus_url(audio_entry(i)) not in urls:
+            urls.append(stimulus_url(audio_entry(i)))
+    return urls
+
 def safe_filename(name: str) -> str:
     name = os.path.basename(name)
     return "".join(c for c in name if c.isalnum() or c in "._-")
@@ -178,90 +246,93 @@ def create_non_repeating_trials(stimuli_indices: List[int], repeats: int) -> Lis
     return trial_list
 
 @st.cache_resource
-def get_gspread_client():
+def get_sheet_writer():
+    """
+    Google Sheets への書き込みキュー（プロセスに1つ）。接続と書き込みは裏のスレッドで行う。
+    環境変数 FAKE_GSHEETS があれば本物の代わりに fake_sheets の偽物に書く。認証情報が設定されていなければ None。
+    """
+    fake = fake_sheets.client_from_env()
+    if fake is not None:
+        return new_sheet_writer(lambda: fake.open_by_key(fake_sheets.FAKE_SHEET_KEY))
     try:
-        creds = st.secrets["gcp_service_account"]
+        creds = dict(st.secrets["gcp_service_account"])
         key = st.secrets["google_sheet_key"]
-        gc = gspread.service_account_from_dict(creds)
-        sh = gc.open_by_key(key)
-        return sh
     except Exception as e:
-        st.error(f"Google Sheets への接続に失敗しました: {e}")
+        st.error(f"Google Sheets の設定が読み込めません: {e}")
         return None
+    return new_sheet_writer(lambda: gspread.service_account_from_dict(creds).open_by_key(key))
 
-def append_to_gsheet(worksheet_name: str, header: List[str], row_data: Dict):
+def append_to_gsheet(worksheet_name: str, header: List[str], rows: List[Dict]):
     """
-    指定されたワークシートにヘッダーを確認し、データを1行追記する
+    指定されたワークシートに複数行を1回で追記する（キューに入れるだけで、API の応答は待たない）
     """
-    sh = get_gspread_client()
-    if sh is None:
+    writer = get_sheet_writer()
+    if writer is None:
         st.error("GSheet接続がないため、ログを保存できません。")
         return
+    values_to_append = [[row_data.get(key, "") for key in header] for row_data in rows]
+    if not enqueue_rows(writer, worksheet_name, values_to_append):
+        # キューが満杯（Sheets 側が長く止まっている）。行はローカルの results.db には残っている
+        st.warning(f"'{worksheet_name}' の Google Sheets への書き込みが混み合っています（ローカルには保存済み）。")
 
+# ---------------- 結果の保存（SQLite）+ Google Sheets ----------------
+@st.cache_resource
+def get_result_store():
+    """結果のデータベース（プロセスに1つ。書き込みは1本の接続でまとめてコミットする。result_store.py）。"""
+    return new_result_store(RESULTS_DB)
+
+def sheets_live_append() -> bool:
+    """
+    結果を1件ずつ Google Sheets にも追記するか。secrets.toml で sheets_live_append = false にすると
+    データベースに保存するだけにし、Sheets へは sheets_sync.py でまとめて送る。
+    """
     try:
-        wks = sh.worksheet(worksheet_name)
-    except gspread.exceptions.WorksheetNotFound:
-        st.error(f"ワークシート '{worksheet_name}' が見つかりません。")
-        return
-    
-    try:
+        return bool(st.secrets.get("sheets_live_append", True))
+    except Exception:
+        return True
 
-        values_to_append = [row_data.get(key, "") for key in header]
-        
-        # 3. 最終行に追記
-        wks.append_row(values_to_append, value_input_option='USER_ENTERED')
-        
+def save_record(table: str, row: dict):
+    """
+    1件の結果をデータベースに保存し（コミットまで待つので、セッションが途中で切れても残る）、
+    Google Sheets に送る分はセッションに溜めておく（タスクの区切りで flush_sheet_buffer がまとめて送る）。
+    """
+    try:
+        insert_row(get_result_store(), table, row)
     except Exception as e:
-        # 同時書き込み競合などでエラーが起きても実験が停止しないようにする
-        st.error(f"'{worksheet_name}' へのログ書き込みに失敗: {e}")
+        st.error(f"結果の保存に失敗 ({table}): {e}")
+    if sheets_live_append():
+        st.session_state.setdefault('sheet_buffer', []).append((table, row))
 
-# ---------------- 既存CSV保存 + Google Sheets 両対応関数 ----------------
-# 既存の append_result_csv 等の代替として使います。呼び出し箇所を置換してください。
+def flush_sheet_buffer():
+    """
+    セッションで溜めた結果をワークシートごとに1回の append_rows で送る（書き込みキューに入れるだけ）。
+    送る前にセッションが切れた分は results.db に残っているので、sheets_sync.py で送れる。
+    その間に sheets_sync.py が送った行は、書き込みキューが送る前にシートのキーと突き合わせて飛ばす。
+    """
+    buffer = st.session_state.get('sheet_buffer')
+    if not buffer:
+        return
+    st.session_state['sheet_buffer'] = []
+    groups = {}
+    for table, row in buffer:
+        groups.setdefault(table, []).append(row)
+    for table, rows in groups.items():
+        try:
+            append_to_gsheet(table, TABLES[table], rows)
+        except Exception as e:
+            st.warning(f"Google Sheets 書込失敗 ({table}): {e}")
 
 def append_result_csv_and_sheet(row: dict):
-    """段階的選択結果をローカルCSVに追記し、Google Sheets にも append する。"""
-    header = ['participant_id','trial','audioName','path','finalHex','finalH','finalS','finalL','stepRTs_ms','totalRT_ms','timestamp','practice','loop_playback_used','reset_count']
-    # ローカルCSV保存（既存の実装と同様）
-    exists = os.path.exists(RESULTS_CSV)
-    with open(RESULTS_CSV, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=header)
-        if not exists:
-            writer.writeheader()
-        writer.writerow(row)
-    # Google Sheets 保存（失敗しても処理続行）
-    try:
-        append_to_gsheet("results", header, row)
-    except Exception as e:
-        st.warning(f"Google Sheets 書込失敗 (results): {e}")
+    """段階的選択結果を保存する。"""
+    save_record("results", row)
 
 def append_color_csv_and_sheet(row: dict):
-    """色選択結果をローカルCSVに追記し、Google Sheets にも append する。"""
-    header = ['participant_id','trial','audioName','pickedHex','pickedH','pickedS','pickedL','timestamp','loop_playback_used', 'totalRT_ms']
-    exists = os.path.exists(COLOR_RESULTS_CSV)
-    with open(COLOR_RESULTS_CSV, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=header)
-        if not exists:
-            writer.writeheader()
-        writer.writerow(row)
-    try:
-        append_to_gsheet("color_results", header, row)
-    except Exception as e:
-        st.warning(f"Google Sheets 書込失敗 (color_results): {e}")
+    """色選択結果を保存する。"""
+    save_record("color_results", row)
 
 def append_meta_csv_and_sheet(row: dict):
-    """メタ情報をローカルCSVに追記し、Google Sheets にも append する。"""
-    # meta のヘッダは既存の定義に合わせてください（例: q1..q18 等）
-    header = ['participant_id','task_order','timestamp'] + [f"q{i}" for i in range(1,19)] + ['n_color_picks','n_hierarchical_trials']
-    exists = os.path.exists(META_RESULTS_CSV)
-    with open(META_RESULTS_CSV, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=header)
-        if not exists:
-            writer.writeheader()
-        writer.writerow(row)
-    try:
-        append_to_gsheet("meta_results", header, row)
-    except Exception as e:
-        st.warning(f"Google Sheets 書込失敗 (meta_results): {e}")
+    """メタ情報を保存する。"""
+    save_record("meta_results", row)
 
 # ---------- session 初期化 ----------
 if 'page' not in st.session_state:
@@ -274,7 +345,7 @@ if 'task_order' not in st.session_state:
     random.shuffle(tasks)
     st.session_state['task_order'] = tasks
 
-if 'audio_files' not in st.session_state: st.session_state['audio_files'] = []
+if 'audio_files' not in st.session_state: st.session_state['audio_files'] = []  # 共有ストアの番号（audio_entry で引く）
 if 'trials_order' not in st.session_state: st.session_state['trials_order'] = []
 if 'current_trial_index' not in st.session_state: st.session_state['current_trial_index'] = 0
 if 'results' not in st.session_state: st.session_state['results'] = []
@@ -303,28 +374,26 @@ if 'reset_counts' not in st.session_state:
     st.session_state['reset_counts'] = {}
 if 'color_picker_start_time' not in st.session_state:
     st.session_state['color_picker_start_time'] = None
-# ---------- uploads/ からの自動読み込み（参加者用） ----------
-if not st.session_state.get('audio_files'):
+# ---------- uploads/ の目録からの読み込み（参加者用） ----------
+# 目録の版が変わっていれば読み直す。ただし試行を始めたセッションは刺激の並びを変えない
+# （どちらかの課題のページに入った、または試行が1つでも進んだら開始済みとする。段階的選択の結果は
+# session_state['results'] に積まれないので、結果の有無では判断できない）
+manifest = get_stimulus_manifest()
+get_stimulus_route()   # 音声を使うページより前に /stimulus/ ルートを用意しておく
+not_started = (st.session_state['current_trial_index'] == 0 and st.session_state['color_trial_index'] == 0
+               and st.session_state.get('page') not in ('stage', 'color_picker'))
+if not st.session_state.get('audio_files') or (
+        not_started and st.session_state.get('manifest_version') != manifest['version']):
     try:
-        files_on_disk = sorted([
-            p for p in UPLOAD_DIR.iterdir() 
-            if p.is_file() and not p.name.startswith('_check_sound.')
-        ])
-    except Exception:
-        files_on_disk = []
-    if files_on_disk:
-        st.session_state['audio_files'] = []
-        for p in files_on_disk:
-            try:
-                with open(p, 'rb') as f: data = f.read()
-                ext = p.suffix.lower().lstrip('.')
-                mime = 'audio/wav'
-                if ext in ['mp3']: mime = 'audio/mpeg'
-                elif ext in ['ogg']: mime = 'audio/ogg'
-                elif ext in ['m4a','mp4','aac']: mime = 'audio/mp4'
-                st.session_state['audio_files'].append({'id': f"disk_{p.stem}", 'name': p.name, 'safe_name': p.name, 'data': data, 'mime': mime})
-            except Exception as e:
-                st.warning(f"failed to load {p.name}: {e}")
+        loaded = load_manifest_stimuli(get_stimulus_store(), manifest)
+    except Exception as e:
+        st.warning(f"failed to load uploads: {e}")
+        loaded = []
+    if loaded != st.session_state['audio_files']:
+        st.session_state['audio_files'] = loaded
+        st.session_state['trials_order'] = []
+    st.session_state['manifest_version'] = manifest['version']
+    if loaded:
         if not st.session_state.get('trials_order'):
             n = len(st.session_state['audio_files'])
             if n == 0:
@@ -350,6 +419,9 @@ def go_to(p):
     st.session_state['page'] = p
     safe_rerun()
 
+if st.session_state.get('page') in SHEET_FLUSH_PAGES:
+    flush_sheet_buffer()
+
 # ---------- 管理者判定 ----------
 # ---------- 管理者判定（隠しURL: 管理者ログインを出す） ----------
 import hashlib
@@ -425,14 +497,13 @@ if st.session_state.get("is_admin", False):
         st.markdown("---")
         st.subheader("音量チェック用 サウンド設定")
         
-        # チェックサウンドのファイルパスをglobで探す
+        # チェックサウンド（_check_sound.*）は目録から探す
         current_check_sound_path = None
         current_check_sound_name = None
-        # _check_sound.* という名前のファイルを探す
-        check_sound_files = list(UPLOAD_DIR.glob('_check_sound.*'))
-        if check_sound_files:
-            current_check_sound_path = check_sound_files[0]
-            current_check_sound_name = current_check_sound_path.name
+        check_record = manifest_check_sound(get_stimulus_manifest())
+        if check_record:
+            current_check_sound_name = check_record['name']
+            current_check_sound_path = UPLOAD_DIR / current_check_sound_name
 
         uploaded_check = st.file_uploader(
             "音量チェック専用の音声ファイルをアップロード ( .wav, .mp3, .ogg, .m4a )", 
@@ -452,10 +523,13 @@ if st.session_state.get("is_admin", False):
                 # 既存のチェックサウンド（違う拡張子でも）を削除
                 if current_check_sound_path and current_check_sound_path.exists():
                     current_check_sound_path.unlink()
+                if current_check_sound_name:
+                    manifest_remove(get_stimulus_manifest(), current_check_sound_name)
                     
                 # 新しいファイルを保存
                 with open(new_check_sound_path, 'wb') as out:
                     out.write(data)
+                manifest_add(get_stimulus_manifest(), new_check_sound_path)
                 
                 st.success(f"音量チェック用サウンドを '{new_check_sound_name}' として保存しました。")
                 # ページを再読み込みして下の表示に反映
@@ -464,20 +538,15 @@ if st.session_state.get("is_admin", False):
             except Exception as e:
                 st.error(f"チェックサウンドの保存に失敗: {e}")
 
-        # 現在のチェックサウンドを表示・再生
+        # 現在のチェックサウンドを表示・再生（音声確認ページと同じく共有ストアの URL から再生し、
+        # 目録のサイズと更新時刻が変わらない限りファイルを読み直さない）
         if current_check_sound_path:
             st.write(f"現在のチェックサウンド: **{current_check_sound_name}**")
             try:
-                with open(current_check_sound_path, 'rb') as f:
-                    check_data = f.read()
-                # Mimeタイプを推測
-                ext = current_check_sound_path.suffix.lower()
-                mime = 'audio/wav'
-                if ext == '.mp3': mime = 'audio/mpeg'
-                elif ext == '.ogg': mime = 'audio/ogg'
-                elif ext in ['.m4a', '.mp4', '.aac']: mime = 'audio/mp4'
-                
-                render_audio_player(check_data, mime=mime, autoplay=False, loop=False, height=90)
+                check_entry = get_stimulus_store()['entries'][load_stimulus_file(
+                    get_stimulus_store(), current_check_sound_path, stamp=(check_record['mtime_ns'], check_record['size']))]
+                audio_player(stimulus_url(check_entry), mode='once', autoplay=False,
+                             token=check_entry['hash'], key='admin_check_player')
             except Exception as e:
                 st.error(f"チェックサウンドの読み込み/再生に失敗: {e}")
         else:
@@ -493,30 +562,20 @@ if st.session_state.get("is_admin", False):
         saved_count = 0
         for f in uploaded:
             try:
-                data = f.read()
+                # uploads/ には元のファイルをそのまま保存する（軽量版は配信する時に cache/ingest/ から作る）
                 safe_name = safe_filename(f.name)
                 save_path = UPLOAD_DIR / safe_name
                 with open(save_path, 'wb') as out:
-                    out.write(data)
+                    out.write(f.read())
+                record = manifest_add(get_stimulus_manifest(), save_path)
+                thumbnail_for(save_path, record['hash'])
                 saved_count += 1
             except Exception as e:
                 st.error(f"ファイル保存に失敗しました ({f.name}): {e}")
         
-        reloaded = []
         try:
-            files_on_disk = sorted([
-                p for p in UPLOAD_DIR.iterdir() 
-                if p.is_file() and not p.name.startswith('_check_sound.')
-            ])
-            for p in files_on_disk:
-                with open(p, 'rb') as fh: data = fh.read()
-                ext = p.suffix.lower().lstrip('.')
-                mime = 'audio/wav'
-                if ext in ['mp3']: mime = 'audio/mpeg'
-                elif ext in ['ogg']: mime = 'audio/ogg'
-                elif ext in ['m4a','mp4','aac']: mime = 'audio/mp4'
-                reloaded.append({'id': f"disk_{p.stem}", 'name': p.name, 'safe_name': p.name, 'data': data, 'mime': mime})
-            st.session_state['audio_files'] = reloaded
+            st.session_state['audio_files'] = load_manifest_stimuli(get_stimulus_store(), get_stimulus_manifest())
+            st.session_state['manifest_version'] = get_stimulus_manifest()['version']
         except Exception as e:
             st.error(f"uploads フォルダ読み込み失敗: {e}")
 
@@ -538,6 +597,13 @@ if st.session_state.get("is_admin", False):
         st.success(f"{saved_count} 件を保存・反映しました（合計 {n} 件）。")
         safe_rerun()
 
+    if st.button("uploads フォルダを再スキャン"):
+        # uploads/ に直接ファイルを置いた・消した場合に目録へ反映する
+        if sync_manifest(get_stimulus_manifest()):
+            st.success("uploads フォルダの変更を反映しました。")
+        else:
+            st.info("変更はありませんでした。")
+
     if st.button("手動: トライアル順リセット＆実験初期化"):
         n = len(st.session_state.get('audio_files', []))
         st.session_state['trials_order'] = list(range(n)) if n > 0 else [None]
@@ -559,35 +625,69 @@ if st.session_state.get("is_admin", False):
 
     st.markdown("---")
     st.subheader("現在読み込まれているファイル（管理）")
+    if stimulus_rendition_enabled():
+        st.warning("WAV の刺激は軽量版（モノラル・前後の無音なし・低いサンプリング周波数）で配信しています"
+                   "（secrets.toml の stimulus_rendition）。uploads/ の元ファイルは変えていません。"
+                   "サンプリング周波数の半分より高い音は参加者に届きません。")
     audio_list = st.session_state.get('audio_files', [])
     if not audio_list:
         st.write("まだファイルが読み込まれていません。")
     else:
-        for idx, a in enumerate(audio_list):
-            cols = st.columns([3,1,1,1,1])
-            with cols[0]: st.markdown(f"**{idx+1}. {a.get('name')}**")
+        # 一覧には名前・長さ・サイズ・サムネイルだけを出し、音声そのものは再生・ダウンロードの時に URL から取りに行く
+        for idx in range(len(audio_list)):
+            a = audio_entry(idx)
+            cols = st.columns([3,3,1,1,1])
+            with cols[0]:
+                st.markdown(f"**{idx+1}. {a.get('name')}**")
+                duration = stimulus_duration(a)
+                st.caption((f"{duration:.1f} 秒 / " if duration else "") + format_size(a.get('size', 0)))
+                rendition = a.get('rendition')
+                if rendition and rendition.get('converted'):
+                    st.caption(f"配信: 軽量版 {rendition['rate']:,} Hz モノラル（帯域 ~{rendition['rate'] // 2:,} Hz）, "
+                               f"{format_size(rendition['size'])}")
             with cols[1]:
+                thumb = stimulus_thumbnail(a)
+                if thumb: st.image(str(thumb), use_container_width=True)
+            with cols[2]:
                 if st.button("再生", key=f"play_{a.get('safe_name')}_{idx}"):
-                    render_audio_player(a.get('data'), mime=a.get('mime'), autoplay=True, loop=False, height=100)
-            with cols[2]: st.download_button(f"Download", data=a.get('data'), file_name=a.get('name'), mime=a.get('mime'), key=f"dl_{a.get('safe_name')}_{idx}")
+                    st.session_state['admin_playing'] = a.get('safe_name')
             with cols[3]:
+                st.markdown(f'<a href="{html_escape(stimulus_url(a))}" download="{html_escape(a.get("name"))}">Download</a>',
+                            unsafe_allow_html=True)
+            with cols[4]:
                 if st.button("削除", key=f"del_{a.get('safe_name')}_{idx}"):
                     filepath = UPLOAD_DIR / a.get('safe_name')
                     if filepath.exists(): filepath.unlink()
-                    st.session_state['audio_files'] = [x for x in st.session_state['audio_files'] if x.get('safe_name') != a.get('safe_name')]
+                    manifest_remove(get_stimulus_manifest(), a.get('safe_name'))
+                    entries = get_stimulus_store()['entries']
+                    st.session_state['audio_files'] = [x for x in st.session_state['audio_files'] if entries[x]['safe_name'] != a.get('safe_name')]
                     st.success(f"{a.get('safe_name')} を削除しました。反映するには「手動リセット」を押してください。")
                     safe_rerun()
+            if st.session_state.get('admin_playing') == a.get('safe_name'):
+                audio_player(stimulus_url(a), mode='once', autoplay=True, token=a.get('safe_name'), key='admin_player')
     st.markdown("---")
     st.header("ログ / 結果のダウンロード")
-    if os.path.exists(RESULTS_CSV):
-        with open(RESULTS_CSV, 'r', encoding='utf-8') as f:
-            st.download_button("results.csv をダウンロード", data=f.read(), file_name="results.csv", mime="text/csv")
-    if os.path.exists(COLOR_RESULTS_CSV):
-        with open(COLOR_RESULTS_CSV, 'r', encoding='utf-8') as f:
-            st.download_button("color_results.csv をダウンロード", data=f.read(), file_name="color_results.csv", mime="text/csv")
-    if os.path.exists(META_RESULTS_CSV):
-        with open(META_RESULTS_CSV, 'r', encoding='utf-8') as f:
-            st.download_button("meta_results.csv をダウンロード", data=f.read(), file_name="meta_results.csv", mime="text/csv")
+    writer = get_sheet_writer()
+    if writer is not None:
+        m = writer_metrics(writer)
+        cols = st.columns(4)
+        cols[0].metric("Sheets 書き込み待ち", m['pending'])
+        cols[1].metric("書き込み済み", m['written'],
+                       help=f"ほかに、シートに既にあったため送らなかった行 {m['already_present']} 行")
+        cols[2].metric("失敗 / 破棄", f"{m['failed']} / {m['dropped']}")
+        latency = m['last_flush_latency_s']
+        cols[3].metric("直近の遅延", f"{latency:.1f} 秒" if latency is not None else "-",
+                       help=f"最大 {m['max_flush_latency_s']:.1f} 秒, 再試行 {m['retries']} 回")
+        if m['last_error']:
+            st.caption(f"最後のエラー（{m['last_error_at']}）: {m['last_error']}")
+    # CSV は results.db から書き出す（以前の results.csv や results.v1.csv などは最初の起動時に取り込み済み）
+    result_store = get_result_store()
+    for file_name, imported in result_store['imports'].items():
+        if 'error' in imported:
+            st.warning(f"{file_name} を取り込めませんでした: {imported['error']}")
+    for table in TABLES:
+        st.download_button(f"{table}.csv をダウンロード", data=export_csv(result_store['path'], table),
+                           file_name=f"{table}.csv", mime="text/csv")
 
 # 参加者ページフロー
 elif st.session_state.get('page') == 'consent':
@@ -638,44 +738,44 @@ elif st.session_state.get('page') == 'audio_check':
     """)
 
     st.subheader("1. 音の確認")
+    # 実験で使う音声をここで先に読み込んでおく（以降の試行はブラウザ内のコピーから再生される）
+    render_stimulus_preloader(session_stimulus_urls())
     st.markdown("---")
-    check_sound_data, check_sound_mime, check_sound_name = None, None, None
-    check_sound_files = list(UPLOAD_DIR.glob('_check_sound.*'))
-    if check_sound_files:
-        check_sound_path = check_sound_files[0]
+    check_sound_mime, check_sound_name, check_sound_url = None, None, None
+    check_record = manifest_check_sound(get_stimulus_manifest())
+    if check_record:
+        check_sound_path = UPLOAD_DIR / check_record['name']
         try:
-            with open(check_sound_path, 'rb') as f:
-                check_sound_data = f.read()
-            
-            ext = check_sound_path.suffix.lower()
-            check_sound_mime = 'audio/wav'
-            if ext == '.mp3': check_sound_mime = 'audio/mpeg'
-            elif ext == '.ogg': check_sound_mime = 'audio/ogg'
-            elif ext in ['.m4a', '.mp4', '.aac']: check_sound_mime = 'audio/mp4'
+            check_entry = get_stimulus_store()['entries'][load_stimulus_file(
+                get_stimulus_store(), check_sound_path, stamp=(check_record['mtime_ns'], check_record['size']))]
+            check_sound_mime = check_entry['mime']
+            check_sound_url = stimulus_url(check_entry)
             check_sound_name = check_sound_path.name
             # st.write(f"再生ファイル: **{check_sound_name}**")
 
         except Exception as e:
             st.error(f"チェックサウンドの読み込みに失敗: {e}")
-            check_sound_data = None
+            check_sound_url = None
     
     # フォールバック: _check_sound がない場合、audio_files[0] を使う
-    if check_sound_data is None and st.session_state.get('audio_files'):
+    if check_sound_url is None and st.session_state.get('audio_files'):
         st.info("管理者設定のチェックサウンドが見つかりません。実験用の最初の音源を再生します。")
         try:
-            first = st.session_state['audio_files'][0]
-            check_sound_data = first['data']
+            first = audio_entry(0)
             check_sound_mime = first.get('mime','audio/wav')
             check_sound_name = first.get('name')
+            check_sound_url = stimulus_url(first)
             st.write(f"再生ファイル: **{check_sound_name}**")
         except Exception:
             st.error("実験用音源の読み込みにも失敗しました。")
 
     # 再生UIの描画
-    if check_sound_data:
+    if check_sound_url:
         # 通常の1回再生
         st.info("まず、下の再生ボタンを押して音を一度最後までお聞きください。")
-        render_audio_player(check_sound_data, mime=check_sound_mime, autoplay=False, loop=False)
+        # 1回再生とループ再生は同じプレーヤーで切り替える（再実行してもプレーヤーは作り直されない）
+        audio_player(check_sound_url, mode='loop' if st.session_state.get('audio_check_continuous_play') else 'once',
+                     autoplay=False, key="check_player")
 
         st.markdown("---")
         # ループ再生コントロール (本番タスクと同様)
@@ -689,7 +789,6 @@ elif st.session_state.get('page') == 'audio_check':
         
         if st.session_state.get('audio_check_continuous_play'):
             st.write("ループ再生中...")
-            render_audio_player(check_sound_data, mime=check_sound_mime, autoplay=True, loop=True)
     else:
         st.error("再生できる音量チェック用の音声ファイルがありません。管理者に連絡してください。")
 
@@ -716,49 +815,12 @@ elif st.session_state.get('page') == 'audio_check':
 
         st.write("左の指示に従って、慣れるまで操作を繰り返してみてください。")
 
-        # セッションから現在のテストパスを取得
-        current_test_path = st.session_state.get('test_stage_path', [])
-        current_step_number = len(current_test_path) + 1
-
-        if current_step_number > 8:
-            # 8段階終了時の表示
-            st.write(f"テスト完了 (8/8)")
-            try:
-                final_hsl = path_to_hsl_separated(current_test_path)
-                final_hex = hsl_to_hex(final_hsl)
-                st.markdown(f'<div style="height:80px;border-radius:5px;background:{final_hex};"></div>', unsafe_allow_html=True)
-                # st.caption(f"最終色: {final_hex}")
-            except Exception as e:
-                st.error(f"テスト色描画エラー: {e}")
-            
-            if st.button("もう一度テストする", key="test_stage_reset_final"):
-                st.session_state['test_stage_path'] = [] # パスをリセット
-                safe_rerun()
-        else:
-            # 途中の段階の表示
-            st.write(f"段階 {current_step_number} / 8")
-            try:
-                if current_step_number == 1:
-                    options = [{'digit': d, 'hex': hsl_to_hex(path_to_hsl_separated(current_test_path + [d]))} for d in range(6)]
-                    test_cols = st.columns(6)
-                else:
-                    options = [{'digit': d, 'hex': hsl_to_hex(path_to_hsl_separated(current_test_path + [d]))} for d in [0,1,2]]
-                    test_cols = st.columns(3)
-                
-                for i, opt in enumerate(options):
-                    with test_cols[i]:
-                        st.markdown(f'<div style="height:80px;border-radius:5px;background:{opt["hex"]};"></div>', unsafe_allow_html=True)
-                        # キーがステップごとに変わるようにする
-                        if st.button(f"この色を選ぶ", key=f"test_stage_s{current_step_number}_o{i}"):
-                            st.session_state['test_stage_path'].append(opt['digit'])
-                            safe_rerun()
-            except Exception as e:
-                st.error(f"テスト1の描画エラー: {e}")
-                
-            if current_step_number > 1:
-                if st.button("テストをリセット", key="test_stage_reset_mid"):
-                    st.session_state['test_stage_path'] = [] # パスをリセット
-                    safe_rerun()
+        # 練習用。選択・リセット・完了表示はコンポーネント内で完結し、サーバーには何も返らない
+        try:
+            hierarchical_selector(get_selector_palette(), trial_key=f"test_{st.session_state.get('participant_id')}",
+                                  practice=True, key="test_stage_selector")
+        except Exception as e:
+            st.error(f"テスト1の描画エラー: {e}")
 
     st.markdown("\n")
     st.markdown("\n")
@@ -839,20 +901,31 @@ elif st.session_state.get('page') == 'stage':
         
     else:
         idx = st.session_state['trials_order'][st.session_state['current_trial_index']]
-        audio_name = '(なし)' if idx is None else st.session_state['audio_files'][idx]['name']
+        audio_name = '(なし)' if idx is None else audio_entry(idx)['name']
         st.write(f"**トライアル {st.session_state['current_trial_index']+1} / {len(st.session_state['trials_order'])}**")
         
-        audio_bytes = None
-        if idx is not None:
-            audio_bytes = st.session_state['audio_files'][idx]['data']
-            audio_mime = st.session_state['audio_files'][idx].get('mime','audio/wav')
+        audio_url = None if idx is None else stimulus_url(audio_entry(idx))
+
+        # プレーヤーは再生段階・選択段階とも同じ位置に1つだけ置き、試行中は作り直されないようにする
+        intro = st.container()
+        playback = None
+        if audio_url is not None:
+            if not st.session_state.get('listening_complete'):
+                player_mode = 'once'
+            else:
+                player_mode = 'loop' if st.session_state.get('continuous_play_mode') else 'stop'
+            playback = audio_player(audio_url, mode=player_mode, autoplay=True, token=st.session_state['current_trial_index'], key="stage_player")
+            # 最後まで聞き終えたらプレーヤーから知らせが届くので、そのまま（再実行せずに）色選択を表示する
+            if not st.session_state.get('listening_complete') and listened_to_end(playback, audio_entry(idx)):
+                st.session_state['listening_complete'] = True
 
         if not st.session_state.get('listening_complete'):
-            st.markdown("---")
-            st.subheader(f"トライアル {st.session_state['current_trial_index']+1} の再生")
-            st.info("まず、今回の音刺激を一度最後までお聞きください。\n\n再生が終了したら、下のボタンを押して色選択に進んでください。")
-            render_audio_player(audio_bytes, mime=audio_mime, autoplay=True, loop=False)
-            if st.button("再生が終了したので、色選択に進む"):
+            with intro:
+                st.markdown("---")
+                st.subheader(f"トライアル {st.session_state['current_trial_index']+1} の再生")
+                st.info("まず、今回の音刺激を一度最後までお聞きください。\n\n再生が終了すると、自動で色選択に進みます。")
+            # プレーヤーで再生できない場合だけ、手動で進めるボタンを出す
+            if (audio_url is None or (playback and playback['event'] == 'error')) and st.button("再生が終了したので、色選択に進む"):
                 st.session_state['listening_complete'] = True
                 safe_rerun()
         else:
@@ -867,73 +940,31 @@ elif st.session_state.get('page') == 'stage':
                         st.session_state['continuous_play_mode'] = False; safe_rerun()
                 if st.session_state.get('continuous_play_mode'):
                     st.write("ループ再生中...")
-                    render_audio_player(audio_bytes, mime=audio_mime, autoplay=True, loop=True)
             
-            # st.markdown("---")
-            # st.markdown("### 色選択（8段階）")
-            current_step_number = len(st.session_state.get('current_path', [])) + 1
-            st.write(f"**段階 {current_step_number} / 8**")
-
-
-            if current_step_number == 1:
-                st.info("音に対して想起した色に近い色を6つの色から1つ選んでください。ボタンを押すと次の段階に進みます。")
-                options = [{'digit': d, 'hex': hsl_to_hex(path_to_hsl_separated(st.session_state['current_path'] + [d]))} for d in range(6)]
-                cols = st.columns(6)
-            else:
-                st.info("音に対して想起した色に近い色を3つの色から1つ選んでください。ボタンを押すと次の段階に進みます。")
-                options = [{'digit': d, 'hex': hsl_to_hex(path_to_hsl_separated(st.session_state['current_path'] + [d]))} for d in [0,1,2]]
-                cols = st.columns(3)
-            
-            if st.session_state['step_start_time'] is None:
-                st.session_state['step_start_time'] = time.time()
-            for i, opt in enumerate(options):
-                with cols[i]:
-                    st.markdown(f'<div style="height:140px;border-radius:10px;background:{opt["hex"]};display:flex;align-items:center;justify-content:center;font-weight:bold;color:#000;margin-bottom:8px"></div>', unsafe_allow_html=True)
-                    if st.button(f"この色を選ぶ ", key=f"sel_{st.session_state['current_trial_index']}_{current_step_number}_{i}"):
-                        if st.session_state['step_start_time'] is None: st.session_state['step_start_time'] = time.time()
-                        
-                        rt_ms = int((time.time() - st.session_state['step_start_time'])*1000)
-                        
-                        st.session_state['step_rts'].append(rt_ms)
-                        st.session_state['current_path'].append(opt['digit'])
-                        
-                        st.session_state['step_start_time'] = None
-                        if len(st.session_state['current_path']) >= 8:
-                            final_hsl = path_to_hsl_separated(st.session_state['current_path'])
-                            current_trial_idx = st.session_state['current_trial_index']
-                            reset_count_for_this_trial = st.session_state.get('reset_counts', {}).get(current_trial_idx, 0)
-                            trial_record = {
-                                'participant_id': st.session_state.get('participant_id'), 
-                                'trial': st.session_state['current_trial_index']+1, 'audioName': audio_name,
-                                'path': ''.join(map(lambda d: str(d + 1), st.session_state['current_path'])), 'finalHex': hsl_to_hex(final_hsl),
-                                'finalH': round(final_hsl['H'],2), 'finalS': final_hsl['S'], 'finalL': final_hsl['L'],
-                                'stepRTs_ms': '|'.join(map(str,st.session_state.get('step_rts',[]))), 'totalRT_ms': sum(st.session_state.get('step_rts', [])),
-                                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'practice': False,
-                                'loop_playback_used': st.session_state.get('continuous_play_mode', False),
-                                'reset_count': reset_count_for_this_trial
-                            }
-                            append_result_csv_and_sheet(trial_record)
-                            st.session_state['current_trial_index'] += 1
-                            st.session_state['current_path'] = []
-                            st.session_state['step_rts'] = []
-                            st.session_state['listening_complete'] = False
-                            st.session_state['continuous_play_mode'] = False
-                            time.sleep(0.3)
-                        safe_rerun()
-            
-            st.markdown("\n")
-            st.markdown("\n")
-            if current_step_number > 1:
-                if st.button("このトライアルの選択をリセット", key=f"reset_stage_trial_{st.session_state['current_trial_index']}"):
-                    current_trial_idx = st.session_state['current_trial_index']
-                    current_count = st.session_state.get('reset_counts', {}).get(current_trial_idx, 0)
-                    st.session_state['reset_counts'][current_trial_idx] = current_count + 1
-                    st.session_state['current_path'] = []
-                    st.session_state['step_rts'] = []
-                    st.session_state['step_start_time'] = None
-                    st.warning("このトライアルの選択をリセットしました。段階1からやり直してください。")
-                    time.sleep(1) 
-                    safe_rerun()
+            # 8段階の選択はコンポーネント内で進め、選び終えた時だけ結果が返る（1試行につき再実行1回）
+            current_trial_idx = st.session_state['current_trial_index']
+            result = hierarchical_selector(get_selector_palette(),
+                                           trial_key=f"{st.session_state.get('participant_id')}_{current_trial_idx}",
+                                           key=f"stage_selector_{current_trial_idx}")
+            if result is not None:
+                final_color = node_color(result['path'])
+                st.session_state['reset_counts'][current_trial_idx] = result['resets']
+                trial_record = {
+                    'participant_id': st.session_state.get('participant_id'), 
+                    'trial': current_trial_idx+1, 'audioName': audio_name,
+                    'finalHex': final_color['hex'],
+                    'finalH': round(final_color['H'],2), 'finalS': final_color['S'], 'finalL': final_color['L'],
+                    **stage_columns(result['path'], result['stepRTs']),  # pathCode / stepRTsPacked と派生列 path / stepRTs_ms / totalRT_ms
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'practice': False,
+                    'loop_playback_used': st.session_state.get('continuous_play_mode', False),
+                    'reset_count': result['resets'],
+                    'paletteHash': get_palette_table()['hash']
+                }
+                append_result_csv_and_sheet(trial_record)
+                st.session_state['current_trial_index'] += 1
+                st.session_state['listening_complete'] = False
+                st.session_state['continuous_play_mode'] = False
+                safe_rerun()
 
 # questionnaire (段階的選択の後)
 elif st.session_state.get('page') == 'questionnaire':
@@ -966,20 +997,32 @@ elif st.session_state.get('page') == 'color_picker':
         go_to('post_questionnaire') 
     else:
         cidx = st.session_state['color_trials_order'][st.session_state['color_trial_index']]
-        audio_name = '(なし)' if cidx is None else st.session_state['audio_files'][cidx]['name']
+        audio_name = '(なし)' if cidx is None else audio_entry(cidx)['name']
         st.write(f"**トライアル {st.session_state['color_trial_index']+1} / {len(st.session_state['color_trials_order'])}**")
         
-        audio_bytes = None
-        if cidx is not None:
-            audio_bytes = st.session_state['audio_files'][cidx]['data']
-            audio_mime = st.session_state['audio_files'][cidx].get('mime','audio/wav')
+        audio_url = None if cidx is None else stimulus_url(audio_entry(cidx))
+
+        # プレーヤーは再生段階・選択段階とも同じ位置に1つだけ置き、試行中は作り直されないようにする
+        intro = st.container()
+        playback = None
+        if audio_url is not None:
+            if not st.session_state.get('color_picker_listening_complete'):
+                player_mode = 'once'
+            else:
+                player_mode = 'loop' if st.session_state.get('color_picker_continuous_play') else 'stop'
+            playback = audio_player(audio_url, mode=player_mode, autoplay=True, token=st.session_state['color_trial_index'], key="color_player")
+            # 最後まで聞き終えたらプレーヤーから知らせが届くので、そのまま（再実行せずに）色選択を表示する
+            if not st.session_state.get('color_picker_listening_complete') and listened_to_end(playback, audio_entry(cidx)):
+                st.session_state['color_picker_listening_complete'] = True
+                st.session_state['color_picker_start_time'] = None
 
         if not st.session_state.get('color_picker_listening_complete'):
-            st.markdown("---")
-            st.subheader(f"トライアル {st.session_state['color_trial_index']+1} の再生")
-            st.info("まず、今回の音刺激を一度最後までお聞きください。\n\n再生が終了したら、下のボタンを押して色選択に進んでください。")
-            render_audio_player(audio_bytes, mime=audio_mime, autoplay=True, loop=False)
-            if st.button("再生が終了したので、色選択に進む", key="cp_finish_listening"):
+            with intro:
+                st.markdown("---")
+                st.subheader(f"トライアル {st.session_state['color_trial_index']+1} の再生")
+                st.info("まず、今回の音刺激を一度最後までお聞きください。\n\n再生が終了すると、自動で色選択に進みます。")
+            # プレーヤーで再生できない場合だけ、手動で進めるボタンを出す
+            if (audio_url is None or (playback and playback['event'] == 'error')) and st.button("再生が終了したので、色選択に進む", key="cp_finish_listening"):
                 st.session_state['color_picker_listening_complete'] = True
                 st.session_state['color_picker_start_time'] = None
                 safe_rerun()
@@ -998,7 +1041,6 @@ elif st.session_state.get('page') == 'color_picker':
                 
                 if st.session_state.get('color_picker_continuous_play'):
                     st.write("ループ再生中...")
-                    render_audio_player(audio_bytes, mime=audio_mime, autoplay=True, loop=True)
 
                 
                 picked = st.color_picker(":blue-background[:arrow_down_small: 音に対して想起した色をカラーピッカーから選んでください]", "#808080", key=f"picker_{st.session_state['color_trial_index']}",width="content")
@@ -1008,18 +1050,7 @@ elif st.session_state.get('page') == 'color_picker':
                 st.markdown("\n")
                 if st.button("この色を保存して次へ"):
                     rt_ms = int((time.time() - st.session_state['color_picker_start_time'])*1000)
-                    def hex_to_hsl(hexc):
-                        hexc=hexc.lstrip('#'); r=int(hexc[0:2],16)/255.0; g=int(hexc[2:4],16)/255.0; b=int(hexc[4:6],16)/255.0
-                        maxc,minc=max(r,g,b),min(r,g,b); l=(maxc+minc)/2
-                        if maxc==minc: h=s=0
-                        else:
-                            d=maxc-minc; s=d/(2-maxc-minc) if l>0.5 else d/(maxc+minc)
-                            if maxc==r: h=(g-b)/d+(6 if g<b else 0)
-                            elif maxc==g: h=(b-r)/d+2
-                            else: h=(r-g)/d+4
-                            h=(h*60)%360
-                        return {'H': round(h,2), 'S': round(s*100,2), 'L': round(l*100,2)}
-                    picked_hsl = hex_to_hsl(picked)
+                    picked_hsl = lookup_hsl(get_hsl_lut(), picked)
                     row = {
                         'participant_id': st.session_state.get('participant_id'), # ★★★ participant_id を追加
                         'trial': st.session_state['color_trial_index']+1, 'audioName': audio_name,
@@ -0,0 +1,53 @@
+"""
+段階的な色選択（8段階）をブラウザ内で完結させるカスタムコンポーネント（components/hierarchical_selector/）。
+
+選択木の全ノードの色は、コンパイル済みの色表（static/palettes/<name>.<hash>.json）の URL とハッシュだけを渡し、
+ブラウザが一度だけ取得してハッシュごとに sessionStorage に置く（再実行のたびに色を送り直さない）。
+段階ごとの描画・反応時間の計測・リセットはブラウザ側で行う。サーバーに戻るのは 8 段階を選び終えた時の 1 回だけで、値は
+{'trialKey', 'path'（0 始まりの数字 8 個）, 'stepRTs'（ms）, 'resets', 'resetSteps', 'paletteHash'}。
+練習モード（practice=True）では値を返さず、完了表示と「もう一度テストする」もブラウザ内で行う。
+"""
+from pathlib import Path
+from typing import Dict, Optional
+import streamlit.components.v1 as components
+
+from color_tree import N_STEPS, RADIX
+from palette_compiler import STATIC_URL
+
+_COMPONENT_DIR = Path(__file__).resolve().parent / 'components' / 'hierarchical_selector'
+_selector = components.declare_component('hierarchical_selector', path=str(_COMPONENT_DIR))
+
+
+def selector_palette(table: Dict) -> Dict:
+    """
+    色表（load_palette の戻り値）をコンポーネントに渡す形にする。配信されている色表があればその URL
+    （'paletteUrl'）だけを渡し、なければ（成果物を作っていない場合）葉の HEX を '#' を除いて連結して渡す。
+    """
+    n = len(table['hex'])
+    palette = {
+        'firstRadix': n // RADIX ** (N_STEPS - 1),
+        'radix': RADIX,
+        'steps': N_STEPS,
+        'hash': table.get('hash', ''),
+    }
+    if table.get('json'):
+        palette['paletteUrl'] = f"{STATIC_URL}/{table['json']}"
+    else:
+        palette['colors'] = ''.join(h[1:] for h in table['hex'].tolist())
+    return palette
+
+def hierarchical_selector(palette: Dict, trial_key: str, practice: bool = False,
+                          key: Optional[str] = None) -> Optional[Dict]:
+    """
+    コンポーネントを表示し、trial_key の試行を選び終えていればその結果を返す（それまでは None）。
+    key は試行ごとに変えること（同じ key のままだと前の試行の値が残る）。高さはコンポーネント側で合わせる。
+    """
+    value = _selector(**palette, trialKey=trial_key, practice=practice, key=key, default=None)
+    if not value or value.get('trialKey') != trial_key:
+        return None
+    path = value.get('path') or []
+    first_radix = palette['firstRadix']
+    if (len(path) != N_STEPS or len(value.get('stepRTs') or []) != N_STEPS
+            or not 0 <= path[0] < first_radix or any(not 0 <= d < RADIX for d in path[1:])):
+        raise ValueError(f"段階的選択コンポーネントから不正な値を受け取りました: {value}")
+    return value
@@ -0,0 +1,263 @@
+"""
+Google Sheets への追記を裏のスレッドでまとめて行う書き込みキュー（プロセスに1つ、全セッションで共有）。
+
+ボタンの処理からは enqueue_row / enqueue_rows で行をキューに入れるだけで、API の往復を待たない
+（キューが満杯なら待たずに False を返す。行はローカルの results.db には保存されている）。
+書き込みスレッドは
+  - 最初の行が来てから LINGER_SEC だけ待って届いた行をまとめ、ワークシートごとに append_rows で1回で送る
+  - 429（クォータ）・5xx・通信エラーはジッター付きの指数バックオフで再試行し、それ以外のエラーや
+    再試行の上限に達した行は失敗として数える
+  - result_store.TABLES の表のワークシートでは、送る前に記録のキー（KEY_COLUMNS）を読み、既にシートにある
+    行は送らない（sheets_sync.py と同じ方法）。実験中に sheets_sync.py を実行してセッションが溜めていた
+    行が先に送られていても、失敗した要求がサーバー側では書けていても、同じ行を2回送らない。
+    キーはまとめた1回分の全ワークシートについて values_batch_get の1回で読み、再試行の前には読み直す
+  - キューの長さ・書き込みまでの遅延・件数を writer_metrics で返す（管理画面に表示する）
+"""
+import atexit
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import gspread
+from gspread.utils import rowcol_to_a1
+
+from result_store import TABLES, KEY_COLUMNS
+
+QUEUE_SIZE = 5000
+BATCH_ROWS = 500
+LINGER_SEC = 0.5
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SEC = 1.0
+BACKOFF_MAX_SEC = 32.0
+VALUE_INPUT_OPTION = 'USER_ENTERED'
+
+
+def new_sheet_writer(open_sheet: Callable, queue_size: int = QUEUE_SIZE, batch_rows: int = BATCH_ROWS,
+                     linger: float = LINGER_SEC, check_keys: bool = True) -> Dict:
+    """
+    書き込みキューを作って書き込みスレッドを起動する（sc.py では st.cache_resource で1つだけ作る）。
+    open_sheet はスプレッドシート（gspread.Spreadsheet）を開く関数で、最初に書き込む時に書き込みスレッドで呼ぶ。
+    check_keys=False なら最初の送信の前にはキーを読まない（再試行の前には読む）。
+      'queue'   : (ワークシート名, 行のリスト, キューに入れた時刻) の有限キュー（1要素に複数行を入れられる）
+      'metrics' : writer_metrics が返す値の元（lock で守る）
+    """
+    writer = {
+        'open_sheet': open_sheet, 'sheet': None, 'worksheets': {}, 'check_keys': check_keys,
+        'queue': queue.Queue(maxsize=queue_size), 'batch_rows': batch_rows, 'linger': linger,
+        'lock': threading.Lock(), 'idle': threading.Condition(), 'busy': 0,
+        'metrics': {'enqueued': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'retries': 0, 'batches': 0,
+                    'already_present': 0,
+                    'last_flush_latency_s': None, 'max_flush_latency_s': 0.0,
+                    'last_error': None, 'last_error_at': None},
+    }
+    thread = threading.Thread(target=_run, args=(writer,), name='sheet-writer', daemon=True)
+    writer['thread'] = thread
+    thread.start()
+    atexit.register(flush_sheet_writer, writer, 5.0)
+    return writer
+
+def enqueue_rows(writer: Dict, worksheet: str, rows: List[List]) -> bool:
+    """
+    複数の行をまとめてキューに入れる（同じ append_rows で送られる）。待たずに戻り、
+    キューが満杯なら False（それらの行は Sheets に送られない）。
+    """
+    rows = [list(values) for values in rows]
+    if not rows:
+        return True
+    try:
+        with writer['idle']:
+            writer['queue'].put_nowait((worksheet, rows, time.monotonic()))
+            writer['busy'] += len(rows)
+    except queue.Full:
+        _count(writer, dropped=len(rows))
+        return False
+    _count(writer, enqueued=len(rows))
+    return True
+
+def enqueue_row(writer: Dict, worksheet: str, values: List) -> bool:
+    """1行をキューに入れる（enqueue_rows と同じく待たない）。"""
+    return enqueue_rows(writer, worksheet, [values])
+
+def writer_metrics(writer: Dict) -> Dict:
+    """キューの長さ・件数・書き込みまでの遅延（キューに入れてから append_rows が終わるまで、秒）など。"""
+    with writer['lock']:
+        out = dict(writer['metrics'])
+    out['queue_depth'] = writer['queue'].qsize()
+    out['pending'] = writer['busy']
+    return out
+
+def flush_sheet_writer(writer: Dict, timeout: Optional[float] = None) -> bool:
+    """キューに入れた行がすべて処理される（書けた・諦めた）まで待つ。時間内に終われば True。"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with writer['idle']:
+        while writer['busy']:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            writer['idle'].wait(remaining)
+    return True
+
+
+# ---------- 書き込みスレッド ----------
+def _count(writer: Dict, **increments):
+    with writer['lock']:
+        for key, n in increments.items():
+            writer['metrics'][key] += n
+
+def _record_error(writer: Dict, message: str):
+    with writer['lock']:
+        writer['metrics']['last_error'] = message
+        writer['metrics']['last_error_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+def _run(writer: Dict):
+    q = writer['queue']
+    while True:
+        batch = [q.get()]
+        n_rows = len(batch[0][1])
+        deadline = time.monotonic() + writer['linger']
+        while n_rows < writer['batch_rows']:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+            except queue.Empty:
+                break
+            n_rows += len(batch[-1][1])
+        # ワークシートごとに、キューに入った順のまま1回で送る
+        groups = OrderedDict()
+        for name, rows, queued_at in batch:
+            groups.setdefault(name, []).extend((values, queued_at) for values in rows)
+        present = _present_keys(writer, list(groups)) if writer['check_keys'] else {}
+        for name, items in groups.items():
+            try:
+                _write_batch(writer, name, items, present.get(name))
+            except Exception as e:     # 想定外のエラーでもスレッドは止めない
+                _count(writer, failed=len(items))
+                _record_error(writer, f"{name}: {e!r}")
+        with writer['idle']:
+            writer['busy'] -= n_rows
+            writer['idle'].notify_all()
+
+def retryable_error(error: Exception) -> bool:
+    """再試行すれば通る見込みのあるエラー（429・5xx・通信エラー）か。"""
+    if isinstance(error, gspread.exceptions.APIError):
+        status = getattr(error.response, 'status_code', None) or error.code
+        return status == 429 or (isinstance(status, int) and status >= 500)
+    # requests の ConnectionError / Timeout も OSError の派生
+    return isinstance(error, OSError)
+
+def backoff_delay(attempt: int) -> float:
+    """attempt 回目の失敗のあとに待つ秒数（上限つきの指数バックオフに一様なジッター）。"""
+    return random.uniform(0, min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** attempt))
+
+
+# ---------- シートにある記録のキー（書き込みキューと sheets_sync.py で共通） ----------
+def _key_range(table: str) -> str:
+    """ワークシートのキー列を含む範囲（A 列からキーの最後の列まで、例えば 'results'!A:B）。"""
+    last = max(TABLES[table].index(c) for c in KEY_COLUMNS[table]) + 1
+    col = rowcol_to_a1(1, last).rstrip('0123456789')
+    return "'{}'!A:{}".format(table.replace("'", "''"), col)
+
+def _key(table: str, row) -> Tuple[str, ...]:
+    columns = TABLES[table]
+    row = list(row)
+    return tuple((str(row[i]) if i < len(row) else '').strip()
+                 for i in (columns.index(c) for c in KEY_COLUMNS[table]))
+
+def fetch_sheet_keys(sh: gspread.Spreadsheet, tables: List[str]) -> Dict[str, Set[Tuple[str, ...]]]:
+    """各ワークシートにある記録のキー（1回の values_batch_get で全ワークシート分を読む）。"""
+    if not tables:
+        return {}
+    res = sh.values_batch_get([_key_range(t) for t in tables])
+    out = {}
+    for t, vr in zip(tables, res.get('valueRanges', [])):
+        keys = {_key(t, row) for row in vr.get('values', [])}
+        keys.discard(tuple(KEY_COLUMNS[t]))       # 1行目の列名
+        out[t] = keys
+    return out
+
+def missing_rows(table: str, rows: List, present: Set[Tuple[str, ...]]) -> Tuple[List[list], int]:
+    """シートにないキーの行（元の順）と、rows の中でキーが重なって飛ばした行の数。"""
+    seen = set(present)
+    out, duplicates = [], 0
+    for row in rows:
+        k = _key(table, row)
+        if k in seen:
+            if k not in present:
+                duplicates += 1
+            continue
+        seen.add(k)
+        out.append(list(row))
+    return out, duplicates
+
+def _worksheet(writer: Dict, name: str):
+    wks = writer['worksheets'].get(name)
+    if wks is None:
+        if writer['sheet'] is None:
+            writer['sheet'] = writer['open_sheet']()
+        wks = writer['sheet'].worksheet(name)
+        writer['worksheets'][name] = wks
+    return wks
+
+def _present_keys(writer: Dict, names: List[str]) -> Dict[str, Set[Tuple[str, ...]]]:
+    """
+    names のうち TABLES の表のワークシートにある記録のキー（1回の values_batch_get で読む）。
+    読めなければ空の dict を返し、各ワークシートの _write_batch で読み直させる。
+    """
+    tables = [name for name in names if name in TABLES]
+    if not tables:
+        return {}
+    try:
+        if writer['sheet'] is None:
+            writer['sheet'] = writer['open_sheet']()
+        return fetch_sheet_keys(writer['sheet'], tables)
+    except Exception as e:
+        _record_error(writer, f"values_batch_get: {e!r}")
+        return {}
+
+def _unsent(writer: Dict, name: str, rows: List[list], present: Set[Tuple[str, ...]] = None) -> List[list]:
+    """
+    rows のうちシートにまだない行（キーの決まらないワークシートなら rows のまま）。
+    present（シートにあるキー）がなければシートから読む。
+    """
+    if name not in TABLES:
+        return rows
+    if present is None:
+        present = fetch_sheet_keys(writer['sheet'], [name])[name]
+    left, _ = missing_rows(name, rows, present)
+    if len(left) < len(rows):
+        _count(writer, already_present=len(rows) - len(left))
+    return left
+
+def _write_batch(writer: Dict, name: str, items: List, present: Set[Tuple[str, ...]] = None):
+    rows = [values for values, _ in items]
+    recheck = writer['check_keys']
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            wks = _worksheet(writer, name)
+            if recheck:
+                # sheets_sync.py が先に送った行や、前の要求が応答だけ失われて書けていた行を送り直さない
+                rows = _unsent(writer, name, rows, present)
+                present = None
+                if not rows:
+                    return
+            wks.append_rows(rows, value_input_option=VALUE_INPUT_OPTION)
+        except Exception as e:
+            _record_error(writer, f"{name}: {e!r}")
+            if not retryable_error(e) or attempt == MAX_ATTEMPTS - 1:
+                _count(writer, failed=len(rows))
+                return
+            _count(writer, retries=1)
+            recheck = True
+            time.sleep(backoff_delay(attempt))
+            continue
+        latency = time.monotonic() - items[0][1]
+        with writer['lock']:
+            m = writer['metrics']
+            m['written'] += len(rows)
+            m['batches'] += 1
+            m['last_flush_latency_s'] = latency
+            m['max_flush_latency_s'] = max(m['max_flush_latency_s'], latency)
+        return
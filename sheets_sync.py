@@ -0,0 +1,109 @@
+"""
+results.db の結果を Google Sheets にまとめて送る同期コマンド（何度実行しても同じ行は2回送らない）。
+
+    python sheets_sync.py [--db results.db] [--table results ...] [--secrets .streamlit/secrets.toml]
+                          [--chunk 1000] [--dry-run]
+
+実験中の1行ずつの追記（sheet_writer）の代わりに、定期的に、あるいはセッションの後で実行する。
+書き込みキューも送る前に同じキーを確かめるので、セッションが行を溜めている間に実行しても、
+その行がセッションの区切りで2回送られることはない。
+  1. 各ワークシートの、記録を決める列（result_store.KEY_COLUMNS、例えば participant_id と trial）だけを
+     values_batch_get の1回の呼び出しで全ワークシート分まとめて読む
+  2. データベースの行のうち、そのキーがシートにまだない行を選ぶ（データベース内で同じキーが重なる行は最初の1行）
+  3. ワークシートごとに chunk 行ずつ append_rows で送る。429・5xx・通信エラーは待って再試行するが、
+     失敗した要求がサーバー側では書けていた場合に備え、再試行の前にキーを読み直して送る行を選び直す
+ワークシートがなければ作り、1行目に列名を書く。シートの列の並びは result_store.TABLES の並びとする。
+認証情報と google_sheet_key は Streamlit と同じ secrets.toml から読む（環境変数 FAKE_GSHEETS があれば
+fake_sheets の偽物に送る）。
+"""
+import argparse
+import sys
+import time
+import tomllib
+from pathlib import Path
+from typing import Dict, List
+
+import gspread
+
+import fake_sheets
+from result_store import RESULTS_DB, TABLES, read_rows
+from sheet_writer import (VALUE_INPUT_OPTION, MAX_ATTEMPTS, retryable_error, backoff_delay, fetch_sheet_keys,
+                          missing_rows)
+
+SECRETS_PATH = Path('.streamlit') / 'secrets.toml'
+CHUNK_ROWS = 1000
+
+
+def open_spreadsheet(secrets_path: Path = SECRETS_PATH) -> gspread.Spreadsheet:
+    """secrets.toml の設定でスプレッドシートを開く（環境変数 FAKE_GSHEETS があれば fake_sheets の偽物）。"""
+    fake = fake_sheets.client_from_env()
+    if fake is not None:
+        return fake.open_by_key(fake_sheets.FAKE_SHEET_KEY)
+    with open(secrets_path, 'rb') as f:
+        secrets = tomllib.load(f)
+    client = gspread.service_account_from_dict(dict(secrets['gcp_service_account']))
+    return client.open_by_key(secrets['google_sheet_key'])
+
+def _append_chunk(sh, wks, table: str, chunk: List[list]) -> int:
+    """1回分を送る。再試行の前にはシートのキーを読み直し、既に書けていた行は送らない。送った行数を返す。"""
+    recheck = False
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            if recheck:
+                chunk, _ = missing_rows(table, chunk, fetch_sheet_keys(sh, [table])[table])
+                if not chunk:
+                    return 0
+            wks.append_rows(chunk, value_input_option=VALUE_INPUT_OPTION, table_range='A1')
+            return len(chunk)
+        except Exception as e:
+            if not retryable_error(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+            print(f"  {table}: {e!r}、再試行します", file=sys.stderr)
+            recheck = True
+            time.sleep(backoff_delay(attempt))
+    return 0
+
+def sync(sh: gspread.Spreadsheet, db: Path, tables: List[str], chunk_rows: int = CHUNK_ROWS,
+         dry_run: bool = False) -> Dict[str, Dict]:
+    """データベースの各表のうちシートにない行を送る。表ごとに件数を返す。"""
+    worksheets = {w.title: w for w in sh.worksheets()}
+    created = [t for t in tables if t not in worksheets]
+    if not dry_run:
+        for t in created:
+            worksheets[t] = sh.add_worksheet(title=t, rows=1, cols=len(TABLES[t]))
+            worksheets[t].update([TABLES[t]], 'A1')
+    present = fetch_sheet_keys(sh, [t for t in tables if t not in created])
+    report = {}
+    for table in tables:
+        rows = read_rows(db, table)
+        todo, duplicates = missing_rows(table, rows, present.get(table, set()))
+        pushed = 0
+        if not dry_run:
+            for start in range(0, len(todo), chunk_rows):
+                pushed += _append_chunk(sh, worksheets[table], table, todo[start:start + chunk_rows])
+        report[table] = {'db': len(rows), 'sheet': len(present.get(table, ())), 'missing': len(todo),
+                         'duplicates': duplicates, 'pushed': pushed, 'created': table in created}
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--db', type=Path, default=RESULTS_DB)
+    ap.add_argument('--table', action='append', choices=list(TABLES), help='同期する表（既定はすべて）')
+    ap.add_argument('--secrets', type=Path, default=SECRETS_PATH)
+    ap.add_argument('--chunk', type=int, default=CHUNK_ROWS, help='1回の append_rows で送る行数')
+    ap.add_argument('--dry-run', action='store_true', help='送る行数を数えるだけで書き込まない')
+    args = ap.parse_args()
+    if not args.db.exists():
+        sys.exit(f"{args.db} がありません")
+    t0 = time.perf_counter()
+    report = sync(open_spreadsheet(args.secrets), args.db, args.table or list(TABLES), args.chunk, args.dry_run)
+    for table, r in report.items():
+        result = '送信なし（--dry-run）' if args.dry_run else f"{r['pushed']} 行を送信"
+        print(f"{table}: データベース {r['db']} 行, シート {r['sheet']} 行, 未送信 {r['missing']} 行"
+              f"（重複 {r['duplicates']} 行を除く）→ {result}" + ('、ワークシートを作成' if r['created'] else ''))
+    print(f"{time.perf_counter() - t0:.1f} 秒")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+音刺激の配信。
+
+音声データを static/stimuli/ に内容のハッシュをファイル名にして置き、Streamlit の静的配信
+（.streamlit/config.toml の enableStaticServing）から URL で参照させる。
+data URI と違って再実行のたびに音声が websocket で送られることはなく、
+URL に ?v=<ハッシュ> を付けると Tornado の StaticFileHandler が長期キャッシュ（max-age 10年）の
+ヘッダーを返すので、同じ刺激はブラウザが一度だけダウンロードする。内容が変わればファイル名も変わる。
+Streamlit の静的配信は音声の拡張子に Content-Type を付けない（text/plain + nosniff）ため、
+<source> の type 属性で MIME を明示する。
+
+音声データそのものはプロセス全体で1つのストア（new_stimulus_store）に内容ハッシュごとに持ち、
+各セッションはストアの番号だけを持つ。ストアに render（ingest.stimulus_rendition）を渡した場合は、
+元のデータの代わりにその軽量版を static/stimuli/ に置いて配信する（ハッシュ・目録・サムネイルは元のデータのもの）。
+
+uploads/ の中身は目録（new_stimulus_manifest）に名前・サイズ・更新時刻・ハッシュ・MIME・長さで記録し、
+cache/stimulus_manifest.json に保存する。セッションごとにディレクトリを走査せず目録を見るだけにし、
+管理者のアップロード・削除は目録を1件ずつ更新して版（version）を上げる。
+長さは audio_probe でヘッダーだけから求める（WAV と MP3。その他の形式は None）。
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from audio_probe import probe_duration
+
+STIMULI_DIR = Path('static') / 'stimuli'
+STATIC_URL = 'app/static/stimuli'
+MANIFEST_PATH = Path('cache') / 'stimulus_manifest.json'
+MANIFEST_FORMAT = 2   # 記録の中身を変えたら上げる（古い目録の記録は作り直す）。2: MP3 の長さを追加
+CHECK_SOUND_PREFIX = '_check_sound.'   # 音量チェック用の音（実験の刺激には含めない）
+STIMULUS_CACHE_NAME = 'stimuli-v1'   # ブラウザの Cache Storage での名前（sc.py の先読みと再生で共通）
+_MIME_BY_EXT = {'.wav': 'audio/wav', '.mp3': 'audio/mpeg', '.ogg': 'audio/ogg',
+                '.m4a': 'audio/mp4', '.mp4': 'audio/mp4', '.aac': 'audio/mp4'}
+_EXT_BY_MIME = {'audio/wav': '.wav', 'audio/mpeg': '.mp3', 'audio/ogg': '.ogg', 'audio/mp4': '.m4a'}
+
+
+def audio_mime(name: str) -> str:
+    """ファイル名の拡張子から MIME タイプを決める（不明なら audio/wav）。"""
+    return _MIME_BY_EXT.get(Path(name).suffix.lower(), 'audio/wav')
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+def stimulus_file_name(digest: str, mime: str) -> str:
+    """static/stimuli/ でのファイル名（<ハッシュ><拡張子>）。"""
+    return f"{digest}{_EXT_BY_MIME.get(mime, '.wav')}"
+
+def publish_stimulus(data: bytes, mime: str = 'audio/wav', out_dir: Path = STIMULI_DIR) -> str:
+    """音声データを static/stimuli/<ハッシュ><拡張子> に置き（既にあれば何もしない）、その URL を返す。"""
+    digest = content_hash(data)
+    name = stimulus_file_name(digest, mime)
+    path = Path(out_dir) / name
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 配信中のファイルが書きかけにならないよう、書き終えてから置き換える
+        tmp = path.with_name(f".{name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    return f"{STATIC_URL}/{name}?v={digest}"
+
+
+# ---------- プロセス全体で共有する音刺激ストア ----------
+def new_stimulus_store(render: Optional[Callable] = None) -> Dict:
+    """
+    全セッションで共有する音刺激の置き場（sc.py では st.cache_resource で1つだけ作る）。
+    音声データは内容のハッシュごとに1つだけ読み込み、読み取り専用の memoryview で持つ。
+    各音刺激には登録順の番号を振り、セッションにはその番号だけを持たせる。番号は途中で変わらない。
+    render（(データ, 名前) → (配信するデータ, 情報)）を渡すと、配信するファイルをその結果にする。
+      'entries' : 番号 → {'id','name','safe_name','mime','hash','size','file','url','data','rendition'}
+                  （hash・size・data は元のデータのもの。file は static/stimuli/ での配信するファイルの名前、
+                  url は app/static/ の URL。rendition は render の返した情報で、render がなければ None。
+                  data は evict_stimuli で手放した後は None）
+      'blobs'   : ハッシュ → memoryview
+      'keys'    : (ハッシュ, 名前) → 番号
+      'files'   : パス → ((mtime_ns, size), 番号)（load_stimulus_file が読み直さないための控え）
+      'manifest_version' : 最後に load_manifest_stimuli で合わせた目録の版
+    """
+    return {'entries': [], 'blobs': {}, 'keys': {}, 'files': {}, 'manifest_version': None,
+            'render': render, 'lock': threading.Lock()}
+
+def add_stimulus(store: Dict, data: bytes, name: str, mime: str = None) -> int:
+    """
+    音声データを登録して番号を返す。同じ名前・同じ内容なら既存の番号を返す（evict_stimuli で
+    データを手放した番号なら、データを付け直して同じ番号を返す）。
+    """
+    mime = mime or audio_mime(name)
+    digest = content_hash(data)
+    with store['lock']:
+        key = (digest, name)
+        blob = store['blobs'].get(digest)
+        if blob is None:
+            blob = memoryview(bytes(data)).toreadonly()
+            store['blobs'][digest] = blob
+        if key in store['keys']:
+            sid = store['keys'][key]
+            store['entries'][sid]['data'] = blob
+            return sid
+        served, served_mime, rendition = blob, mime, None
+        if store['render'] is not None:
+            served, rendition = store['render'](bytes(blob), name)
+            if rendition.get('converted'):
+                served_mime = 'audio/wav'
+        sid = len(store['entries'])
+        store['entries'].append({
+            'id': sid, 'name': name, 'safe_name': name, 'mime': served_mime, 'hash': digest,
+            'size': blob.nbytes, 'file': stimulus_file_name(content_hash(served), served_mime),
+            'url': publish_stimulus(served, served_mime), 'data': blob, 'rendition': rendition,
+        })
+        store['keys'][key] = sid
+        return sid
+
+def load_stimulus_file(store: Dict, path: Path, stamp: tuple = None) -> int:
+    """
+    ファイルを登録して番号を返す。前回から更新時刻とサイズが変わっていなければ読み直さない。
+    stamp（(mtime_ns, size)、目録の値）を渡せば stat もしない。
+    """
+    path = Path(path)
+    if stamp is None:
+        info = path.stat()
+        stamp = (info.st_mtime_ns, info.st_size)
+    cached = store['files'].get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    sid = add_stimulus(store, path.read_bytes(), path.name)
+    store['files'][path] = (stamp, sid)
+    return sid
+
+
+# ---------- uploads/ の目録 ----------
+def _file_record(path: Path) -> Dict:
+    data = path.read_bytes()
+    info = path.stat()
+    duration = probe_duration(data, path.name)
+    if duration is not None:
+        duration = round(duration, 3)
+    return {'name': path.name, 'size': info.st_size, 'mtime_ns': info.st_mtime_ns,
+            'hash': content_hash(data), 'mime': audio_mime(path.name), 'duration': duration}
+
+def _save_manifest(manifest: Dict):
+    path = manifest['path']
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps({'format': MANIFEST_FORMAT, 'version': manifest['version'], 'files': manifest['files']},
+                              ensure_ascii=False, indent=1), encoding='utf-8')
+    os.replace(tmp, path)
+
+def new_stimulus_manifest(upload_dir: Path, path: Path = MANIFEST_PATH) -> Dict:
+    """
+    uploads/ の目録を開く（sc.py では st.cache_resource で1つだけ作る）。
+      'version' : 中身が変わるたびに 1 ずつ増える番号（セッションはこれを見て読み直すか決める）
+      'files'   : ファイル名 → {'name','size','mtime_ns','hash','mime','duration'}
+    保存済みの目録を読み込んだあと sync_manifest で一度だけディレクトリと突き合わせる。
+    """
+    manifest = {'dir': Path(upload_dir), 'path': Path(path), 'version': 0, 'files': {},
+                'lock': threading.Lock()}
+    try:
+        saved = json.loads(manifest['path'].read_text(encoding='utf-8'))
+        manifest['version'] = int(saved['version'])
+        if saved.get('format') == MANIFEST_FORMAT:
+            manifest['files'] = dict(saved['files'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    sync_manifest(manifest)
+    return manifest
+
+def sync_manifest(manifest: Dict) -> bool:
+    """
+    ディレクトリを走査して目録を合わせる（起動時と、管理者が手で uploads/ を変えた時だけ使う）。
+    サイズと更新時刻が目録と同じファイルは読まない。変わっていれば版を上げて True を返す。
+    """
+    with manifest['lock']:
+        files = {}
+        for p in sorted(manifest['dir'].iterdir()):
+            if not p.is_file() or p.suffix.lower() not in _MIME_BY_EXT:
+                continue
+            info = p.stat()
+            old = manifest['files'].get(p.name)
+            if old and old['size'] == info.st_size and old['mtime_ns'] == info.st_mtime_ns:
+                files[p.name] = old
+            else:
+                files[p.name] = _file_record(p)
+        changed = files != manifest['files']
+        if changed:
+            manifest['files'] = files
+            manifest['version'] += 1
+        if changed or not manifest['path'].exists():
+            _save_manifest(manifest)
+        return changed
+
+def manifest_add(manifest: Dict, path: Path) -> Dict:
+    """保存したファイルを目録に加える（同じ名前なら置き換える）。版を上げて記録を返す。"""
+    record = _file_record(Path(path))
+    with manifest['lock']:
+        manifest['files'][record['name']] = record
+        manifest['version'] += 1
+        _save_manifest(manifest)
+    return record
+
+def manifest_remove(manifest: Dict, name: str) -> bool:
+    """ファイルを目録から除く。目録になければ何もせず False を返す。"""
+    with manifest['lock']:
+        if manifest['files'].pop(name, None) is None:
+            return False
+        manifest['version'] += 1
+        _save_manifest(manifest)
+        return True
+
+def manifest_stimuli(manifest: Dict) -> List[Dict]:
+    """実験の刺激（チェック用の音を除く）の記録を名前順に返す。"""
+    files = manifest['files']
+    return [files[name] for name in sorted(files) if not name.startswith(CHECK_SOUND_PREFIX)]
+
+def manifest_check_sound(manifest: Dict) -> Optional[Dict]:
+    """音量チェック用の音の記録（なければ None）。"""
+    files = manifest['files']
+    names = sorted(name for name in files if name.startswith(CHECK_SOUND_PREFIX))
+    return files[names[0]] if names else None
+
+def evict_stimuli(store: Dict, keep_hashes) -> int:
+    """
+    keep_hashes にない内容の音声データをストアから手放す。手放したハッシュの数を返す。
+    番号と記録（entries）は残すので、その番号を持つ実験中のセッションは URL（static/stimuli/ の
+    ファイルは消さない）で再生を続けられる。記録に残るのは data 以外の小さな値だけ。
+    """
+    keep = set(keep_hashes)
+    with store['lock']:
+        gone = [digest for digest in store['blobs'] if digest not in keep]
+        if not gone:
+            return 0
+        gone = set(gone)
+        for digest in gone:
+            del store['blobs'][digest]
+        for entry in store['entries']:
+            if entry['hash'] in gone:
+                entry['data'] = None
+        entries = store['entries']
+        store['files'] = {path: cached for path, cached in store['files'].items()
+                          if entries[cached[1]]['hash'] not in gone}
+        return len(gone)
+
+def load_manifest_stimuli(store: Dict, manifest: Dict) -> List[int]:
+    """
+    目録の刺激をストアに登録して番号の一覧を返す（目録のサイズと更新時刻を使い、ファイルを stat しない）。
+    目録の版が前回から変わっていれば、目録にない内容の音声データを evict_stimuli で手放す。
+    """
+    version = manifest['version']
+    sids = [load_stimulus_file(store, manifest['dir'] / r['name'], stamp=(r['mtime_ns'], r['size']))
+            for r in manifest_stimuli(manifest)]
+    if store['manifest_version'] != version:
+        with manifest['lock']:
+            keep = [r['hash'] for r in manifest['files'].values()]
+        evict_stimuli(store, keep)
+        store['manifest_version'] = version
+    return sids
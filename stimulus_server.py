@@ -0,0 +1,82 @@
+"""
+音刺激専用の配信ルート（Streamlit と同じ Tornado サーバーに /stimulus/<ハッシュ><拡張子> を追加する）。
+
+Streamlit の静的配信（app/static/）は Content-Type を text/plain にし（nosniff 付き）、
+Cache-Control も max-age だけで immutable が付かないので、ページを再読み込みすると刺激ごとに再検証が走る。
+ETag はファイル全体の SHA-512 で、If-Range も見ない。
+このルートは static/stimuli/ の同じファイルを次のように返す。
+  - Content-Type    : 拡張子から決めた audio/*
+  - Cache-Control   : public, max-age=1年, immutable（ファイル名が内容のハッシュなので中身は変わらない）
+  - ETag            : ファイル名のハッシュをそのまま使う強い ETag（ファイルを読まずに決まる）
+  - Range / If-Range: 部分取得は Tornado の StaticFileHandler に任せ、If-Range が ETag と違う時は全体を返す
+
+Streamlit には独自のルートを足す公開 API がないので、起動済みの tornado.web.Application を探して
+add_handlers で前に差し込む。見つからない場合（AppTest やサーバーなしの実行）は False を返し、
+呼び出し側は従来の app/static/ の URL を使う。
+"""
+import gc
+import re
+from pathlib import Path
+from typing import Optional
+
+import tornado.web
+
+from stimuli import STIMULI_DIR, audio_mime
+
+ROUTE_URL = 'stimulus'          # ページからの相対 URL の先頭（stimulus/<ハッシュ><拡張子>）
+CACHE_SECONDS = 365 * 24 * 3600
+_NAME_PATTERN = r'([0-9a-f]{16}\.(?:wav|mp3|ogg|m4a))'
+
+
+class StimulusHandler(tornado.web.StaticFileHandler):
+    """static/stimuli/ の内容ハッシュ名のファイルを、音声の Content-Type・immutable・強い ETag で返す。"""
+
+    async def get(self, path: str, include_body: bool = True) -> None:
+        # If-Range の ETag が今のものと違えば Range を無視して全体を返す（RFC 9110 13.1.5）
+        if_range = self.request.headers.get('If-Range')
+        if if_range is not None and 'Range' in self.request.headers and if_range != self._hash_etag(path):
+            del self.request.headers['Range']
+        await super().get(path, include_body)
+
+    @staticmethod
+    def _hash_etag(path: str) -> str:
+        return f'"{Path(path).stem}"'
+
+    def compute_etag(self) -> Optional[str]:
+        return self._hash_etag(self.path)
+
+    def get_content_type(self) -> str:
+        return audio_mime(self.path)
+
+    def get_cache_time(self, path, modified, mime_type) -> int:
+        return CACHE_SECONDS
+
+    def set_extra_headers(self, path: str) -> None:
+        self.set_header('Cache-Control', f'public, max-age={CACHE_SECONDS}, immutable')
+        self.set_header('Access-Control-Allow-Origin', '*')
+
+
+def stimulus_routes(base_url_path: str = '', stimuli_dir: Path = STIMULI_DIR) -> list:
+    """StimulusHandler のルート（tornado.web.Application / add_handlers に渡す形）。"""
+    base = base_url_path.strip('/')
+    prefix = f'/{re.escape(base)}' if base else ''
+    return [(f'{prefix}/{ROUTE_URL}/{_NAME_PATTERN}', StimulusHandler,
+             {'path': str(Path(stimuli_dir).resolve())})]
+
+def mount_stimulus_route() -> bool:
+    """起動中の Streamlit の Tornado アプリにルートを追加する。追加できた（済みの）アプリがあれば True。"""
+    try:
+        from streamlit import config
+        base = config.get_option('server.baseUrlPath') or ''
+    except Exception:
+        base = ''
+    mounted = False
+    for obj in gc.get_objects():
+        if not isinstance(obj, tornado.web.Application):
+            continue
+        if not getattr(obj, '_stimulus_route_mounted', False):
+            # add_handlers のルールは既存の全ホスト用ルール（Streamlit の各ルート）より前に入る
+            obj.add_handlers(r'.*$', stimulus_routes(base))
+            obj._stimulus_route_mounted = True
+        mounted = True
+    return mounted
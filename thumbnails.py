@@ -0,0 +1,105 @@
+"""
+管理画面の音刺激一覧に出す波形サムネイル（PNG）。
+
+アップロード時に作り、内容のハッシュごとに cache/thumbnails/ に置く（一覧では PNG を表示するだけ）。
+  - 復号できる音声（WAV、ffmpeg がある場合の MP3 など）: 上に波形（列ごとの最小・最大）、下にスペクトログラム
+  - 復号できない MP3: audio_probe.mp3_gain_envelope の音量の推移を波形の代わりに描く
+PNG は NumPy の配列を zlib で圧縮して書く（画像ライブラリは使わない）。
+"""
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Optional
+import numpy as np
+
+from acoustic_features import decode_audio
+from audio_probe import mp3_gain_envelope
+
+THUMBNAIL_DIR = Path('cache') / 'thumbnails'
+THUMBNAIL_VERSION = 1
+WIDTH = 320
+WAVE_HEIGHT = 48
+SPEC_HEIGHT = 40
+BACKGROUND = np.array([246, 247, 249], dtype=np.float64)
+FOREGROUND = np.array([255, 75, 75], dtype=np.float64)   # Streamlit の強調色
+SPEC_FLOOR_DB = -80.0
+
+
+def encode_png(rgb: np.ndarray) -> bytes:
+    """(高さ, 幅, 3) の uint8 配列を PNG（8bit RGB、フィルターなし）にする。"""
+    rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+    h, w, _ = rgb.shape
+    raw = np.concatenate([np.zeros((h, 1), dtype=np.uint8), rgb.reshape(h, w * 3)], axis=1).tobytes()
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 9)) + chunk(b'IEND', b''))
+
+def _blend(t: np.ndarray) -> np.ndarray:
+    """0〜1 の値を背景色→強調色の色にする。"""
+    t = np.clip(t, 0, 1)[..., None]
+    return (BACKGROUND * (1 - t) + FOREGROUND * t).round().astype(np.uint8)
+
+def waveform_image(lo: np.ndarray, hi: np.ndarray, height: int = WAVE_HEIGHT) -> np.ndarray:
+    """列ごとの最小値・最大値（-1〜1）から波形の画像を作る。"""
+    rows = np.linspace(1, -1, height)[:, None]
+    return _blend(((rows >= lo[None, :]) & (rows <= hi[None, :])).astype(np.float64))
+
+def _column_extremes(values: np.ndarray, width: int) -> tuple:
+    edges = np.linspace(0, len(values), width + 1).astype(int)
+    edges[1:] = np.maximum(edges[1:], edges[:-1] + 1)
+    edges = np.minimum(edges, len(values))
+    idx = np.minimum(edges[:-1], len(values) - 1)
+    return np.minimum.reduceat(values, idx), np.maximum.reduceat(values, idx)
+
+def spectrogram_image(mono: np.ndarray, rate: int, width: int = WIDTH, height: int = SPEC_HEIGHT) -> np.ndarray:
+    """対数周波数（50Hz〜ナイキスト）のスペクトログラムの画像を作る。"""
+    frame = 1024
+    hop = max(1, (len(mono) - frame) // max(1, width - 1)) if len(mono) > frame else 1
+    starts = np.minimum(np.arange(width) * hop, max(0, len(mono) - frame))
+    padded = np.concatenate([mono, np.zeros(frame, dtype=np.float32)])
+    frames = padded[starts[:, None] + np.arange(frame)[None, :]] * np.hanning(frame)
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    freqs = np.fft.rfftfreq(frame, 1.0 / rate)
+    edges = np.searchsorted(freqs, np.geomspace(50, rate / 2, height + 1))
+    edges = np.minimum(np.maximum(edges, np.arange(height + 1)), len(freqs) - 1)
+    bands = np.maximum.reduceat(power, edges[:-1], axis=1)
+    db = 10 * np.log10(bands + 1e-12)
+    db -= db.max()
+    return _blend((db.T[::-1] - SPEC_FLOOR_DB) / -SPEC_FLOOR_DB)
+
+def render_thumbnail(path: Path) -> Optional[bytes]:
+    """音声ファイルのサムネイル PNG を作る。波形も音量の推移も得られなければ None。"""
+    path = Path(path)
+    decoded = decode_audio(path)
+    if decoded is not None and len(decoded[0]):
+        mono, rate = decoded
+        peak = float(np.max(np.abs(mono))) or 1.0
+        lo, hi = _column_extremes(mono / peak, WIDTH)
+        separator = np.full((1, WIDTH, 3), 255, dtype=np.uint8)
+        return encode_png(np.concatenate([waveform_image(lo, hi), separator, spectrogram_image(mono, rate)]))
+    if path.suffix.lower() == '.mp3':
+        try:
+            amp, _ = mp3_gain_envelope(path.read_bytes())
+        except (ValueError, IndexError):
+            return None
+        _, hi = _column_extremes(amp, WIDTH)
+        return encode_png(waveform_image(-hi, hi))
+    return None
+
+def thumbnail_for(path: Path, digest: str, cache_dir: Path = THUMBNAIL_DIR) -> Optional[Path]:
+    """内容ハッシュ digest のサムネイルのパス（なければ作る）。作れなければ None。"""
+    out = Path(cache_dir) / f"{digest}.v{THUMBNAIL_VERSION}.png"
+    if out.exists():
+        return out
+    png = render_thumbnail(path)
+    if png is None:
+        return None
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f".{out.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(png)
+    os.replace(tmp, out)
+    return out